@@ -0,0 +1,222 @@
+# aio_server.py — asyncio-режим Tandau Server: все соединения в одном event loop
+import asyncio
+import os
+
+import downloads
+import metrics
+import server
+import uploads
+from framing import HEADER, read_frame
+from outbound import AsyncQueuedConnection
+from uploads import UploadError
+
+# Команды, которые читают переписку с диска (ленивый режим) или перебирают историю
+# под блокировкой журнала, идут в пул потоков: одна такая не останавливает
+# остальных клиентов. Ответы conn.send() передаёт в event loop сам.
+OFFLOADED = ('HISTORY:', 'SEARCH:', 'DELETE:')
+
+async def receive_to_file(read_chunk, path, size):
+    """Пишет тело файла во временный *.part; запись на диск — в пуле потоков,
+    чтобы большой файл не останавливал event loop для остальных клиентов"""
+    loop = asyncio.get_running_loop()
+    f, tmp = uploads.open_part(path)
+    try:
+        with f:
+            received = 0
+            while received < size:
+                chunk = await read_chunk(size - received)
+                if not chunk:
+                    break
+                if received + len(chunk) > size:
+                    raise UploadError('клиент прислал больше заявленного размера')
+                await loop.run_in_executor(None, f.write, chunk)
+                received += len(chunk)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    uploads.finish_part(tmp, path, received, size)
+
+async def receive_resumable(reader, upload):
+    """Дописывает загрузку по хешу с upload.offset; диск — в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    while upload.remaining:
+        chunk = await reader.read(min(upload.remaining, uploads.RECV_BUFFER))
+        if not chunk:
+            break
+        await loop.run_in_executor(None, upload.write, chunk)
+    await loop.run_in_executor(None, upload.finish)
+
+async def receive_file(info, reader, conn, user, ip):
+    try:
+        filename, size = uploads.parse_upload_info(info, server.UPLOAD_LIMIT)
+        if server.rate_limit('upload', user, ip, conn):
+            # Тело уже в пути — дочитываем и выбрасываем
+            received = 0
+            while received < size:
+                chunk = await read_frame(reader)
+                if not chunk:
+                    break
+                received += len(chunk)
+            metrics.bytes_in.inc(value=received)
+            return
+        await receive_to_file(lambda left: read_frame(reader), server.media_path(filename), size)
+        metrics.bytes_in.inc(value=size)
+        server.announce(f"FILE:{filename}")
+    except Exception as e:
+        print(f"Ошибка файла: {e}")
+
+async def handle_upload(auth, reader, conn, addr):
+    loop = asyncio.get_running_loop()
+    store = server.content_store
+    upload = None
+    try:
+        user, filename, size, sha = server.parse_upload(auth)
+        wait = server.rate_limit('upload', user, addr[0], conn, notify=False)
+        if wait:
+            conn.send(f"FAIL:слишком много загрузок, повторите через {wait:.0f} с")
+            return
+        if sha and store.has(sha):
+            await loop.run_in_executor(None, store.link, sha, server.media_path(filename))
+            conn.send(b'EXISTS')
+            print(f"[F] {user} переслал {filename} из хранилища ({addr[0]})")
+            server.announce(f"FILE:{filename}")
+            return
+        if sha:
+            # При докачке конструктор перечитывает принятую часть — не в event loop
+            upload = await loop.run_in_executor(None, store.open_upload, sha, size)
+    except (ValueError, OSError) as e:
+        conn.send(f"FAIL:{e}")
+        return
+    try:
+        if upload:
+            conn.send(f"OK:{sha}:{upload.offset}")
+            start = upload.offset
+            try:
+                await receive_resumable(reader, upload)
+            finally:
+                # Тело идёт мимо кадров — в байты от клиентов добавляем сами, и оборванное тоже
+                metrics.bytes_in.inc(value=upload.offset - start)
+            await loop.run_in_executor(None, store.link, sha, server.media_path(filename))
+        else:
+            conn.send(b'OK')
+            await receive_to_file(lambda left: reader.read(min(left, uploads.RECV_BUFFER)),
+                                  server.media_path(filename), size)
+            metrics.bytes_in.inc(value=size)
+    except (UploadError, OSError) as e:
+        print(f"Ошибка загрузки {filename} от {user}: {e}")
+        conn.send(f"FAIL:{e}")
+        return
+    finally:
+        if upload:
+            upload.close()
+    conn.send(b'DONE')
+    print(f"[F] {user} загрузил {filename} ({size} байт, {addr[0]})")
+    server.announce(f"FILE:{filename}")
+
+async def handle_download(request, writer, conn, addr):
+    try:
+        user, filename, spec = server.parse_download(request)
+        f, start, length, total = downloads.open_range(server.media_path(filename), spec)
+    except (ValueError, OSError) as e:
+        conn.send(f"FAIL:{e}")
+        return
+    with f:
+        conn.send(f"OK:{start}:{length}:{total}")
+        await conn.flush()
+        if length:
+            # loop.sendfile() — тот же os.sendfile(), но без блокировки event loop
+            sent = await asyncio.get_running_loop().sendfile(writer.transport, f, start, length)
+            metrics.bytes_out.inc(value=sent)
+    print(f"[D] {user} скачал {filename} [{start}+{length} из {total}] ({addr[0]})")
+
+async def handle_client(reader, writer):
+    addr = writer.get_extra_info('peername')
+    # Обработчики из server.py вызывают conn.send() так же, как у сокета
+    conn = AsyncQueuedConnection(writer, server.SEND_QUEUE_LIMIT, server.OVERFLOW_POLICY)
+    username = None
+    try:
+        conn.send(server.login_prompt())
+        auth = await read_frame(reader)
+        while auth is not None and server.negotiate(auth, conn):
+            auth = await read_frame(reader)
+        if auth is None:
+            return
+        auth = auth.decode('utf-8')
+        metrics.frame_in(metrics.command(auth), len(auth.encode('utf-8')) + HEADER.size)
+        if auth.startswith('UPLOAD:'):
+            await handle_upload(auth, reader, conn, addr)
+            return
+        if auth.startswith('DOWNLOAD:'):
+            await handle_download(auth, writer, conn, addr)
+            return
+        if auth.startswith('RESUME:'):
+            # RESUME: досылает пропущенное — по всем перепискам пользователя
+            username = await asyncio.get_running_loop().run_in_executor(
+                None, server.authenticate, auth, conn, addr)
+        else:
+            username = server.authenticate(auth, conn, addr)
+        if not username:
+            return
+
+        while True:
+            frame = await read_frame(reader)
+            if frame is None or conn.closed: break
+            msg = frame.decode('utf-8')
+            metrics.frame_in(metrics.command(msg), len(frame) + HEADER.size)
+
+            if msg.startswith('FILE:'):
+                await receive_file(msg[5:], reader, conn, username, addr[0])
+            else:
+                await dispatch(msg, username, conn, addr[0])
+
+            # Обратное давление: пока клиент не разобрал свою очередь (в ней эхо
+            # его же сообщений), следующие кадры от него не читаем
+            if len(conn.outbox) >= conn.outbox.limit // 2:
+                await conn.flush()
+            # readexactly() не уступает управление, если данные уже в буфере —
+            # отдаём ход писателям и другим клиентам после каждого кадра
+            await asyncio.sleep(0)
+
+    except Exception as e:
+        print(f"Ошибка клиента {addr}: {e}")
+    finally:
+        if username:
+            server.disconnect(username, conn)
+        conn.close()
+
+async def dispatch(msg, username, conn, ip):
+    """server.dispatch: лимиты — в event loop, медленные команды (OFFLOADED) — в пуле.
+    Следующий кадр клиента читается после ответа — порядок его команд сохраняется."""
+    kind = server.rate_kind(msg)
+    if kind and server.rate_limit(kind, username, ip, conn):
+        return
+    if msg.startswith(OFFLOADED):
+        await asyncio.get_running_loop().run_in_executor(None, server.handle_command, msg, username, conn)
+    else:
+        server.handle_command(msg, username, conn)
+
+def commit_callback(loop):
+    """Доставка после группового коммита без блокировки event loop:
+    писатель журнала будит loop, когда пачка стала долговечной. Пачки
+    подтверждаются по порядку, так что очередь переписки (order) не нужна."""
+    def after_commit(commit, deliver, order, failed):
+        def on_done():
+            if commit.error is None:
+                loop.call_soon_threadsafe(deliver)
+            else:
+                loop.call_soon_threadsafe(failed, commit.error)
+        commit.add_done_callback(on_done)
+    return after_commit
+
+async def run(host, port, reuse_port=False):
+    loop = asyncio.get_running_loop()
+    server.after_commit = commit_callback(loop)
+    # Вход по RESUME: идёт в пуле потоков — таймер присутствия ставится через loop
+    server.presence.call_later = lambda delay, fn: loop.call_soon_threadsafe(loop.call_later, delay, fn)
+    srv = await asyncio.start_server(handle_client, host, port, backlog=4096, reuse_port=reuse_port)
+    print(f"[SERVER] Запущен на {host}:{port} (asyncio)")
+    async with srv:
+        await srv.serve_forever()
+
+def serve(host, port):
+    asyncio.run(run(host, port))
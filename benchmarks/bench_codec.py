@@ -0,0 +1,80 @@
+# bench_codec.py — JSON против bin1 (wire.py): нс на сообщение и байт на сообщение
+#
+# Корпус тот же, что в bench_compression.py. Кодирование — как на сервере
+# (wire.encode), декодирование — как на клиенте (wire.parse: для JSON это
+# decode + json.loads, для bin1 — struct и срезы одного UTF-8 тела).
+# Меряются одиночные кадры MSG: и страницы HISTORY: по --page сообщений.
+#
+#   python benchmarks/bench_codec.py --count 20000
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import wire
+from bench_compression import CORPUS_FILES, load_corpus, synthetic
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        fn()
+        elapsed = time.perf_counter_ns() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def encode_ascii(kind, target, data):
+    """Как кодировал сервер до UTF-8 JSON: json.dumps по умолчанию, кириллица как \\uXXXX"""
+    body = json.dumps(data)
+    if kind == 'PRIVATE':
+        return f"PRIVATE:{target}:{body}"
+    if kind == 'CHANNEL':
+        return f"CHANNEL:{target}:MSG:{body}"
+    return f"{kind}:{body}"
+
+def measure(name, items, n_messages, repeat):
+    """items — [(вид, target, данные)]; печатает строку на каждую кодировку"""
+    variants = [
+        ('json ascii', encode_ascii),
+        ('json', lambda k, t, d: wire.encode(k, t, d, False)),
+        (wire.CODEC, lambda k, t, d: wire.encode(k, t, d, True)),
+    ]
+    print(f"\n{name}: {len(items)} кадров, {n_messages} сообщений")
+    print(f"{'кодировка':>12}{'байт/сообщ':>12}{'encode нс/сообщ':>17}{'decode нс/сообщ':>17}")
+    for label, encode in variants:
+        # Текст в байты переводит encode_frame — это тоже часть кодирования
+        def to_bytes(item, encode=encode):
+            frame = encode(*item)
+            return frame.encode('utf-8') if isinstance(frame, str) else frame
+        frames = [to_bytes(item) for item in items]
+        size = sum(len(f) for f in frames)
+        enc = best_of(repeat, lambda: [to_bytes(item) for item in items])
+        dec = best_of(repeat, lambda: [wire.parse(f) for f in frames])
+        print(f"{label:>12}{size / n_messages:>12.1f}{enc / n_messages:>17.0f}{dec / n_messages:>17.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON против двоичных кадров bin1: скорость и размер')
+    parser.add_argument('--corpus', nargs='*', default=[os.path.join(ROOT, f) for f in CORPUS_FILES])
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--page', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5, help='прогонов, берётся лучший')
+    args = parser.parse_args()
+
+    messages = load_corpus(args.corpus)
+    messages += synthetic(max(0, args.count - len(messages)))
+    # Старые записи без id и с полями вроде image/reply_to тоже в корпусе — они идут через extra
+    print(f"Корпус: {len(messages)} сообщений")
+
+    single = [('MSG', None, m) for m in messages]
+    measure('MSG: по одному', single, len(messages), args.repeat)
+    pages = [('HISTORY', None, {'chat_type': 'public', 'target': None,
+                                'messages': messages[i:i + args.page], 'more': True})
+             for i in range(0, len(messages), args.page)]
+    measure(f'HISTORY: по {args.page}', pages, len(messages), args.repeat)
+
+if __name__ == '__main__':
+    main()
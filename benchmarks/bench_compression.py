@@ -0,0 +1,138 @@
+# bench_compression.py — сколько байт на проводе экономят UTF-8 JSON и сжатие кадров
+#
+# Корпус: сообщения из messages.json, private_messages.json, channel_messages.json
+# (или --corpus) плюс синтетические русские сообщения до --count. Для одиночных
+# кадров MSG: и страниц HISTORY: по --page сообщений считаются байты на проводе
+# (с заголовком кадра) в вариантах:
+#   ascii    — json.dumps по умолчанию, кириллица как \uXXXX (как было);
+#   utf8     — ensure_ascii=False;
+#   zlib     — utf8 + deflate каждого кадра от --threshold байт, без словаря;
+#   zlib1    — utf8 + deflate со словарём compression.DICTIONARY (то, что на проводе).
+#
+#   python benchmarks/bench_compression.py --count 20000 --threshold 256
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import compression
+from framing import HEADER
+
+CORPUS_FILES = ['messages.json', 'private_messages.json', 'channel_messages.json']
+
+PHRASES = [
+    'Привет, как у тебя дела?', 'Нормально, работаю над проектом', 'Скинь, пожалуйста, файл с отчётом',
+    'Во сколько завтра встречаемся?', 'Давай в семь у метро', 'Я уже выехал, буду минут через двадцать',
+    'Посмотри, что я нашёл', 'Отличная идея, поддерживаю', 'Не могу сейчас говорить, перезвоню',
+    'Кто-нибудь знает, почему сервер не отвечает?', 'Обновил приложение, теперь всё работает',
+    'Спасибо большое!', 'Ха-ха, это было смешно', 'Напомни мне вечером про документы',
+    'В канале выложили новое расписание', 'Сегодня созвон переносится на четверг',
+    'У меня вопрос по домашнему заданию', 'Кто идёт на концерт в субботу?',
+    'Проверь личные сообщения', 'Хорошо, договорились', 'Завтра будет дождь, возьми зонт',
+    'Поздравляю с днём рождения!', 'Не забудь купить хлеб', 'Отправил тебе голосовое сообщение',
+]
+
+def load_corpus(paths):
+    messages = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding='utf-8') as f:
+            loaded = json.load(f)
+        # messages.json — список, private_messages.json и channel_messages.json — словари списков
+        for chunk in (loaded.values() if isinstance(loaded, dict) else [loaded]):
+            messages.extend(m for m in chunk if isinstance(m, dict) and 'message' in m)
+    return messages
+
+def synthetic(count, seed=1):
+    rnd = random.Random(seed)
+    users = ['admin', 'Салти', 'Айгерим', 'dmitry', 'Нурлан', 'kate_m', 'Олжас', 'Мария']
+    start = datetime(2025, 10, 1)
+    messages = []
+    for i in range(count):
+        text = ' '.join(rnd.choice(PHRASES) for _ in range(rnd.choice([1, 1, 1, 2, 3])))
+        messages.append({
+            'user': rnd.choice(users),
+            'message': text,
+            'timestamp': (start + timedelta(seconds=i * 37 + rnd.random())).isoformat(),
+            'is_admin': False,
+            'id': str(7380000000000000000 + i * 4194304 * 37)
+        })
+    return messages
+
+def deflate(payload, zdict):
+    c = zlib.compressobj(compression.LEVEL, zlib.DEFLATED, -15, **({'zdict': zdict} if zdict else {}))
+    return compression.MARK + c.compress(payload) + c.flush()
+
+def wire_size(payloads, threshold, zdict=None, compress=True):
+    total = 0
+    for payload in payloads:
+        if compress and len(payload) >= threshold:
+            packed = deflate(payload, zdict)
+            if len(packed) < len(payload):
+                payload = packed
+        total += HEADER.size + len(payload)
+    return total
+
+def frames(messages, page, ensure_ascii):
+    dumps = lambda obj: json.dumps(obj, ensure_ascii=ensure_ascii)
+    single = [f"MSG:{dumps(m)}".encode('utf-8') for m in messages]
+    pages = [f"HISTORY:{dumps({'chat_type': 'public', 'target': None, 'messages': messages[i:i + page], 'more': True})}"
+             .encode('utf-8') for i in range(0, len(messages), page)]
+    return single, pages
+
+def report(name, ascii_frames, utf8_frames, threshold):
+    base = wire_size(ascii_frames, 0, compress=False)
+    rows = [
+        ('ascii', base),
+        ('utf8', wire_size(utf8_frames, 0, compress=False)),
+        ('zlib', wire_size(utf8_frames, threshold)),
+        (compression.CODEC, wire_size(utf8_frames, threshold, compression.DICTIONARY)),
+    ]
+    print(f"\n{name}: {len(ascii_frames)} кадров")
+    print(f"{'вариант':>10}{'байт':>14}{'байт/кадр':>12}{'от ascii':>10}")
+    for label, size in rows:
+        print(f"{label:>10}{size:>14}{size / len(ascii_frames):>12.0f}{size / base:>10.1%}")
+
+def timing(payloads):
+    compression.THRESHOLD = 0
+    start = time.perf_counter()
+    packed = [compression.pack(p) for p in payloads]
+    pack_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for p in packed:
+        compression.unpack(p)
+    unpack_time = time.perf_counter() - start
+    return pack_time / len(payloads) * 1e6, unpack_time / len(payloads) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='байты на проводе: ascii JSON, UTF-8 JSON и сжатие zlib со словарём')
+    parser.add_argument('--corpus', nargs='*', default=[os.path.join(ROOT, f) for f in CORPUS_FILES],
+                        help='JSON-файлы с сообщениями (список или словарь списков)')
+    parser.add_argument('--count', type=int, default=20000, help='дополнить корпус синтетикой до стольких сообщений')
+    parser.add_argument('--page', type=int, default=50, help='сообщений в странице HISTORY:')
+    parser.add_argument('--threshold', type=int, default=compression.THRESHOLD)
+    args = parser.parse_args()
+
+    messages = load_corpus(args.corpus)
+    real = len(messages)
+    messages += synthetic(max(0, args.count - real))
+    print(f"Корпус: {len(messages)} сообщений ({real} из файлов), порог сжатия {args.threshold} байт")
+
+    ascii_single, ascii_pages = frames(messages, args.page, True)
+    utf8_single, utf8_pages = frames(messages, args.page, False)
+    report('MSG: по одному', ascii_single, utf8_single, args.threshold)
+    report(f'HISTORY: по {args.page}', ascii_pages, utf8_pages, args.threshold)
+
+    pack_us, unpack_us = timing(utf8_pages)
+    print(f"\n{compression.CODEC} на страницу HISTORY: сжатие {pack_us:.0f} мкс, распаковка {unpack_us:.0f} мкс")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# bench_connections.py — сравнение threaded и asyncio режимов server.py
+#
+# Запускает сервер в отдельном процессе во временной папке, открывает N
+# соединений (по одному пользователю на соединение), логинит их и меряет:
+#   - время подключения и логина всех клиентов;
+#   - RSS процесса сервера с N простаивающими клиентами;
+#   - задержку доставки одного MSG: до всех N получателей.
+#
+#   python benchmarks/bench_connections.py --counts 1000 10000
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from framing import encode_frame, read_frame
+
+PASSWORD = 'bench'
+
+def prepare_workdir(count):
+    workdir = tempfile.mkdtemp(prefix='tandau_bench_')
+    digest = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    users = {f"u{i}": {'password': digest, 'is_admin': False} for i in range(count)}
+    with open(os.path.join(workdir, 'users.json'), 'w', encoding='utf-8') as f:
+        json.dump(users, f)
+    return workdir
+
+def start_server(mode, port, workdir):
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server.py'), '--mode', mode,
+         '--host', '127.0.0.1', '--port', str(port), '--rate-limit', 'off'],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError('сервер не запустился')
+
+def rss_kb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+async def login(port, name):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    await read_frame(reader)
+    writer.write(encode_frame(f"LOGIN:{name}:{PASSWORD}"))
+    await writer.drain()
+    reply = await read_frame(reader)
+    if reply != b'OK':
+        raise RuntimeError(f'логин {name} не прошёл: {reply!r}')
+    return reader, writer
+
+async def wait_for(reader, marker):
+    while True:
+        frame = await read_frame(reader)
+        if frame is None:
+            raise ConnectionError('сервер закрыл соединение')
+        if marker in frame:
+            return
+
+async def drain_until_quiet(reader):
+    # Выбираем ONLINE:-уведомления, которые накопились за время логина
+    try:
+        while await asyncio.wait_for(read_frame(reader), 0.2) is not None:
+            pass
+    except asyncio.TimeoutError:
+        pass
+
+async def run_case(mode, count, port):
+    workdir = prepare_workdir(count)
+    proc = start_server(mode, port, workdir)
+    try:
+        start = time.perf_counter()
+        conns = []
+        batch = 200
+        for i in range(0, count, batch):
+            conns += await asyncio.gather(*(login(port, f"u{j}") for j in range(i, min(i + batch, count))))
+        connect_time = time.perf_counter() - start
+
+        await asyncio.gather(*(drain_until_quiet(r) for r, _ in conns))
+        rss = rss_kb(proc.pid)
+
+        marker = f"bench-{time.time_ns()}".encode('utf-8')
+        start = time.perf_counter()
+        conns[0][1].write(encode_frame(b'MSG:' + marker))
+        await asyncio.gather(*(wait_for(r, marker) for r, _ in conns))
+        fanout_time = time.perf_counter() - start
+
+        for _, w in conns:
+            w.close()
+        return connect_time, rss, fanout_time
+    finally:
+        proc.kill()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='threaded vs asyncio server.py')
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--modes', nargs='+', default=['threaded', 'asyncio'])
+    parser.add_argument('--port', type=int, default=5600)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    need = max(args.counts) * 2 + 256
+    if soft < need:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(need, hard), hard))
+
+    print(f"{'mode':<10}{'conns':>8}{'login, s':>12}{'RSS, MB':>10}{'fan-out, ms':>14}")
+    for count in args.counts:
+        for mode in args.modes:
+            connect_time, rss, fanout_time = asyncio.run(run_case(mode, count, args.port))
+            print(f"{mode:<10}{count:>8}{connect_time:>12.2f}{rss / 1024:>10.1f}{fanout_time * 1000:>14.1f}")
+            args.port += 1
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# bench_fanout.py — рассылка одного сообщения на N получателей
+#
+# Сравнивает старый путь (json.dumps + encode + кадр на каждого получателя)
+# с новым (server.broadcast / канал: сериализация и кодирование один раз,
+# всем получателям уходит один общий memoryview). Получатели — настоящие
+# исходящие очереди OutboundQueue без сокетов, так что меряется только
+# стоимость самой рассылки.
+#
+#   python benchmarks/bench_fanout.py --recipients 10000
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+from framing import encode_frame, shared_frame
+from outbound import OutboundQueue
+
+class QueueOnlyConnection:
+    def __init__(self):
+        self.outbox = OutboundQueue(limit=10 ** 6)
+
+    def send(self, payload):
+        return self.send_frame(encode_frame(payload))
+
+    def send_frame(self, frame):
+        self.outbox.push(frame)
+        return len(frame)
+
+MSG = {
+    'user': 'Салти',
+    'message': 'Всем привет! Встречаемся сегодня в 19:00 у главного входа.',
+    'timestamp': '2025-10-25T20:33:48.743129',
+    'is_admin': True,
+    'id': '1761406428000'
+}
+
+def per_recipient(conns):
+    # Как было: на каждого получателя свой json.dumps, encode и кадр
+    for conn in conns:
+        conn.send_frame(encode_frame(f"CHANNEL:1:MSG:{json.dumps(MSG)}".encode('utf-8')))
+
+def encode_once(conns):
+    frame = shared_frame(f"CHANNEL:1:MSG:{json.dumps(MSG)}")
+    for conn in conns:
+        conn.send_frame(frame)
+
+def measure(fn, conns, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        for conn in conns:
+            conn.outbox.items.clear()
+        start = time.perf_counter()
+        fn(conns)
+        best = min(best, time.perf_counter() - start)
+    # Сколько байт реально лежит в памяти: общий буфер считается один раз
+    buffers = {id(item): len(item) for conn in conns for item in conn.outbox.items}
+    return best, sum(buffers.values())
+
+def main():
+    parser = argparse.ArgumentParser(description='fan-out одного сообщения')
+    parser.add_argument('--recipients', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    conns = [QueueOnlyConnection() for _ in range(args.recipients)]
+    server.clients.clear()
+    server.clients.update({f"u{i}": conn for i, conn in enumerate(conns)})
+
+    def broadcast(conns):
+        server.broadcast(f"MSG:{json.dumps(MSG)}")
+
+    print(f"{'path':<22}{'fan-out, ms':>12}{'ns/recipient':>14}{'buffer bytes':>14}")
+    for name, fn in [('per-recipient encode', per_recipient),
+                     ('encode-once', encode_once),
+                     ('server.broadcast', broadcast)]:
+        best, distinct = measure(fn, conns, args.rounds)
+        print(f"{name:<22}{best * 1000:>12.2f}{best * 1e9 / len(conns):>14.0f}{distinct:>14}")
+
+if __name__ == '__main__':
+    main()
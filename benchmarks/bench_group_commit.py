@@ -0,0 +1,82 @@
+# bench_group_commit.py — групповой коммит журнала при всплеске трафика
+#
+# T потоков-«отправителей» одновременно пишут по M сообщений и ждут
+# подтверждения каждого, как обработчики server.py. Для каждой политики
+# fsync печатает пропускную способность и сколько write()/fsync() ушло на диск:
+# сначала прямо в журнал (log.append), затем через server.handle_public — все
+# в общий чат, под его блокировкой locks.conversation и с рассылкой, как у
+# threaded-сервера. Второе не должно заметно отставать от первого.
+#
+#   python benchmarks/bench_group_commit.py --threads 64 --messages 200
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+from locks import LockManager
+from message_log import MessageLog, FSYNC_POLICIES
+
+class NullConnection:
+    binary = False
+
+    def send(self, payload):
+        return len(payload)
+
+    def send_frame(self, frame, kind=None):
+        return len(frame)
+
+def run_policy(policy, threads, messages, interval_ms, via_server):
+    workdir = tempfile.mkdtemp(prefix='tandau_wal_')
+    log = MessageLog(os.path.join(workdir, 'message_log'), fsync_policy=policy,
+                     fsync_interval=interval_ms / 1000, checkpoint_every=10 ** 9)
+    log.load()
+    if via_server:
+        server.message_log = log
+        server.locks = LockManager()
+        server.data.update(users={f'u{n}': {'password': '', 'is_admin': False} for n in range(threads)},
+                           channels={})
+        server.clients.clear()
+        server.clients.update({f'u{n}': NullConnection() for n in range(threads)})
+
+    def sender(n):
+        for i in range(messages):
+            if via_server:
+                server.handle_public('Привет, как дела?', f'u{n}')
+                continue
+            msg = {'user': f'u{n}', 'message': 'Привет, как дела?', 'id': f'{n}-{i}'}
+            log.append('messages', None, msg).wait()
+
+    workers = [threading.Thread(target=sender, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    log.close()
+    shutil.rmtree(workdir)
+    return elapsed, log.records, log.writes, log.fsyncs
+
+def main():
+    parser = argparse.ArgumentParser(description='group commit журнала сообщений')
+    parser.add_argument('--threads', type=int, default=64)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--interval-ms', type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{'policy':<10}{'path':<8}{'msg/s':>10}{'records':>10}{'writes':>10}{'fsyncs':>10}{'rec/write':>11}")
+    for policy in FSYNC_POLICIES:
+        for path, via_server in (('log', False), ('server', True)):
+            elapsed, records, writes, fsyncs = run_policy(policy, args.threads, args.messages,
+                                                          args.interval_ms, via_server)
+            print(f"{policy:<10}{path:<8}{records / elapsed:>10.0f}{records:>10}{writes:>10}{fsyncs:>10}"
+                  f"{records / max(writes, 1):>11.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# bench_lock_contention.py — пропускная способность при одной общей блокировке
+# и при блокировках на переписку (locks.py)
+#
+# Вызывает обработчики server.py напрямую (с настоящими locks.conversation и
+# ожиданием коммита): K активных личных переписок, по T потоков-отправителей
+# в каждой, журнал с fsync=always. fsync отправители ждут уже без блокировки,
+# так что в одну пачку группового коммита попадают и разные переписки, и
+# отправители одной; общая блокировка (single) сериализует только запись в
+# журнал и рассылку — разница между столбцами и есть их цена.
+#
+#   python benchmarks/bench_lock_contention.py --conversations 1 2 4 8 16 32
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+from locks import LockManager
+from message_log import MessageLog
+
+class NullConnection:
+    binary = False
+
+    def send(self, payload):
+        return len(payload)
+
+def run_case(conversations, threads, messages, single, fsync):
+    workdir = tempfile.mkdtemp(prefix='tandau_locks_')
+    server.message_log = MessageLog(os.path.join(workdir, 'message_log'),
+                                    fsync_policy=fsync, checkpoint_every=10 ** 9)
+    server.locks = LockManager(single=single)
+    server.data.clear()
+    server.data['users'] = {}
+    server.data['channels'] = {}
+    server.data.update(server.message_log.load())
+    server.clients.clear()
+    for c in range(conversations):
+        for name in (f'a{c}', f'b{c}'):
+            # handle_private отбрасывает сообщения несуществующим пользователям
+            server.data['users'][name] = {'password': '', 'is_admin': False}
+            server.clients[name] = NullConnection()
+
+    def sender(c):
+        for i in range(messages):
+            server.handle_private(f"b{c}:сообщение {i}", f'a{c}')
+
+    workers = [threading.Thread(target=sender, args=(c,))
+               for c in range(conversations) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    server.message_log.close()
+    assert server.message_log.records == len(workers) * messages
+    return len(workers) * messages / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='общая блокировка против блокировок переписок')
+    parser.add_argument('--conversations', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--threads', type=int, default=2, help='отправителей на переписку')
+    parser.add_argument('--messages', type=int, default=100, help='сообщений на отправителя')
+    parser.add_argument('--fsync', default='always')
+    args = parser.parse_args()
+
+    print(f"{'conversations':>14}{'global, msg/s':>16}{'per-conv, msg/s':>18}{'speedup':>10}")
+    for k in args.conversations:
+        single = run_case(k, args.threads, args.messages, True, args.fsync)
+        fine = run_case(k, args.threads, args.messages, False, args.fsync)
+        print(f"{k:>14}{single:>16.0f}{fine:>18.0f}{fine / single:>10.1f}")
+
+if __name__ == '__main__':
+    main()
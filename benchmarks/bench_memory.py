@@ -0,0 +1,103 @@
+# bench_memory.py — память истории сервера: dict на сообщение против records.Message
+#
+# Строит журнал из --count синтетических сообщений (как bench_compression.py:
+# русские фразы, ISO-время, snowflake id), раскладывает их по общему чату,
+# личным перепискам и каналам и проигрывает его двумя способами:
+#   dict    — как было: json.loads записи, сообщение в списке как есть;
+#   records — message_log.apply_record: сообщение упаковано в records.Message.
+# Память считается tracemalloc'ом (только то, что осталось в состоянии), время —
+# на проигрывание журнала (json.loads + упаковка) и на выдачу страниц по --page
+# сообщений (для records — to_dict каждого).
+#
+#   python benchmarks/bench_memory.py --count 1000000
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_compression import synthetic
+from message_log import apply_record, empty_state
+from records import unpack_list
+
+def journal(count, seed=1):
+    """Строки журнала: 60% общий чат, 25% личные, 15% каналы"""
+    rnd = random.Random(seed)
+    users = ['admin', 'Салти', 'Айгерим', 'dmitry', 'Нурлан', 'kate_m', 'Олжас', 'Мария']
+    lines = []
+    for msg in synthetic(count, seed):
+        roll = rnd.random()
+        if roll < 0.6:
+            kind, key = 'messages', None
+        elif roll < 0.85:
+            a, b = sorted(rnd.sample(users, 2))
+            kind, key = 'private', f"{a}_{b}"
+        else:
+            kind, key = 'channel_msgs', str(rnd.randrange(20))
+        lines.append(json.dumps({'op': 'add', 'kind': kind, 'key': key, 'msg': msg}, ensure_ascii=False))
+    return lines
+
+def replay_dicts(lines):
+    state = empty_state()
+    for line in lines:
+        record = json.loads(line)
+        if record['kind'] == 'messages':
+            state['messages'].append(record['msg'])
+        else:
+            state[record['kind']].setdefault(record['key'], []).append(record['msg'])
+    return state
+
+def replay_records(lines):
+    state = empty_state()
+    for line in lines:
+        apply_record(state, json.loads(line))
+    return state
+
+def measure(replay, lines):
+    """(байт в состоянии, секунд на проигрывание, состояние). Память и время —
+    в разных прогонах: под tracemalloc каждое выделение памяти заметно дороже."""
+    gc.collect()
+    tracemalloc.start()
+    state = replay(lines)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del state
+    gc.collect()
+    start = time.perf_counter()
+    state = replay(lines)
+    return size, time.perf_counter() - start, state
+
+def page_ns(messages, page, to_dicts):
+    """нс на сообщение при выдаче страниц с конца общего чата"""
+    pages = min(len(messages) // page, 2000)
+    start = time.perf_counter_ns()
+    for i in range(pages):
+        to_dicts(messages[len(messages) - (i + 1) * page:len(messages) - i * page])
+    return (time.perf_counter_ns() - start) / max(1, pages * page)
+
+def main():
+    parser = argparse.ArgumentParser(description='память истории: dict на сообщение против records.Message')
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--page', type=int, default=50, help='сообщений в странице истории')
+    args = parser.parse_args()
+
+    lines = journal(args.count)
+    payload = sum(len(json.dumps(json.loads(line)['msg'], ensure_ascii=False).encode('utf-8')) for line in lines)
+    print(f"{args.count} сообщений, JSON сообщений {payload / 2 ** 20:.0f} МБ ({payload / args.count:.0f} байт/сообщ)")
+    print(f"{'вариант':>10}{'МБ':>10}{'байт/сообщ':>12}{'от JSON':>10}{'проигрыш, с':>14}{'страница, нс/сообщ':>20}")
+    for label, replay, to_dicts in (('dict', replay_dicts, list), ('records', replay_records, unpack_list)):
+        size, elapsed, state = measure(replay, lines)
+        ns = page_ns(state['messages'], args.page, to_dicts)
+        print(f"{label:>10}{size / 2 ** 20:>10.0f}{size / args.count:>12.0f}{size / payload:>10.1f}"
+              f"{elapsed:>14.1f}{ns:>20.0f}")
+        del state
+
+if __name__ == '__main__':
+    main()
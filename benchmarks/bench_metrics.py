@@ -0,0 +1,96 @@
+# bench_metrics.py — цена метрик (metrics.py) на горячем пути
+#
+# Меряет наносекунды на одно событие для того, что сервер делает на каждый
+# кадр или захват блокировки:
+#   frame_in / frame_out  — счётчики вида и байтов (+ глубина очереди) под одной блокировкой;
+#   command / frame_command — вид кадра из текста и из готового кадра;
+#   observe               — гистограмма (persist_seconds, fanout);
+#   TimedLock             — `with` свободной блокировки с учётом ожидания против голого Lock.
+# С --threads N то же событие frame_out идёт из N потоков одновременно — видно,
+# во что обходится общая блокировка метрик под конкуренцией.
+#
+#   python benchmarks/bench_metrics.py --count 1000000 --threads 8
+import argparse
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import metrics
+from framing import encode_frame
+from locks import TimedLock
+
+def per_event(action, count):
+    """нс на вызов action() (цикл без действия вычитается)"""
+    start = time.perf_counter()
+    for _ in range(count):
+        pass
+    empty = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(count):
+        action()
+    return max(time.perf_counter() - start - empty, 0) / count * 1e9
+
+def plain_lock():
+    lock = threading.Lock()
+    def action():
+        with lock:
+            pass
+    return action
+
+def timed_lock():
+    lock = TimedLock(threading.Lock(), 'bench')
+    def action():
+        with lock:
+            pass
+    return action
+
+def concurrent(threads, count):
+    """нс на frame_out в пересчёте на одно событие, когда пишут threads потоков"""
+    barrier = threading.Barrier(threads + 1)
+    def worker():
+        barrier.wait()
+        for _ in range(count):
+            metrics.frame_out('MSG', 64, 1)
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - start) / (threads * count) * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description='цена метрик на одно событие')
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    text = 'MSG:alice:' + 'x' * 100
+    frame = encode_frame(text.encode('utf-8'))
+    cases = (
+        ('frame_in', lambda: metrics.frame_in('MSG', 64)),
+        ('frame_out', lambda: metrics.frame_out('MSG', 64, 3)),
+        ('command', lambda: metrics.command(text)),
+        ('frame_command', lambda: metrics.frame_command(frame)),
+        ('observe', lambda: metrics.persist_seconds.observe(0.0012)),
+        ('observe (метка)', lambda: metrics.fanout.observe(42, 'messages')),
+        ('Lock', plain_lock()),
+        ('TimedLock', timed_lock()),
+    )
+    print(f"{'событие':>16}{'нс':>8}")
+    for label, action in cases:
+        print(f"{label:>16}{per_event(action, args.count):>8.0f}")
+    if args.threads > 1:
+        ns = concurrent(args.threads, args.count // args.threads)
+        print(f"frame_out из {args.threads} потоков: {ns:.0f} нс на событие")
+    start = time.perf_counter()
+    size = len(metrics.render())
+    print(f"render(): {(time.perf_counter() - start) * 1e3:.2f} мс, {size} байт")
+
+if __name__ == '__main__':
+    main()
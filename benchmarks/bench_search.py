@@ -0,0 +1,135 @@
+# bench_search.py — поиск по истории (search_index.py) на большом корпусе
+#
+# Корпус — --count синтетических сообщений (фразы bench_compression.py плюс по
+# 0–3 слова из словаря --vocabulary «слов» с распределением Ципфа, чтобы были и
+# частые, и редкие термины), разложенных по общему чату, личным и каналам как в
+# bench_memory.py. Меряется:
+#   build  — индекс с нуля по всей истории (первый запуск или потерянный файл);
+#   save   — слияние и запись search.idx;
+#   load   — чтение search.idx при старте (доиндексировать нечего);
+#   запросы — MessageLog.search страницами по --page: задержка первой страницы
+#            (медиана и 99-й перцентиль) и листание вглубь на --depth страниц.
+#
+#   python benchmarks/bench_search.py --count 1000000
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_memory import journal
+from message_log import MessageLog, empty_state
+from search_index import SearchIndex, tokens
+
+SYLLABLES = ['ка', 'ро', 'ми', 'ле', 'на', 'ту', 'зо', 'ви', 'ша', 'бер', 'дан', 'кон', 'сит',
+             'рам', 'жу', 'пле', 'ост', 'гри', 'фа', 'чек']
+ENDINGS = ['', 'а', 'ы', 'ом', 'ами', 'е', 'ой']
+
+def vocabulary(size, rnd):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))))
+    return sorted(words)
+
+def corpus(count, size, seed=1):
+    """Строки журнала с добавленными словами словаря; слово №i встречается ~1/(i+1)"""
+    rnd = random.Random(seed)
+    words = vocabulary(size, rnd)
+    cumulative, total = [], 0
+    for i in range(size):
+        total += 1 / (i + 1)
+        cumulative.append(total)
+    lines = []
+    for line in journal(count, seed):
+        record = json.loads(line)
+        extra = rnd.choices(words, cum_weights=cumulative, k=rnd.choice([0, 1, 2, 3]))
+        record['msg']['message'] += ''.join(f" {w}{rnd.choice(ENDINGS)}" for w in extra)
+        lines.append(record)
+    return lines, words
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+def run_queries(log, queries, page, repeat, depth):
+    print(f"{'запрос':>28}{'кандидатов':>12}{'медиана, мкс':>14}{'p99, мкс':>12}{f'{depth} стр., мс':>14}")
+    for label, text in queries:
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            hits, cursor = log.search(text, limit=page)
+            samples.append((time.perf_counter() - start) * 1e6)
+        start = time.perf_counter()
+        pages, before = 0, None
+        while pages < depth:
+            hits, before = log.search(text, before=before, limit=page)
+            pages += 1
+            if before is None:
+                break
+        deep = (time.perf_counter() - start) * 1000
+        print(f"{label:>28}{candidates(log.search_index, text):>12}{percentile(samples, 0.5):>14.0f}{percentile(samples, 0.99):>12.0f}{deep:>14.1f}")
+
+def candidates(index, text):
+    """Длина самого короткого списка документов среди терминов запроса"""
+    return min((sum(map(len, index.parts(term))) for term in tokens(text)), default=0)
+
+def main():
+    parser = argparse.ArgumentParser(description='поиск по истории: построение, загрузка и задержка запросов')
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--vocabulary', type=int, default=50000, help='слов в синтетическом словаре')
+    parser.add_argument('--page', type=int, default=20, help='попаданий в странице')
+    parser.add_argument('--depth', type=int, default=50, help='сколько страниц листать вглубь')
+    parser.add_argument('--repeat', type=int, default=200, help='повторов каждого запроса')
+    args = parser.parse_args()
+
+    records, words = corpus(args.count, args.vocabulary)
+    directory = tempfile.mkdtemp(prefix='bench_search_')
+    try:
+        # Реплика: состояние журнала без писателя и сегментов
+        log = MessageLog(directory)
+        log.replica = True
+        log.state = empty_state()
+        for record in records:
+            log.apply_locked(record)
+        del records
+        path = os.path.join(directory, 'search.idx')
+
+        index = SearchIndex(path, save_every=float('inf'))
+        start = time.perf_counter()
+        log.enable_search(index)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        index.save()
+        save = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        log.search_index = None
+        index = SearchIndex(path, save_every=float('inf'))
+        start = time.perf_counter()
+        log.enable_search(index)
+        load = time.perf_counter() - start
+        print(f"{args.count} сообщений, терминов {len(index.terms)}, search.idx {size / 2 ** 20:.0f} МБ "
+              f"({size / args.count:.0f} байт/сообщ)")
+        print(f"build {build:.1f} с ({build / args.count * 1e6:.1f} мкс/сообщ), save {save:.1f} с, load {load:.2f} с")
+
+        queries = [
+            ('частое слово', 'привет'),
+            ('форма другого падежа', 'сообщением'),
+            ('два частых (AND)', 'завтра дождь'),
+            ('частое + среднее', f'проект {words[500]}'),
+            ('редкое', words[len(words) // 2]),
+            ('частые без пересечения', 'зонт концерт'),
+            ('нет в индексе', 'абракадабра'),
+        ]
+        run_queries(log, queries, args.page, args.repeat, args.depth)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# bench_startup.py — старт сервера: вся история сразу против ленивой загрузки
+#
+# Раскладывает --count синтетических сообщений (bench_compression.py) по общему
+# чату (--general доля) и --conversations личным перепискам в сегменты
+# message_log/ и открывает журнал двумя способами:
+#   eager — как было: все сегменты читаются при старте;
+#   lazy  — message_log.lazy: при старте только общий чат и опись, переписка —
+#           при первом обращении, в памяти не больше --cache переписок.
+# Меряется время load(), память состояния после него (tracemalloc, отдельным
+# прогоном) и для lazy — первая страница холодной переписки (чтение с диска)
+# и повторная (из памяти), а также память после обхода --touch случайных
+# переписок (LRU держит её в пределах --cache).
+#
+#   python benchmarks/bench_startup.py --count 1000000 --conversations 20000
+import argparse
+import gc
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_compression import synthetic
+from message_log import MessageLog
+from records import pack
+from segments import SegmentStore
+
+def build(directory, count, conversations, general):
+    """Сегменты и опись, как после контрольной точки; журнал пуст"""
+    rnd = random.Random(1)
+    store = SegmentStore(directory)
+    for msg in synthetic(count):
+        if rnd.random() < general:
+            conv = ('messages', None)
+        else:
+            conv = ('private', f"u{rnd.randrange(conversations):06d}_v")
+        store.added(conv, pack(msg))
+    store.flush(store.take(), 1, threading.Lock())
+    return sorted(conv for conv in store.conversations if conv[0] != 'messages')
+
+def open_log(directory, lazy, cache):
+    log = MessageLog(directory)
+    log.lazy = lazy
+    log.cache_size = cache
+    log.compact_interval = 3600
+    return log
+
+def measure(directory, lazy, cache):
+    """(секунд на load(), байт в памяти после него)"""
+    gc.collect()
+    tracemalloc.start()
+    log = open_log(directory, lazy, cache)
+    log.load()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    log.close()
+    del log
+    gc.collect()
+    log = open_log(directory, lazy, cache)
+    start = time.perf_counter()
+    log.load()
+    elapsed = time.perf_counter() - start
+    log.close()
+    return elapsed, size
+
+def first_pages(directory, cache, convs, touch):
+    """мкс на первую (холодную) и повторную страницу, байт после обхода touch переписок"""
+    log = open_log(directory, True, cache)
+    log.load()
+    rnd = random.Random(2)
+    cold, warm = [], []
+    for conv in rnd.sample(convs, min(touch, len(convs))):
+        start = time.perf_counter()
+        log.page(*conv)
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        log.page(*conv)
+        warm.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    probe = open_log(directory, True, cache)
+    probe.load()
+    for conv in rnd.sample(convs, min(touch, len(convs))):
+        probe.page(*conv)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    log.close()
+    probe.close()
+    return statistics.median(cold) * 1e6, statistics.median(warm) * 1e6, size, len(probe.resident)
+
+def main():
+    parser = argparse.ArgumentParser(description='старт сервера: вся история против ленивой загрузки')
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--conversations', type=int, default=20000, help='личных переписок')
+    parser.add_argument('--general', type=float, default=0.2, help='доля сообщений в общем чате')
+    parser.add_argument('--cache', type=int, default=1000, help='переписок в памяти (lazy)')
+    parser.add_argument('--touch', type=int, default=2000, help='сколько переписок открыть после старта')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='bench_startup_')
+    directory = os.path.join(tmp, 'message_log')
+    try:
+        convs = build(directory, args.count, args.conversations, args.general)
+        print(f"{args.count} сообщений, {len(convs)} личных переписок, в памяти (lazy) до {args.cache}")
+        print(f"{'вариант':>8}{'load, с':>10}{'МБ после load':>16}")
+        for label, lazy in (('eager', False), ('lazy', True)):
+            elapsed, size = measure(directory, lazy, args.cache)
+            print(f"{label:>8}{elapsed:>10.2f}{size / 2 ** 20:>16.1f}")
+        cold, warm, size, resident = first_pages(directory, args.cache, convs, args.touch)
+        print(f"lazy: первая страница переписки {cold:.0f} мкс, повторная {warm:.0f} мкс; "
+              f"после {args.touch} переписок в памяти {resident}, {size / 2 ** 20:.1f} МБ")
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
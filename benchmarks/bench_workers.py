@@ -0,0 +1,141 @@
+# bench_workers.py — пропускная способность server.py в зависимости от --workers
+#
+# Запускает сервер во временной папке (1 — обычный процесс, N > 1 — cluster.py
+# с N воркерами на одном порту) и гоняет личные сообщения между парами
+# пользователей. Нагрузку дают несколько процессов-клиентов, чтобы не упереться
+# в GIL самого бенчмарка. Отправитель держит в полёте не больше --window
+# сообщений; меряется, сколько сообщений в секунду доходит до получателей.
+# Масштабирование видно только на машине с несколькими ядрами.
+#
+#   python benchmarks/bench_workers.py --workers 1 2 4 --pairs 200 --messages 500
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from framing import encode_frame, read_frame
+
+PASSWORD = 'bench'
+
+def prepare_workdir(count):
+    workdir = tempfile.mkdtemp(prefix='tandau_bench_')
+    digest = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    users = {f"u{i}": {'password': digest, 'is_admin': False} for i in range(count)}
+    with open(os.path.join(workdir, 'users.json'), 'w', encoding='utf-8') as f:
+        json.dump(users, f)
+    return workdir
+
+def start_server(workers, mode, port, workdir):
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server.py'), '--mode', mode, '--fsync', 'os',
+         '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers),
+         '--node-id', '0', '--rate-limit', 'off'],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            # Воркеры поднимаются не одновременно — даём остальным занять порт
+            time.sleep(0.5)
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError('сервер не запустился')
+
+async def login(port, name):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    await read_frame(reader)
+    writer.write(encode_frame(f"LOGIN:{name}:{PASSWORD}"))
+    await writer.drain()
+    if await read_frame(reader) != b'OK':
+        raise RuntimeError(f'логин {name} не прошёл')
+    return reader, writer
+
+async def count_private(reader, n):
+    while n:
+        frame = await read_frame(reader)
+        if frame is None:
+            raise ConnectionError('сервер закрыл соединение')
+        if frame.startswith(b'PRIVATE:'):
+            n -= 1
+
+async def pump(sender, recipient, name, messages, window):
+    (rs, ws), (rr, _) = sender, recipient
+    delivered = asyncio.create_task(count_private(rr, messages))
+    sent = 0
+    while sent < messages:
+        n = min(window, messages - sent)
+        ws.write(b''.join(encode_frame(f"PRIVATE:{name}:m{sent + i}") for i in range(n)))
+        await ws.drain()
+        # Отправитель тоже получает свою копию — ждём её, прежде чем слать дальше
+        await count_private(rs, n)
+        sent += n
+    await delivered
+
+async def drive(port, pairs, messages, window, barrier):
+    conns = []
+    for a, b in pairs:
+        conns.append((await login(port, a), await login(port, b), b))
+    await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+    start = time.perf_counter()
+    await asyncio.gather(*(pump(s, r, name, messages, window) for s, r, name in conns))
+    return start, time.perf_counter()
+
+def client_process(port, pairs, messages, window, barrier, results):
+    results.put(asyncio.run(drive(port, pairs, messages, window, barrier)))
+
+def run_case(workers, args, port):
+    workdir = prepare_workdir(args.pairs * 2)
+    proc = start_server(workers, args.mode, port, workdir)
+    try:
+        pairs = [(f"u{2 * i}", f"u{2 * i + 1}") for i in range(args.pairs)]
+        barrier = multiprocessing.Barrier(args.client_procs)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=client_process,
+                                         args=(port, pairs[i::args.client_procs], args.messages,
+                                               args.window, barrier, results))
+                 for i in range(args.client_procs)]
+        for p in procs:
+            p.start()
+        spans = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+        elapsed = max(end for _, end in spans) - min(start for start, _ in spans)
+        return args.pairs * args.messages / elapsed
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='msgs/sec server.py в зависимости от числа воркеров')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--mode', choices=['threaded', 'asyncio'], default='asyncio')
+    parser.add_argument('--pairs', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=500, help='сообщений от каждого отправителя')
+    parser.add_argument('--window', type=int, default=50)
+    parser.add_argument('--client-procs', type=int, default=4)
+    parser.add_argument('--port', type=int, default=5650)
+    args = parser.parse_args()
+
+    print(f"CPU: {os.cpu_count()}, режим: {args.mode}")
+    print(f"{'workers':>8}{'msgs/sec':>12}{'speedup':>10}")
+    base = None
+    for workers in args.workers:
+        rate = run_case(workers, args, args.port)
+        base = base or rate
+        print(f"{workers:>8}{rate:>12.0f}{rate / base:>10.2f}")
+        args.port += 1
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,7 @@ source.dir = .
 source.include_exts = py,png,jpg,kv,atlas,json,ttf
 
 version = 1.0
-requirements = python3,kivy,openssl
+requirements = python3,kivy,openssl,sqlite3
 
 [buildozer]
 log_level = 2
@@ -0,0 +1,66 @@
+# channel_index.py — индекс подписок на каналы
+#
+# В channels.json подписчики хранятся списком, и раньше каждое сообщение
+# канала проходило по всему списку с проверкой `sub in clients`. Индекс
+# держит в памяти:
+#   subscribers[cid]   — множество подписчиков канала;
+#   user_channels[user] — обратная карта: каналы пользователя;
+#   online[cid]        — подписчики канала, которые сейчас подключены.
+# online обновляется инкрементально при входе/выходе пользователя и при
+# подписке/отписке, так что рассылка касается только подключённых.
+# Потокобезопасность — на вызывающем (server.py держит locks.channels).
+
+class ChannelIndex:
+    def __init__(self):
+        self.subscribers = {}
+        self.user_channels = {}
+        self.online = {}
+        self.online_users = set()
+
+    def load(self, channels):
+        """Строит индекс из data['channels'] (формат channels.json)"""
+        self.subscribers.clear()
+        self.user_channels.clear()
+        self.online.clear()
+        for cid, channel in channels.items():
+            self.subscribers[cid] = set()
+            self.online[cid] = set()
+            for user in channel.get('subscribers', []):
+                self.subscribe(cid, user)
+
+    def subscribe(self, cid, user):
+        """Подписывает пользователя. False — он уже был подписан."""
+        subs = self.subscribers.setdefault(cid, set())
+        if user in subs:
+            return False
+        subs.add(user)
+        self.user_channels.setdefault(user, set()).add(cid)
+        if user in self.online_users:
+            self.online.setdefault(cid, set()).add(user)
+        return True
+
+    def unsubscribe(self, cid, user):
+        """Отписывает пользователя. False — он не был подписан."""
+        subs = self.subscribers.get(cid)
+        if not subs or user not in subs:
+            return False
+        subs.discard(user)
+        self.user_channels.get(user, set()).discard(cid)
+        self.online.get(cid, set()).discard(user)
+        return True
+
+    def is_subscribed(self, cid, user):
+        return user in self.subscribers.get(cid, ())
+
+    def user_online(self, user):
+        self.online_users.add(user)
+        for cid in self.user_channels.get(user, ()):
+            self.online.setdefault(cid, set()).add(user)
+
+    def user_offline(self, user):
+        self.online_users.discard(user)
+        for cid in self.user_channels.get(user, ()):
+            self.online.get(cid, set()).discard(user)
+
+    def online_subscribers(self, cid):
+        return self.online.get(cid, set())
@@ -3,6 +3,10 @@ import threading
 import json
 from datetime import datetime
 
+import compression
+import wire
+from framing import FramedSocket
+
 class ChatClient:
     def __init__(self, host='localhost', port=5555):
         self.host = host
@@ -11,6 +15,9 @@ class ChatClient:
         self.connected = False
         self.current_user = None
         self.is_admin = False
+        # Имя из LOGIN:, пока сервер не ответил OK / FAIL; токен для RESUME:
+        self.pending_user = None
+        self.session_token = None
         
         # Колбэки для обновления UI
         self.on_message_received = None
@@ -21,8 +28,13 @@ class ChatClient:
     def connect(self):
         """Подключается к серверу"""
         try:
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.connect((self.host, self.port))
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.connect((self.host, self.port))
+            self.client_socket = FramedSocket(sock)
+            # Приглашение LOGIN[:кодеки] — соглашаемся на сжатие и двоичные кадры, если предложены
+            welcome = self.client_socket.recv_frame()
+            compression.accept(self.client_socket, welcome)
+            wire.accept(self.client_socket, welcome)
             self.connected = True
             
             # Запускаем поток для прослушивания сообщений
@@ -55,11 +67,40 @@ class ChatClient:
         """Прослушивает сообщения от сервера"""
         while self.connected:
             try:
-                data = self.client_socket.recv(4096).decode('utf-8')
-                if not data:
+                frame = self.client_socket.recv_frame()
+                if frame is None:
                     break
                 
-                message_data = json.loads(data)
+                parsed = wire.parse(frame)
+                if parsed:
+                    # MSG:/PRIVATE:/CHANNEL:/HISTORY: — текстом или bin1, разбор один
+                    self.handle_server_message(self.chat_message_data(*parsed))
+                    continue
+                text = frame.decode('utf-8')
+                if text in ('OK', 'FAIL') and self.pending_user:
+                    # Ответ на LOGIN: — сервер отвечает голым OK / FAIL
+                    message_data = {'type': 'login_response', 'success': text == 'OK',
+                                    'user': self.pending_user}
+                    self.pending_user = None
+                elif text.startswith('SESSION:'):
+                    self.session_token = text[8:]
+                    continue
+                elif text.startswith('PRESENCE:'):
+                    # Пачка входов и выходов за последние ~250 мс
+                    message_data = json.loads(text[9:])
+                    message_data['type'] = 'presence'
+                elif text.startswith('DELETED:'):
+                    message_data = dict(json.loads(text[8:]), type='message_deleted')
+                elif text.startswith('CLEARED:'):
+                    message_data = dict(json.loads(text[8:]), type='history_cleared')
+                elif text.startswith('SEARCH:'):
+                    message_data = dict(json.loads(text[7:]), type='search_results')
+                elif text.startswith('THROTTLED:'):
+                    # Сервер отбрасывает сообщения сверх лимита частоты (см. ratelimit.py)
+                    kind, retry_ms = text[10:].split(':')
+                    message_data = {'type': 'throttled', 'kind': kind, 'retry_ms': int(retry_ms)}
+                else:
+                    message_data = json.loads(text)
                 self.handle_server_message(message_data)
                 
             except Exception as e:
@@ -71,6 +112,14 @@ class ChatClient:
         if self.on_connection_status_changed:
             self.on_connection_status_changed(False)
     
+    def chat_message_data(self, kind, target, data):
+        """(вид, target, данные) из wire.parse → словарь для handle_server_message"""
+        if kind == 'HISTORY':
+            # Страница истории с сервера — тот же колбэк, что и полная загрузка
+            return dict(data, type='messages_data')
+        chat_type = {'MSG': 'public', 'PRIVATE': 'private', 'CHANNEL': 'channel'}[kind]
+        return dict(data, type='new_message', chat_type=chat_type, target=target)
+    
     def handle_server_message(self, message_data):
         """Обрабатывает сообщения от сервера"""
         message_type = message_data.get('type')
@@ -79,6 +128,8 @@ class ChatClient:
             if message_data.get('success'):
                 self.current_user = message_data.get('user')
                 self.is_admin = message_data.get('is_admin', False)
+            if self.on_message_received:
+                self.on_message_received(message_data)
             
         elif message_type == 'new_message':
             if self.on_message_received:
@@ -106,9 +157,26 @@ class ChatClient:
         elif message_type == 'user_offline':
             print(f"Пользователь {message_data.get('user')} вышел из сети")
         
-        elif message_type == 'message_deleted':
-            # Обработка удаления сообщения
-            pass
+        elif message_type == 'throttled':
+            print(f"Слишком часто ({message_data['kind']}), повторите через {message_data['retry_ms']} мс")
+        
+        elif message_type == 'presence':
+            for user in message_data.get('online', []):
+                print(f"Пользователь {user} в сети")
+            for user in message_data.get('offline', []):
+                print(f"Пользователь {user} вышел из сети")
+        
+        elif message_type == 'search_results':
+            if message_data.get('error'):
+                print(f"Ошибка от сервера: {message_data['error']}")
+            elif self.on_message_received:
+                self.on_message_received(message_data)
+        
+        elif message_type in ('message_deleted', 'history_cleared'):
+            if message_data.get('error'):
+                print(f"Ошибка от сервера: {message_data['error']}")
+            elif self.on_message_received:
+                self.on_message_received(message_data)
         
         elif message_type == 'error':
             print(f"Ошибка от сервера: {message_data.get('error')}")
@@ -126,13 +194,9 @@ class ChatClient:
             return False
     
     def login(self, username, password):
-        """Вход в систему"""
-        message = {
-            'type': 'login',
-            'username': username,
-            'password': password
-        }
-        return self.send_message(message)
+        """Вход в систему: LOGIN:<user>:<password>. Ответ приходит как login_response."""
+        self.pending_user = username
+        return self.send_text(f"LOGIN:{username}:{password}")
     
     def register(self, username, password):
         """Регистрация нового пользователя"""
@@ -144,26 +208,52 @@ class ChatClient:
         return self.send_message(message)
     
     def send_chat_message(self, chat_type, message_text, target=None, image=None, video=None, voice=None):
-        """Отправляет сообщение в чат"""
-        message = {
-            'type': 'send_message',
+        """Отправляет сообщение в чат: MSG:, PRIVATE:<кому>: или CHANNEL:<id>:MSG:.
+        Вложения идут отдельной загрузкой (uploads.py), здесь — только текст."""
+        if chat_type == 'private':
+            return self.send_text(f"PRIVATE:{target}:{message_text}")
+        if chat_type == 'channel':
+            return self.send_text(f"CHANNEL:{target}:MSG:{message_text}")
+        return self.send_text(f"MSG:{message_text}")
+    
+    def load_messages(self, chat_type, target=None, before=None, limit=50):
+        """Загружает страницу истории: limit сообщений перед before (id),
+        без before — последние. Ответ приходит как messages_data с полем more."""
+        query = {
             'chat_type': chat_type,
-            'message': message_text,
             'target': target,
-            'image': image,
-            'video': video,
-            'voice': voice
+            'limit': limit
         }
-        return self.send_message(message)
+        if before is not None:
+            query['before'] = before
+        return self.send_command('HISTORY', query)
     
-    def load_messages(self, chat_type, target=None):
-        """Загружает сообщения"""
-        message = {
-            'type': 'load_messages',
-            'chat_type': chat_type,
-            'target': target
-        }
-        return self.send_message(message)
+    def send_command(self, command, query):
+        """Отправляет команду вида HISTORY:{json}"""
+        return self.send_text(f"{command}:{json.dumps(query)}")
+    
+    def send_text(self, text):
+        """Отправляет один текстовый кадр протокола"""
+        if not self.connected:
+            return False
+        try:
+            self.client_socket.send(text.encode('utf-8'))
+            return True
+        except Exception as e:
+            print(f"Ошибка отправки сообщения: {e}")
+            return False
+    
+    def search(self, text, chat_type=None, target=None, before=None, limit=50):
+        """Ищет сообщения со всеми словами text (без chat_type — во всех доступных
+        переписках). Ответ — search_results: hits от новых к старым и next —
+        before для следующей страницы."""
+        query = {'query': text, 'limit': limit}
+        if chat_type:
+            query['chat_type'] = chat_type
+            query['target'] = target
+        if before is not None:
+            query['before'] = before
+        return self.send_command('SEARCH', query)
     
     def create_channel(self, name, description, is_public=True, subscribers_can_write=True):
         """Создает новый канал"""
@@ -199,11 +289,10 @@ class ChatClient:
         return self.send_message(message)
     
     def delete_message(self, message_id, chat_type, target=None):
-        """Удаляет сообщение"""
-        message = {
-            'type': 'delete_message',
-            'message_id': message_id,
-            'chat_type': chat_type,
-            'target': target
-        }
-        return self.send_message(message)
\ No newline at end of file
+        """Удаляет сообщение (своё; администратор — любое).
+        Ответ приходит как message_deleted, при ошибке — с полем error."""
+        return self.send_command('DELETE', {'chat_type': chat_type, 'target': target, 'id': message_id})
+    
+    def clear_history(self, chat_type, target=None):
+        """Очищает общий чат или канал (только администратор). Ответ — history_cleared."""
+        return self.send_command('CLEAR', {'chat_type': chat_type, 'target': target})
\ No newline at end of file
@@ -0,0 +1,263 @@
+# cluster.py — режим нескольких процессов: server.py --workers N
+#
+# Один процесс Python упирается в GIL и занимает одно ядро. С --workers N
+# главный процесс запускает N воркеров — копий server.py, которые слушают
+# один и тот же порт с SO_REUSEPORT (входящие соединения раскидывает ядро), —
+# а сам становится хабом шины на Unix-сокете:
+#
+#   воркер → хаб    {"op": "add", "kind", "key", "msg"}         новое сообщение
+#                   {"op": "delete", "kind", "key", "id", "by"} сообщение удалено
+#                   {"op": "clear", "kind", "key", "by"}        переписка очищена
+#                   {"op": "announce", "text"}                  FILE:
+#                   {"op": "channel", "cid", "action", "user"}  подписка изменилась
+#                   {"op": "presence", "user", "online"}        вход / выход на воркере
+#   хаб → воркеры   те же события, кроме presence; add / delete / clear — только
+#                   после коммита в журнал; входы и выходы — как announce с
+#                   PRESENCE: (или ONLINE:/OFFLINE:)
+#                   {"op": "expire", "kind", "key", "count"}    срок хранения убрал
+#                                                               count старых сообщений
+#                   {"op": "unsaved", "record", "user", "error"} запись не легла в
+#                                                               журнал — ответ отправителю
+#
+# Журнал и channels.json пишет только хаб, поэтому порядок сообщений один на
+# всех. Каждый воркер держит реплику истории (для HISTORY: и RESUME:) и,
+# получив событие, доставляет его своим клиентам — сообщение доходит до
+# получателя, на каком бы воркере тот ни был подключён.
+#
+# Присутствие тоже считает хаб: пользователь может уйти с одного воркера и
+# вернуться через другой, а события от двух воркеров приходят в любом порядке.
+# В сети тот, кто подключён хотя бы к одному воркеру; рассылает изменения
+# агрегатор хаба (presence.py), так что порядок ONLINE/OFFLINE один на всех.
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+import server
+from framing import shared_frame
+from outbound import QueuedConnection
+
+BUS_PATH = 'tandau-bus.sock'
+# События шины терять нельзя (реплики разойдутся): очередь большая,
+# а при переполнении соединение рвётся целиком
+BUS_QUEUE = 1 << 20
+
+def bus_connection(sock):
+    return QueuedConnection(sock, BUS_QUEUE, 'disconnect')
+
+def encode_event(event):
+    return json.dumps(event, ensure_ascii=False).encode('utf-8')
+
+class Hub:
+    """Главный процесс: журнал, channels.json и рассылка событий всем воркерам"""
+    def __init__(self, path=BUS_PATH):
+        self.path = path
+        self.workers = []
+        self.lock = threading.Lock()
+        # пользователь → воркеры, к которым он подключён
+        self.online = {}
+        self.presence_lock = threading.Lock()
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.listen()
+        threading.Thread(target=self.accept_loop, args=(sock,), daemon=True).start()
+
+    def accept_loop(self, sock):
+        while True:
+            conn = bus_connection(sock.accept()[0])
+            with self.lock:
+                self.workers.append(conn)
+            threading.Thread(target=self.worker_loop, args=(conn,), daemon=True).start()
+
+    def worker_loop(self, conn):
+        try:
+            for frame in conn:
+                self.handle(json.loads(frame), frame, conn)
+        except (OSError, ValueError) as e:
+            print(f"[BUS] Ошибка воркера: {e}")
+        finally:
+            with self.lock:
+                self.workers.remove(conn)
+            with self.presence_lock:
+                # Клиенты упавшего воркера больше не в сети, если не подключены к другому
+                for user in [u for u, workers in self.online.items() if conn in workers]:
+                    self.set_presence(conn, user, False)
+            conn.close()
+
+    def handle(self, event, frame, conn):
+        op = event['op']
+        if op in ('add', 'delete', 'clear'):
+            # События add / delete / clear совпадают с записями журнала — пишем и пересылаем как есть
+            user = event.pop('by', None) or event.get('msg', {}).get('user')
+            commit = server.message_log.write(event)
+            def committed():
+                if commit.error is None:
+                    self.publish(frame)
+                else:
+                    self.publish(encode_event({'op': 'unsaved', 'record': event, 'user': user,
+                                               'error': str(commit.error)}))
+            commit.add_done_callback(committed)
+        elif op == 'channel':
+            with server.locks.channels:
+                apply_subscription(event)
+                server.subscription_changed(event['cid'], event['action'], event['user'])
+            self.publish(frame)
+        elif op == 'presence':
+            with self.presence_lock:
+                self.set_presence(conn, event['user'], event['online'])
+        else:
+            self.publish(frame)
+
+    def set_presence(self, conn, user, online):
+        """Вход или выход на воркере conn; агрегатор узнаёт только о смене
+        итогового состояния. Вызывается под presence_lock."""
+        workers = self.online.setdefault(user, set())
+        was_online = bool(workers)
+        if online:
+            workers.add(conn)
+        else:
+            workers.discard(conn)
+        if not workers:
+            del self.online[user]
+        if was_online != bool(workers):
+            server.presence.changed(user, bool(workers))
+
+    def publish(self, frame):
+        shared = shared_frame(frame)
+        with self.lock:
+            workers = list(self.workers)
+        for conn in workers:
+            conn.send_frame(shared)
+
+def apply_subscription(event):
+    if event['action'] == 'JOIN':
+        server.channel_index.subscribe(event['cid'], event['user'])
+    else:
+        server.channel_index.unsubscribe(event['cid'], event['user'])
+
+class BusPresence:
+    """Воркер: вместо PresenceAggregator отправляет входы и выходы хабу.
+    interval и call_later сервер задаёт по-прежнему, но здесь они не нужны."""
+    def __init__(self, bus):
+        self.bus = bus
+        self.interval = 0
+        self.call_later = None
+
+    def changed(self, user, online):
+        self.bus.send({'op': 'presence', 'user': user, 'online': online})
+
+class BusClient:
+    """Воркер: отправляет события хабу и применяет то, что хаб разослал"""
+    def __init__(self, path=BUS_PATH):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        self.conn = bus_connection(sock)
+
+    def start(self, call):
+        """call(fn, event) — как выполнить обработку события в потоке сервера:
+        в threaded-режиме сразу, в asyncio — через loop.call_soon_threadsafe"""
+        threading.Thread(target=self.read_loop, args=(call,), daemon=True).start()
+
+    def send(self, event):
+        self.conn.send(encode_event(event))
+
+    def read_loop(self, call):
+        for frame in self.conn:
+            call(apply_event, json.loads(frame))
+        # Без хаба воркер не может ни сохранять, ни доставлять — пусть его перезапустят
+        print("[BUS] Связь с главным процессом потеряна")
+        os._exit(1)
+
+def apply_event(event):
+    op = event['op']
+    if op == 'add':
+        server.message_log.apply(event)
+        server.deliver(event['kind'], event['key'], event['msg'])
+    elif op in ('delete', 'clear'):
+        server.message_log.apply(event)
+        server.deliver_removal(event)
+    elif op == 'expire':
+        server.message_log.apply(event)
+    elif op == 'announce':
+        server.broadcast(event['text'])
+    elif op == 'unsaved':
+        server.report_unsaved(event['record'], event['user'], event['error'])
+    elif op == 'channel':
+        with server.locks.channels:
+            apply_subscription(event)
+
+def run_worker(args):
+    """Воркер: подменяет точки сохранения и рассылки server.py на шину"""
+    bus = BusClient(args.bus)
+
+    def store_message(kind, key, msg):
+        bus.send({'op': 'add', 'kind': kind, 'key': key, 'msg': msg})
+
+    def store_removal(record, user):
+        bus.send(dict(record, by=user))
+
+    def announce(text):
+        bus.send({'op': 'announce', 'text': text})
+
+    def subscription_changed(cid, action, user):
+        bus.send({'op': 'channel', 'cid': cid, 'action': action, 'user': user})
+
+    server.store_message = store_message
+    server.store_removal = store_removal
+    server.announce = announce
+    server.subscription_changed = subscription_changed
+    server.presence = BusPresence(bus)
+
+    if args.mode == 'asyncio':
+        import aio_server
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            bus.start(loop.call_soon_threadsafe)
+            await aio_server.run(args.host, args.port, reuse_port=True)
+        asyncio.run(run())
+    else:
+        bus.start(lambda fn, event: fn(event))
+        server.serve_threaded(args.host, args.port, reuse_port=True)
+
+def worker_argv(args, index):
+    return [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'),
+            '--host', args.host, '--port', str(args.port), '--mode', args.mode,
+            '--send-queue', str(args.send_queue), '--overflow', args.overflow,
+            '--max-upload-mb', str(args.max_upload_mb), '--rate-limit', args.rate_limit,
+            '--compress-threshold', str(args.compress_threshold), '--storage', args.storage,
+            '--presence-interval-ms', str(args.presence_interval_ms),
+            *(['--no-binary-wire'] if args.no_binary_wire else []),
+            *(['--lazy-history', '--history-cache', str(args.history_cache)] if args.lazy_history else []),
+            *(['--no-search'] if args.no_search else []),
+            *(['--metrics-port', str(args.metrics_port + index + 1)] if args.metrics_port else []),
+            '--bus', BUS_PATH, '--node-id', str(args.node_id + index + 1)]
+
+def run_cluster(args):
+    """Главный процесс: хаб шины и N воркеров; падение любого воркера гасит всех"""
+    hub = Hub()
+    hub.start()
+    # Входы и выходы сводит агрегатор хаба и рассылает всем воркерам
+    server.presence.publish = lambda text: hub.publish(encode_event({'op': 'announce', 'text': text}))
+    # Реплики воркеров сегменты не читают — сколько убрал срок хранения, сообщает хаб
+    server.message_log.on_expire = lambda kind, key, count: hub.publish(
+        encode_event({'op': 'expire', 'kind': kind, 'key': key, 'count': count}))
+    procs = [subprocess.Popen(worker_argv(args, i)) for i in range(args.workers)]
+    print(f"[SERVER] {args.workers} воркеров на {args.host}:{args.port} ({args.mode}, SO_REUSEPORT)")
+    try:
+        os.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+        os.remove(BUS_PATH)
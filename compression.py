@@ -0,0 +1,74 @@
+# compression.py — сжатие кадров сервер → клиент, согласуемое при подключении
+#
+# Сервер в приглашении перечисляет, что умеет: LOGIN:zlib1,bin1 (см.
+# server.login_prompt). Клиент, который тоже умеет, до входа отвечает
+# COMPRESS:zlib1 и дальше шлёт LOGIN:/RESUME: как обычно. Старые клиенты приглашение не разбирают — для них ничего не меняется.
+#
+# После согласования сервер сжимает свои кадры длиннее THRESHOLD (страницы
+# HISTORY:, досылка после RESUME:, STATS:): тело кадра — MARK + raw deflate со
+# словарём DICTIONARY. Каждый кадр сжимается отдельно: очередь соединения может
+# выбросить кадр (drop_oldest), а общий поток zlib от этого сломался бы. Короткие
+# кадры и общие кадры рассылки (shared_frame) идут как есть. Кадры клиент → сервер
+# не сжимаются: там короткие команды и тела файлов.
+#
+# Словарь — частые куски JSON сообщений и русских слов; без него deflate на
+# коротких кадрах почти ничего не выигрывает. Словарь должен совпадать у сторон:
+# если он меняется, меняется и CODEC (zlib2, ...).
+import zlib
+
+from framing import FrameError, MAX_FRAME_SIZE
+
+CODEC = 'zlib1'
+REQUEST = f"COMPRESS:{CODEC}".encode('ascii')
+# Текстовые кадры начинаются с команды латиницей — нулевой байт их не спутает
+MARK = b'\x00'
+# Кадры короче порога не сжимаются; 0 — сжатие выключено и не предлагается
+THRESHOLD = 256
+LEVEL = 6
+
+DICTIONARY = ' '.join([
+    'спасибо пожалуйста хорошо нормально понятно конечно может быть сегодня завтра вчера',
+    'сейчас потом когда где почему зачем сколько можно нужно надо давай ладно окей',
+    'привет здравствуйте добрый день вечер утро как дела что нового пока до встречи',
+    'я ты он она мы вы они меня тебя его её нас вас их мне тебе нам вам',
+    'это что как так уже ещё тоже только очень все всё был была было будет есть нет да',
+    'в на с по за из от до для о у не и а но или если то же бы ли',
+    'сообщение файл фото видео голосовое канал чат группа ссылка скинь посмотри напиши',
+    '"image": null, "video": null, "reply_to": null, "is_admin": true, ',
+    'CHANNEL:', ':MSG:', 'PRIVATE:', 'MSG:', 'STATS:', 'HISTORY:{"chat_type": "private", "target": "',
+    '"chat_type": "channel", ', '"chat_type": "public", "target": null, "messages": [',
+    '], "more": false}', '], "more": true}',
+    '{"user": "', '", "message": "', '", "timestamp": "202', '", "is_admin": false, "id": "', '"}, ',
+]).encode('utf-8')
+
+def offered(welcome):
+    """Что сервер предлагает в приглашении LOGIN:<кодек>,<кодек>"""
+    return welcome.split(b':', 1)[1].split(b',') if b':' in welcome else []
+
+def pack(payload):
+    """Тело кадра сервер → клиент: сжатое, если кадр длинный и сжатие что-то даёт"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    if len(payload) < THRESHOLD:
+        return payload
+    c = zlib.compressobj(LEVEL, zlib.DEFLATED, -15, zdict=DICTIONARY)
+    packed = MARK + c.compress(payload) + c.flush()
+    return packed if len(packed) < len(payload) else payload
+
+def unpack(payload):
+    if payload[:1] != MARK:
+        return payload
+    d = zlib.decompressobj(-15, zdict=DICTIONARY)
+    raw = d.decompress(payload[1:], MAX_FRAME_SIZE)
+    # Вход может быть прочитан весь, а вывод ещё не выдан — тогда нет и конца потока
+    if d.unconsumed_tail or not d.eof:
+        raise FrameError(f"Сжатый кадр обрезан или распакованный больше {MAX_FRAME_SIZE} байт")
+    return raw
+
+def accept(conn, welcome):
+    """Клиентская сторона: если приглашение предлагает наш кодек — соглашается.
+    Дальше conn.recv_frame() сам распаковывает сжатые кадры."""
+    if CODEC.encode('ascii') in offered(welcome):
+        conn.send(REQUEST)
+        conn.inflate = unpack
+    return conn.inflate is not None
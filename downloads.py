@@ -0,0 +1,109 @@
+# downloads.py — отдача медиафайлов клиентам
+#
+# Как и загрузка, скачивание идёт по отдельному соединению:
+#
+#   клиент → DOWNLOAD:<user>:<password>:<имя файла>[:<диапазон>]   (кадр)
+#   сервер → OK:<начало>:<длина>:<размер файла>  или  FAIL:<причина>
+#   сервер → <длина> байт тела без кадров, затем закрывает соединение
+#
+# Диапазон — как Range в HTTP, границы включительно: "100-199", "100-"
+# (до конца файла, для докачки) или "-500" (последние 500 байт, для
+# перемотки видео к концу). Тело уходит через sendfile(): ядро копирует
+# файл прямо в сокет, байты не проходят через буферы Python.
+import os
+import re
+import socket
+
+from framing import FramedSocket
+
+RANGE_RE = re.compile(r'(\d*)-(\d*)')
+RECV_BUFFER = 1024 * 1024
+
+class DownloadError(ValueError):
+    pass
+
+def parse_range(spec, total):
+    """'начало-конец' → (начало, длина) внутри файла размером total"""
+    if not spec:
+        return 0, total
+    match = RANGE_RE.fullmatch(spec)
+    if not match or spec == '-':
+        raise DownloadError(f'неверный диапазон {spec}')
+    first, last = match.groups()
+    if not first:
+        length = min(int(last), total)
+        return total - length, length
+    start = int(first)
+    end = min(int(last), total - 1) if last else total - 1
+    if (total and start >= total) or start > end + 1:
+        raise DownloadError(f'диапазон {spec} вне файла размером {total}')
+    return start, end - start + 1
+
+def split_request(request):
+    """DOWNLOAD:<user>:<password>:<имя файла>[:<диапазон>] →
+    (user, password, имя файла, диапазон или '')"""
+    username, rest = request[9:].split(':', 1)
+    spec = ''
+    head, last = rest.rsplit(':', 1)
+    if RANGE_RE.fullmatch(last) and last != '-':
+        spec, rest = last, head
+    password, filename = rest.rsplit(':', 1)
+    return username, password, filename, spec
+
+def open_range(path, spec):
+    """Открывает файл и считает диапазон. Возвращает (файл, начало, длина, размер)."""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        raise DownloadError('файл не найден')
+    try:
+        total = os.fstat(f.fileno()).st_size
+        start, length = parse_range(spec, total)
+    except BaseException:
+        f.close()
+        raise
+    return f, start, length, total
+
+def fetch(host, port, username, password, filename, dest, spec=None):
+    """Клиентская сторона. Без spec докачивает dest с его текущего размера.
+    Возвращает число полученных новых байт (0 — файл уже был целиком)."""
+    offset = 0
+    if spec is None:
+        offset = os.path.getsize(dest) if os.path.exists(dest) else 0
+        # Докачка запрашивает и последний уже принятый байт: диапазон "<размер>-"
+        # у целого файла пуст, и сервер ответил бы FAIL, а так ответ всегда OK
+        # и по нему видно, что файл уже целиком (offset == total)
+        spec = f"{offset - 1}-" if offset else ''
+    request = f"DOWNLOAD:{username}:{password}:{filename}"
+    if spec:
+        request += f":{spec}"
+    conn = FramedSocket(socket.create_connection((host, port)))
+    try:
+        conn.recv_frame()  # LOGIN
+        conn.send(request)
+        reply = (conn.recv_frame(last=True) or b'').decode('utf-8')
+        if not reply.startswith('OK:'):
+            raise DownloadError(reply)
+        start, length, total = map(int, reply[3:].split(':'))
+        overlap = max(offset - start, 0)
+        if offset and offset == total:
+            return 0
+        buffer = bytearray(RECV_BUFFER)
+        view = memoryview(buffer)
+        received = 0
+        with open(dest, 'r+b' if os.path.exists(dest) else 'wb') as f:
+            f.seek(start)
+            pending = conn.take_buffered()
+            f.write(pending)
+            received += len(pending)
+            while received < length:
+                n = conn.sock.recv_into(view, min(len(buffer), length - received))
+                if not n:
+                    break
+                f.write(view[:n])
+                received += n
+        if received != length:
+            raise DownloadError(f'получено {received} из {length} байт, можно продолжить')
+        return received - overlap
+    finally:
+        conn.close()
@@ -0,0 +1,140 @@
+# framing.py — кадры с префиксом длины для TCP-протокола Tandau
+#
+# Каждое сообщение на проводе: 4 байта длины (big-endian) + тело.
+# TCP не сохраняет границы send(), поэтому один recv() может вернуть
+# половину сообщения или сразу несколько — FrameDecoder собирает их из потока.
+# Тело файла после FILE:<имя>:<размер> тоже идёт кадрами (кусками до MAX_FRAME_SIZE).
+import asyncio
+import struct
+import threading
+from collections import deque
+from itertools import islice
+
+HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+RECV_SIZE = 65536
+# Ограничение ядра на число буферов в одном sendmsg()
+IOV_MAX = 1024
+
+class FrameError(ValueError):
+    pass
+
+def encode_frame(payload):
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"Кадр слишком большой: {len(payload)} байт")
+    return HEADER.pack(len(payload)) + payload
+
+def shared_frame(payload):
+    """Кадр для рассылки: сериализуется и кодируется один раз, все получатели
+    ставят в очередь один и тот же неизменяемый буфер"""
+    return memoryview(encode_frame(payload))
+
+def send_buffers(sock, buffers):
+    """Scatter/gather-отправка списка буферов одним sendmsg() без склейки в один bytes.
+    Там, где sendmsg нет (Windows), буферы склеиваются и уходят через sendall()."""
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))
+        return
+    views = deque(memoryview(b) for b in buffers)
+    while views:
+        sent = sock.sendmsg(list(islice(views, IOV_MAX)))
+        # Частичная отправка: выкидываем ушедшие буферы, хвост недоотправленного режем без копии
+        while sent:
+            head = views[0]
+            if sent >= len(head):
+                sent -= len(head)
+                views.popleft()
+            else:
+                views[0] = head[sent:]
+                sent = 0
+
+class FrameDecoder:
+    """Инкрементальный разбор потока байт на кадры"""
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+
+    def feed(self, chunk, limit=None):
+        """Добавляет прочитанные байты, возвращает список всех целиком пришедших кадров
+        (не больше limit — остальное остаётся в buffer)"""
+        self.buffer += chunk
+        frames = []
+        pos = 0
+        while len(self.buffer) - pos >= HEADER.size and (limit is None or len(frames) < limit):
+            (size,) = HEADER.unpack_from(self.buffer, pos)
+            if size > self.max_frame_size:
+                raise FrameError(f"Кадр слишком большой: {size} байт")
+            end = pos + HEADER.size + size
+            if len(self.buffer) < end:
+                break
+            frames.append(bytes(self.buffer[pos + HEADER.size:end]))
+            pos = end
+        # Сдвигаем буфер один раз на весь recv, а не на каждый кадр
+        if pos:
+            del self.buffer[:pos]
+        return frames
+
+class FramedSocket:
+    """Блокирующий сокет, который отправляет и принимает целые кадры"""
+    def __init__(self, sock):
+        self.sock = sock
+        self.decoder = FrameDecoder()
+        self.pending = deque()
+        # Распаковка принятых кадров, если согласовано сжатие (compression.accept)
+        self.inflate = None
+        # sendall() из разных потоков может перемешать байты двух кадров
+        self.send_lock = threading.Lock()
+
+    def send(self, payload):
+        return self.send_frame(encode_frame(payload))
+
+    def send_frame(self, frame):
+        """Отправляет уже закодированный кадр (см. shared_frame)"""
+        with self.send_lock:
+            self.sock.sendall(frame)
+        return len(frame)
+
+    def recv_frame(self, last=False):
+        """Возвращает следующий кадр или None, если соединение закрыто.
+        last=True — за этим кадром идут сырые байты (тело DOWNLOAD:), их не разбираем,
+        а забираем через take_buffered()"""
+        while not self.pending:
+            chunk = self.sock.recv(RECV_SIZE)
+            if not chunk:
+                return None
+            self.pending.extend(self.decoder.feed(chunk, 1 if last else None))
+        frame = self.pending.popleft()
+        return self.inflate(frame) if self.inflate else frame
+
+    def take_buffered(self):
+        """Забирает уже прочитанные из сокета байты, не ставшие кадром: после
+        перехода соединения на «сырой» поток (тело UPLOAD:) они принадлежат телу"""
+        raw = bytes(self.decoder.buffer)
+        self.decoder.buffer.clear()
+        return raw
+
+    def __iter__(self):
+        while True:
+            frame = self.recv_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def close(self):
+        self.sock.close()
+
+async def read_frame(reader):
+    """Читает один кадр из asyncio.StreamReader; None — соединение закрыто"""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise FrameError(f"Кадр слишком большой: {size} байт")
+    return await reader.readexactly(size)
@@ -0,0 +1,72 @@
+# ids.py — id сообщений в стиле snowflake
+#
+# Раньше id брался из времени (мс на сервере, секунды в Kivy-клиенте), и два
+# сообщения в одну миллисекунду получали одинаковый id. Теперь id — 64-битное
+# число из трёх полей:
+#
+#   41 бит  миллисекунды от EPOCH_MS (хватит до ~2094 года)
+#   10 бит  номер узла — процесса, который выдаёт id
+#   12 бит  счётчик внутри миллисекунды (до 4096 id/мс на узел)
+#
+# id растут со временем, поэтому годятся как ключ сортировки и курсор страниц,
+# а новые id всегда больше старых «миллисекундных». Разные процессы должны
+# иметь разные номера узла, и задаются они явно: --node-id сервера или
+# TANDAU_NODE_ID в окружении. В режиме воркеров (cluster.py) сервер без номера
+# не запускается: хаб занимает номер N, воркеры — N+1..N+W; одиночный сервер
+# без номера — узел 0, поэтому у нескольких серверов (хостов) с общей историей
+# номера должны быть заданы каждому свои. Номер из pid — только у локальных
+# Kivy-приложений, которые ids не настраивают: он уникален лишь на одной машине
+# и между перезапусками может повториться.
+import os
+import threading
+import time
+
+EPOCH_MS = 1735689600000  # 2025-01-01 00:00:00 UTC
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+
+def node_from_env():
+    """Номер узла из TANDAU_NODE_ID или None, если не задан"""
+    value = os.environ.get('TANDAU_NODE_ID')
+    return int(value) if value else None
+
+class SnowflakeGenerator:
+    def __init__(self, node_id=None):
+        if node_id is None:
+            node_id = node_from_env()
+        if node_id is None:
+            # Локальное приложение: номер из pid
+            node_id = os.getpid() & MAX_NODE
+        if not 0 <= node_id <= MAX_NODE:
+            raise ValueError(f"номер узла вне 0..{MAX_NODE}: {node_id}")
+        self.node_id = node_id
+        self.last_ms = 0
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def next_id(self):
+        with self.lock:
+            now = time.time_ns() // 1000000 - EPOCH_MS
+            if now > self.last_ms:
+                self.last_ms = now
+                self.sequence = 0
+            else:
+                # Та же миллисекунда или часы ушли назад: продолжаем от last_ms,
+                # а при переполнении счётчика занимаем следующую миллисекунду
+                self.sequence = (self.sequence + 1) & SEQUENCE_MASK
+                if self.sequence == 0:
+                    self.last_ms += 1
+            return (self.last_ms << (NODE_BITS + SEQUENCE_BITS)) | (self.node_id << SEQUENCE_BITS) | self.sequence
+
+generator = SnowflakeGenerator()
+
+def configure(node_id):
+    """Задаёт номер узла для id этого процесса (вызывается из main() сервера)"""
+    global generator
+    generator = SnowflakeGenerator(node_id)
+
+def new_id():
+    """Следующий id в виде строки — в JSON id всегда хранились строками"""
+    return str(generator.next_id())
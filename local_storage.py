@@ -0,0 +1,391 @@
+# local_storage.py — хранилища пользователей, каналов и сообщений без журнала
+#
+# Один интерфейс для сервера и Kivy-приложений (simple.py, main_simple.py):
+#   users() → {имя: запись}            user(имя) → запись или None
+#   add_user(имя, запись) → False, если имя занято
+#   channels() → {id: канал со списком subscribers}
+#   add_channel(id, канал)             set_subscribed(id, пользователь, подписан)
+#   add_message(kind, key, msg)        messages(kind, key, limit=None) → старые → новые
+#   clear_messages(kind, key)          stats() → {'users', 'messages', 'channels'}
+# kind — messages (key None) / private ('<a>_<b>') / channel_msgs (id канала),
+# как в message_log.py.
+#
+# Реализации:
+#   JsonFiles    — users.json и channels.json сервера (историю сервер ведёт в message_log);
+#   JsonDocument — messenger_data.json приложений: всё в одном файле, переписывается целиком;
+#                  файлы JSON меняются под файловой блокировкой (<файл>.lock) поверх
+#                  свежей копии с диска — запись другого процесса не затирается;
+#   SqliteStorage — одна база SQLite в режиме WAL: изменение — одна строка, а не весь
+#                   файл; сообщения по индексу (переписка, порядок) и (переписка, id),
+#                   пользователи по имени, подписки по каналу и по пользователю.
+#
+# Новая база заполняется из JSON-файлов (migrate_server / migrate_document),
+# старые файлы не трогаются. Перенос — одна транзакция вместе с отметкой
+# migrated в таблице meta: оборванный перенос откатывается и повторяется
+# при следующем открытии. Журнал сервера поверх базы —
+# в storage.py; приложения его не импортируют, как и message_log с индексом поиска.
+# Без модуля sqlite3 (сборка под Android без рецепта) open_local остаётся на JSON.
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+try:
+    import sqlite3
+except ImportError:  # сборка без sqlite3 — приложения остаются на JSON
+    sqlite3 = None
+
+DB_FILE = 'tandau.db'
+BACKENDS = ('json', 'sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS channels (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS subscriptions (
+    channel_id TEXT NOT NULL,
+    user TEXT NOT NULL,
+    PRIMARY KEY (channel_id, user)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS subscriptions_by_user ON subscriptions (user);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY,
+    conversation TEXT NOT NULL,
+    id TEXT,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation, seq);
+CREATE INDEX IF NOT EXISTS messages_by_id ON messages (conversation, id);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Политика fsync журнала (message_log.FSYNC_POLICIES) → PRAGMA synchronous.
+# В режиме WAL NORMAL не теряет данных при падении процесса, только при отключении питания.
+SYNCHRONOUS = {'always': 'FULL', 'interval': 'NORMAL', 'os': 'OFF'}
+
+INSERT_MESSAGE = 'INSERT INTO messages (conversation, id, body) VALUES (?, ?, ?)'
+DELETE_MESSAGE = 'DELETE FROM messages WHERE conversation = ? AND id = ?'
+CLEAR_MESSAGES = 'DELETE FROM messages WHERE conversation = ?'
+# Отметка о завершённом переносе из JSON — в той же транзакции, что и перенос
+MARK_MIGRATED = "INSERT OR REPLACE INTO meta (name, value) VALUES ('migrated', '1')"
+
+def to_json(obj):
+    return json.dumps(obj, ensure_ascii=False)
+
+def conversation_key(kind, key):
+    return kind if kind == 'messages' else f"{kind}:{key}"
+
+def split_conversation(conversation):
+    kind, _, key = conversation.partition(':')
+    return kind, key or None
+
+@contextmanager
+def file_lock(path):
+    """Блокировка между процессами на <path>.lock (снимается при закрытии файла)"""
+    with open(path + '.lock', 'a+b') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        yield
+
+def read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def refresh(cached, fresh):
+    """Свежая копия с диска — в тот же объект: ссылки на раздел (server.data) остаются живыми"""
+    if isinstance(cached, list):
+        cached[:] = fresh
+    else:
+        cached.clear()
+        cached.update(fresh)
+
+def write_json(path, obj, indent):
+    """Через временный файл и os.replace(): читатель не увидит файл наполовину"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, ensure_ascii=False, indent=indent)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+class JsonFiles:
+    """Сервер по-старому: users.json и channels.json читаются при старте,
+    channels.json переписывается целиком при каждом изменении подписки"""
+    def __init__(self, users_file='users.json', channels_file='channels.json'):
+        self.files = {'users': users_file, 'channels': channels_file}
+        self.data = {name: read_json(path, {}) for name, path in self.files.items()}
+        self.lock = threading.Lock()
+
+    def modify(self, name, change):
+        """change(раздел) поверх копии, перечитанной под файловой блокировкой, —
+        файл мог переписать другой процесс; раздел пишется целиком"""
+        path = self.files[name]
+        with self.lock, file_lock(path):
+            refresh(self.data[name], read_json(path, {}))
+            result = change(self.data[name])
+            write_json(path, self.data[name], 4)
+        return result
+
+    def users(self):
+        return self.data['users']
+
+    def user(self, name):
+        return self.data['users'].get(name)
+
+    def add_user(self, name, record):
+        def change(users):
+            if name in users:
+                return False
+            users[name] = record
+            return True
+        return self.modify('users', change)
+
+    def channels(self):
+        return self.data['channels']
+
+    def add_channel(self, cid, channel):
+        self.modify('channels', lambda channels: channels.__setitem__(cid, channel))
+
+    def set_subscribed(self, cid, user, subscribed):
+        def change(channels):
+            subscribers = channels[cid].setdefault('subscribers', [])
+            if subscribed and user not in subscribers:
+                subscribers.append(user)
+            elif not subscribed and user in subscribers:
+                subscribers.remove(user)
+        self.modify('channels', change)
+
+    def close(self):
+        pass
+
+class JsonDocument(JsonFiles):
+    """Приложения по-старому: всё в одном messenger_data.json"""
+    SECTIONS = {'messages': 'messages', 'private': 'private_messages', 'channel_msgs': 'channel_messages'}
+
+    def __init__(self, path='messenger_data.json'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = self.read()
+
+    def read(self):
+        data = read_json(self.path, {})
+        for name in ('users', 'channels', 'private_messages', 'channel_messages'):
+            data.setdefault(name, {})
+        data.setdefault('messages', [])
+        return data
+
+    def modify(self, name, change):
+        # Одно приложение может быть открыто дважды: перечитываем весь документ
+        with self.lock, file_lock(self.path):
+            for section, fresh in self.read().items():
+                if section in self.data:
+                    refresh(self.data[section], fresh)
+                else:
+                    self.data[section] = fresh
+            result = change(self.data[name])
+            write_json(self.path, self.data, 2)
+        return result
+
+    def add_message(self, kind, key, msg):
+        if kind == 'messages':
+            self.modify('messages', lambda msgs: msgs.append(msg))
+        else:
+            self.modify(self.SECTIONS[kind], lambda section: section.setdefault(key, []).append(msg))
+
+    def messages(self, kind, key=None, limit=None):
+        section = self.data[self.SECTIONS[kind]]
+        msgs = section if kind == 'messages' else section.get(key, [])
+        return list(msgs[-limit:] if limit else msgs)
+
+    def clear_messages(self, kind, key=None):
+        if kind == 'messages':
+            self.modify('messages', lambda msgs: msgs.clear())
+        else:
+            self.modify(self.SECTIONS[kind], lambda section: section.pop(key, None))
+
+    def stats(self):
+        return {'users': len(self.data['users']), 'messages': len(self.data['messages']),
+                'channels': len(self.data['channels'])}
+
+class SqliteStorage:
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        # Одно соединение на процесс: писатель журнала, обработчики и загрузка
+        # ходят в него по очереди под self.lock
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        tables = {name for (name,) in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.db.executescript(SCHEMA)
+        if 'users' in tables and 'meta' not in tables:
+            # База из версии без отметки — в ней перенос уже прошёл
+            self.db.execute(MARK_MIGRATED)
+        self.lock = threading.Lock()
+
+    def migrated(self):
+        """Перенос из JSON завершён (отметка в meta)"""
+        return bool(self.query("SELECT 1 FROM meta WHERE name = 'migrated'"))
+
+    def set_synchronous(self, fsync_policy):
+        with self.lock:
+            self.db.execute(f'PRAGMA synchronous={SYNCHRONOUS[fsync_policy]}')
+
+    def transaction(self, statements):
+        """[(sql, параметры или список параметров)] одной транзакцией"""
+        with self.lock:
+            self.db.execute('BEGIN')
+            try:
+                for sql, params in statements:
+                    if isinstance(params, list):
+                        self.db.executemany(sql, params)
+                    else:
+                        self.db.execute(sql, params)
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def users(self):
+        return {name: json.loads(data) for name, data in self.query('SELECT name, data FROM users')}
+
+    def user(self, name):
+        rows = self.query('SELECT data FROM users WHERE name = ?', (name,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def add_user(self, name, record):
+        try:
+            self.transaction([('INSERT INTO users (name, data) VALUES (?, ?)', (name, to_json(record)))])
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def channels(self):
+        channels = {cid: json.loads(data) for cid, data in self.query('SELECT id, data FROM channels')}
+        for channel in channels.values():
+            channel['subscribers'] = []
+        for cid, user in self.query('SELECT channel_id, user FROM subscriptions'):
+            if cid in channels:
+                channels[cid]['subscribers'].append(user)
+        return channels
+
+    def add_channel(self, cid, channel):
+        self.transaction(self.channel_statements(cid, channel))
+
+    def channel_statements(self, cid, channel):
+        meta = {k: v for k, v in channel.items() if k != 'subscribers'}
+        return [
+            ('INSERT OR REPLACE INTO channels (id, data) VALUES (?, ?)', (cid, to_json(meta))),
+            ('DELETE FROM subscriptions WHERE channel_id = ?', (cid,)),
+            ('INSERT OR IGNORE INTO subscriptions (channel_id, user) VALUES (?, ?)',
+             [(cid, user) for user in channel.get('subscribers', [])]),
+        ]
+
+    def set_subscribed(self, cid, user, subscribed):
+        if subscribed:
+            sql = 'INSERT OR IGNORE INTO subscriptions (channel_id, user) VALUES (?, ?)'
+        else:
+            sql = 'DELETE FROM subscriptions WHERE channel_id = ? AND user = ?'
+        self.transaction([(sql, (cid, user))])
+
+    def user_channels(self, user):
+        return [cid for (cid,) in self.query('SELECT channel_id FROM subscriptions WHERE user = ?', (user,))]
+
+    def message_row(self, kind, key, msg):
+        return conversation_key(kind, key), msg.get('id'), to_json(msg)
+
+    def insert_messages(self, rows):
+        """rows — [(переписка, id, JSON сообщения)] одной транзакцией"""
+        self.transaction([(INSERT_MESSAGE, rows)])
+
+    def add_message(self, kind, key, msg):
+        self.insert_messages([self.message_row(kind, key, msg)])
+
+    def messages(self, kind, key=None, limit=None, before=None):
+        """Сообщения переписки по индексу: последние limit (до сообщения с id before)"""
+        conversation = conversation_key(kind, key)
+        sql = 'SELECT body FROM messages WHERE conversation = ?'
+        params = [conversation]
+        if before is not None:
+            sql += ' AND seq < (SELECT seq FROM messages WHERE conversation = ? AND id = ?)'
+            params += [conversation, before]
+        sql += ' ORDER BY seq DESC'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        rows = self.query(sql, params)
+        return [json.loads(body) for (body,) in reversed(rows)]
+
+    def clear_messages(self, kind, key=None):
+        self.transaction([(CLEAR_MESSAGES, (conversation_key(kind, key),))])
+
+    def stats(self):
+        return {'users': self.query('SELECT COUNT(*) FROM users')[0][0],
+                'messages': self.query("SELECT COUNT(*) FROM messages WHERE conversation = 'messages'")[0][0],
+                'channels': self.query('SELECT COUNT(*) FROM channels')[0][0]}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+def migrate_server(store, users, channels, history):
+    """Новая база сервера: пользователи, каналы и история (состояние message_log)
+    одной транзакцией с отметкой migrated"""
+    statements = [
+        ('INSERT OR IGNORE INTO users (name, data) VALUES (?, ?)',
+         [(name, to_json(record)) for name, record in users.items()]),
+    ]
+    rows = [store.message_row('messages', None, m) for m in history['messages']]
+    for kind in ('private', 'channel_msgs'):
+        for key, msgs in history[kind].items():
+            rows.extend(store.message_row(kind, key, m) for m in msgs)
+    statements.append((INSERT_MESSAGE, rows))
+    for cid, channel in channels.items():
+        statements.extend(store.channel_statements(cid, channel))
+    statements.append((MARK_MIGRATED, ()))
+    store.transaction(statements)
+    print(f"[DB] Импортировано в {store.path}: {len(users)} пользователей, "
+          f"{len(channels)} каналов, {len(rows)} сообщений")
+
+def migrate_document(store, path):
+    """Новая база приложения: переносит messenger_data.json, если он есть"""
+    if not os.path.exists(path):
+        store.transaction([(MARK_MIGRATED, ())])
+        return False
+    doc = JsonDocument(path)
+    history = {kind: doc.data[section] for kind, section in JsonDocument.SECTIONS.items()}
+    migrate_server(store, doc.users(), doc.channels(), history)
+    return True
+
+def open_local(backend='sqlite', path='messenger_data.db', legacy='messenger_data.json'):
+    """Хранилище Kivy-приложения: SQLite (при первом запуске — импорт legacy) или JSON-документ"""
+    if backend == 'json' or sqlite3 is None:
+        return JsonDocument(legacy)
+    store = SqliteStorage(path)
+    if not store.migrated():
+        migrate_document(store, legacy)
+    return store
@@ -0,0 +1,94 @@
+# locks.py — раздельные блокировки сервера Tandau
+#
+# Раньше один threading.Lock охранял и реестр соединений, и все переписки,
+# и каналы: публичное сообщение ждало любую личную переписку. Теперь:
+#   clients          — реестр подключённых пользователей (server.clients);
+#   channels         — реестр каналов и подписчиков (data['channels']);
+#   conversation(key) — блокировка переписки ('public', 'private:<a>_<b>',
+#                      'channel:<id>'): одна из STRIPES, выбранная по хешу ключа.
+#                      Свой Lock на каждую переписку рос бы вместе с числом пар
+#                      пользователей, а безопасно убрать блокировку, которую
+#                      кто-то мог уже взять из словаря, нельзя; чужие переписки
+#                      делят полосу редко и только на время записи в журнал.
+# Блокировка переписки держится, только пока сообщение пишется в журнал, —
+# так порядок в журнале задан ею, а разные переписки не мешают друг другу.
+# Пачку (fsync) отправитель ждёт уже без неё, а рассылка идёт через очередь
+# переписки delivery(key) — в том же порядке, что и в журнале.
+#
+# Каждая блокировка — TimedLock: сколько ждали захвата, видно в метрике
+# tandau_lock_wait_seconds (metrics.py). Свободная захватывается сразу
+# (acquire без ожидания) и учитывается как ожидание 0 — часы не трогаются,
+# а счётчик таких захватов живёт в самом TimedLock под его же блокировкой.
+# Метрика видит TimedLock по слабой ссылке и не держит брошенные блокировки.
+import threading
+import time
+from collections import deque
+
+import metrics
+
+STRIPES = 1024
+
+class TimedLock:
+    """Обёртка над Lock/RLock для `with`: ожидание захвата — в гистограмму"""
+    __slots__ = ('lock', 'name', 'free', '__weakref__')
+
+    def __init__(self, lock, name):
+        self.lock = lock
+        self.name = name
+        # Захваты без ожидания; меняется только под self.lock
+        self.free = 0
+        metrics.lock_wait_seconds.timers.add(self)
+
+    def __enter__(self):
+        if self.lock.acquire(False):
+            self.free += 1
+            return self
+        start = time.perf_counter()
+        self.lock.acquire()
+        metrics.lock_wait_seconds.observe(time.perf_counter() - start, self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+class Delivery:
+    """Очередь рассылки полосы переписок. put() — под блокировкой переписки, сразу
+    после записи в журнал; drain() — без неё, когда пачка стала долговечной:
+    кто первым дождался, тот и рассылает всё готовое с головы очереди."""
+    def __init__(self):
+        self.items = deque()
+        self.lock = threading.Lock()
+
+    def put(self, commit, deliver, failed):
+        self.items.append((commit, deliver, failed))
+
+    def drain(self):
+        with self.lock:
+            # Писатель журнала подтверждает пачки по порядку — готовое всегда в голове
+            while self.items and self.items[0][0].event.is_set():
+                commit, deliver, failed = self.items.popleft()
+                if commit.error is None:
+                    deliver()
+                else:
+                    failed(commit.error)
+
+class LockManager:
+    def __init__(self, single=False):
+        # single=True — все блокировки на самом деле одна (старое поведение,
+        # нужно для сравнения в benchmarks/bench_lock_contention.py)
+        self.single = threading.RLock() if single else None
+        self.clients = TimedLock(self.single or threading.Lock(), 'clients')
+        self.channels = TimedLock(self.single or threading.Lock(), 'channels')
+        if single:
+            self.conversations = [TimedLock(self.single, 'conversation')]
+        else:
+            self.conversations = [TimedLock(threading.Lock(), 'conversation') for _ in range(STRIPES)]
+        # Очередь рассылки — на ту же полосу, что и блокировка: put() идёт под ней
+        self.deliveries = [Delivery() for _ in self.conversations]
+
+    def conversation(self, key):
+        return self.conversations[hash(key) % len(self.conversations)]
+
+    def delivery(self, key):
+        """Очередь рассылки (Delivery) той же полосы, что conversation(key)"""
+        return self.deliveries[hash(key) % len(self.deliveries)]
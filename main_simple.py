@@ -12,11 +12,15 @@ from kivy.uix.screenmanager import ScreenManager, Screen
 from kivy.core.window import Window
 from kivy.clock import Clock
 
-import json
-import os
 import hashlib
 from datetime import datetime
 
+from ids import new_id
+from local_storage import open_local
+
+# Где приложение хранит данные: sqlite или json (см. local_storage.py)
+STORAGE_BACKEND = 'sqlite'
+
 class LoginScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -157,9 +161,9 @@ class ChatScreen(Screen):
     
     def load_messages(self):
         self.chat_layout.clear_widgets()
-        messages = App.get_running_app().get_messages()
+        messages = App.get_running_app().get_messages(limit=20)
         
-        for msg in messages[-20:]:
+        for msg in messages:
             text = f"{msg.get('user', 'Unknown')}: {msg.get('message', '')}"
             label = Label(
                 text=text,
@@ -186,22 +190,16 @@ class MessengerApp(App):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.current_user = None
-        self.data_file = "messenger_data.json"
+        # SQLite (при первом запуске переносит messenger_data.json) или старый JSON, см. local_storage.py
+        self.storage = open_local(STORAGE_BACKEND)
         self.initialize_data()
     
     def initialize_data(self):
-        if not os.path.exists(self.data_file):
-            data = {
-                "users": {
-                    "admin": {
-                        "password": self.hash_password("admin123"),
-                        "is_admin": True
-                    }
-                },
-                "messages": []
-            }
-            with open(self.data_file, 'w') as f:
-                json.dump(data, f, indent=2)
+        if not self.storage.users():
+            self.storage.add_user("admin", {
+                "password": self.hash_password("admin123"),
+                "is_admin": True
+            })
     
     def hash_password(self, password):
         return hashlib.sha256(password.encode()).hexdigest()
@@ -215,10 +213,8 @@ class MessengerApp(App):
     
     def login(self, username, password):
         try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
-            
-            if username in data["users"] and data["users"][username]["password"] == self.hash_password(password):
+            user = self.storage.user(username)
+            if user and user["password"] == self.hash_password(password):
                 self.current_user = username
                 return True
         except:
@@ -232,47 +228,29 @@ class MessengerApp(App):
             return False
         
         try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
-            
-            if username in data["users"]:
-                return False
-            
-            data["users"][username] = {
+            return self.storage.add_user(username, {
                 "password": self.hash_password(password),
                 "is_admin": False
-            }
-            
-            with open(self.data_file, 'w') as f:
-                json.dump(data, f, indent=2)
-            
-            return True
+            })
         except:
             return False
     
-    def get_messages(self):
+    def get_messages(self, limit=None):
         try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
-            return data.get("messages", [])
+            return self.storage.messages('messages', limit=limit)
         except:
             return []
     
     def send_message(self, text):
         try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
-            
             message = {
                 "user": self.current_user,
                 "message": text,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now().isoformat(),
+                "id": new_id()
             }
             
-            data["messages"].append(message)
-            
-            with open(self.data_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            self.storage.add_message('messages', None, message)
             
             return True
         except:
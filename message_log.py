@@ -0,0 +1,727 @@
+# message_log.py — append-only журнал сообщений сервера Tandau
+#
+# Вместо перезаписи messages.json / private_messages.json / channel_messages.json
+# на каждое сообщение сервер дописывает одну JSON-строку в конец журнала (O(1)).
+# Раз в CHECKPOINT_EVERY записей — контрольная точка: накопленное дописывается в
+# сегменты переписок (segments.py), журнал начинает новое поколение, а старые
+# поколения удаляются — при старте читаются сегменты и проигрывается только
+# хвост журнала.
+#
+#   message_log/
+#       checkpoint.json     опись сегментов и поколение журнала, с которого читать
+#       segments/...        сообщения по перепискам (см. segments.py)
+#       wal-000003.log      записи после контрольной точки, по одной JSON-строке
+#
+# Записи журнала:
+#   {"op": "add", "kind", "key", "msg"}   новое сообщение
+#   {"op": "delete", "kind", "key", "id"} удаление сообщения
+#   {"op": "clear", "kind", "key"}        очистка переписки
+# Удалённое вычищает из сегментов фоновый уплотнитель (compactor_loop); он же
+# применяет срок хранения (retention_days / retention_messages), удаляя старые
+# сегменты целиком. Каталог старого формата (snapshot.json) переводится в
+# сегменты при первом запуске.
+#
+# Запись на диск — групповая: append() только ставит строку в очередь,
+# отдельный поток-писатель собирает пачку от всех обработчиков и пишет её
+# одним write(). В состояние (HISTORY, SEARCH, досылка) запись попадает только
+# после этого — её применяет писатель, когда пачка стала долговечной. Не
+# записалось — пачка срезается с конца журнала, в состоянии её нет, а Commit
+# завершается с ошибкой. Политики долговечности (FSYNC_POLICIES):
+#   always   — fsync после каждой пачки, подтверждение только после fsync;
+#   interval — пачка копится до fsync_interval секунд, затем один fsync;
+#   os       — без fsync, подтверждение сразу после write() в буфер ОС.
+#
+# В режиме воркеров (cluster.py) журнал пишет только главный процесс, а у
+# воркеров — реплика (replica=True): она читает сегменты и журнал с диска, ничего
+# не пишет и дальше получает записи от главного процесса через apply().
+#
+# История отдаётся страницами (page()): индекс id → позиция в списке переписки
+# строится при первом запросе к переписке и дальше пополняется в append(),
+# так что страница из 50 сообщений стоит O(50) при любой длине истории.
+#
+# Поиск (search()) — по обратному индексу search_index.py, который журнал
+# пополняет вместе с состоянием; включается enable_search() после load().
+#
+# В памяти сообщения лежат как records.Message (__slots__, int-время и id);
+# dict'ами они становятся только на выходе — в page(), since() и сегментах.
+#
+# Ленивый режим (lazy): при старте читается только общий чат, а личная переписка
+# или канал — при первом обращении (conversation()). О непрочитанных журнал знает
+# по описи сегментов: id последнего сообщения (known) — этого хватает, чтобы
+# досылка при RESUME: не читала переписки, где нет ничего нового. Прочитанные
+# переписки держатся в LRU (resident) не больше cache_size; самые давние
+# вытесняются из памяти, кроме тех, чьих изменений ещё нет на диске (pinned).
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import metrics
+from records import pack, pack_id, pack_time, unpack_list, unpack_state
+from search_index import tokens
+from segments import SegmentStore
+
+LOG_DIR = 'message_log'
+CHECKPOINT_EVERY = 10000
+# Как часто уплотнитель проверяет срок хранения и удалённые сообщения, секунды
+COMPACT_INTERVAL = 60
+FSYNC_POLICIES = ('always', 'interval', 'os')
+FSYNC_INTERVAL = 0.01
+BATCH_SIZE = 1024
+PAGE_SIZE = 50
+# Ленивый режим: сколько личных переписок и каналов держать в памяти
+CACHE_SIZE = 1000
+
+# Старые файлы, из которых история импортируется при первом запуске
+LEGACY_FILES = {
+    'messages': 'messages.json',
+    'private': 'private_messages.json',
+    'channel_msgs': 'channel_messages.json'
+}
+
+# Маркер в очереди писателя: закрыть текущее поколение и сделать контрольную точку
+ROTATE = object()
+
+def empty_state():
+    return {'messages': [], 'private': {}, 'channel_msgs': {}}
+
+def apply_record(state, record):
+    """Добавляет сообщение из записи add в состояние. Возвращает Message."""
+    kind, msg = record['kind'], pack(record['msg'])
+    if kind == 'messages':
+        state['messages'].append(msg)
+    else:
+        state[kind].setdefault(record['key'], []).append(msg)
+    return msg
+
+class Commit:
+    """Подтверждение записи: завершается, когда пачка с сообщением стала долговечной.
+    Время от создания до done() — метрика tandau_persist_seconds."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.callbacks = []
+        self.error = None
+        self.lock = threading.Lock()
+        self.created = time.perf_counter()
+
+    def done(self, error=None):
+        metrics.persist_seconds.observe(time.perf_counter() - self.created)
+        with self.lock:
+            self.error = error
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_done_callback(self, callback):
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
+
+class MessageLog:
+    def __init__(self, directory=LOG_DIR, checkpoint_every=CHECKPOINT_EVERY,
+                 fsync_policy='interval', fsync_interval=FSYNC_INTERVAL, batch_size=BATCH_SIZE):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Неизвестная политика fsync: {fsync_policy}")
+        self.directory = directory
+        self.checkpoint_every = checkpoint_every
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.generation = 1
+        self.since_checkpoint = 0
+        self.file = None
+        self.state = None
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.writer = None
+        self.checkpoint_thread = None
+        # Следующая контрольная точка не заказывается, пока не закончена предыдущая
+        self.checkpoint_pending = False
+        self.segments = SegmentStore(directory)
+        # Срок хранения: 0 — без ограничения
+        self.retention_days = 0
+        self.retention_messages = 0
+        self.compact_interval = COMPACT_INTERVAL
+        self.compactor = None
+        self.stopping = threading.Event()
+        # Кластер: хаб пересылает воркерам, сколько сообщений срок хранения убрал
+        self.on_expire = None
+        # (kind, key) → {id сообщения: позиция в списке переписки}
+        self.positions = {}
+        # search_index.SearchIndex или None — поиск выключен
+        self.search_index = None
+        self.replica = False
+        # Ленивый режим: (kind, key) → id последнего сообщения для всех переписок,
+        # кроме общего чата; прочитанные — в resident от давних к свежим;
+        # unsaved — сколько записей переписки ещё не подтверждено писателем
+        self.lazy = False
+        self.cache_size = CACHE_SIZE
+        self.known = {}
+        self.resident = OrderedDict()
+        self.unsaved = {}
+        # Статистика группового коммита
+        self.records = 0
+        self.writes = 0
+        self.fsyncs = 0
+
+    def wal_path(self, generation):
+        return os.path.join(self.directory, f'wal-{generation:06d}.log')
+
+    @property
+    def snapshot_path(self):
+        # Снимок всего состояния — формат каталога до сегментов
+        return os.path.join(self.directory, 'snapshot.json')
+
+    def wal_generations(self):
+        gens = []
+        for name in os.listdir(self.directory):
+            if name.startswith('wal-') and name.endswith('.log'):
+                gens.append(int(name[4:-4]))
+        return sorted(gens)
+
+    def load(self):
+        """Восстанавливает состояние: сегменты + хвост журнала и запускает писателя
+        и уплотнитель. Возвращает dict с ключами messages / private / channel_msgs."""
+        if not os.path.isdir(self.directory) and not self.replica:
+            os.makedirs(self.directory)
+            self.state = empty_state()
+            self.restore(import_legacy())
+            replayed = 0
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            replayed = self.read()
+
+        self.since_checkpoint = replayed
+        if self.replica:
+            print(f"[LOG] Реплика истории: поколение {self.generation}, проиграно записей: {replayed}")
+            return self.state
+        if not self.segments.exists():
+            # Первый запуск или каталог со snapshot.json: всё сразу в сегменты
+            self.generation += 1
+            self.checkpoint(self.segments.take(), self.generation)
+            if os.path.exists(self.snapshot_path):
+                os.remove(self.snapshot_path)
+            self.since_checkpoint = 0
+        self.file = open(self.wal_path(self.generation), 'a', encoding='utf-8')
+        self.writer = threading.Thread(target=self.writer_loop, daemon=True)
+        self.writer.start()
+        self.compactor = threading.Thread(target=self.compactor_loop, daemon=True)
+        self.compactor.start()
+        print(f"[LOG] История загружена: поколение {self.generation}, проиграно записей: {replayed}, fsync: {self.fsync_policy}")
+        return self.state
+
+    def read(self):
+        """Читает сегменты (или снимок старого формата) и хвост журнала в self.state,
+        ничего не записывая. Возвращает число проигранных записей."""
+        self.state = empty_state()
+        if self.segments.exists():
+            self.segments.load(self.state, self.lazy)
+            self.generation = self.segments.generation
+            if self.lazy:
+                for conv in self.segments.conversations:
+                    if conv[0] != 'messages':
+                        self.known[conv] = self.segments.last_id(conv)
+                        if conv[1] in self.state[conv[0]]:
+                            # Опись старого формата: переписка уже прочитана
+                            self.touch(conv)
+        elif os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snap = json.load(f)
+            self.generation = snap.pop('generation')
+            self.restore(snap)
+        replayed = 0
+        for gen in self.wal_generations():
+            if gen < self.generation:
+                continue
+            replayed += replay(self.wal_path(gen), self.apply_locked)
+            self.generation = gen
+        return replayed
+
+    def restore(self, state):
+        """История из старых файлов или снимка — как будто пришла записями add"""
+        for kind, key, msg in iter_state(state):
+            self.apply_locked({'op': 'add', 'kind': kind, 'key': key, 'msg': msg})
+
+    def append(self, kind, key, msg):
+        """Ставит сообщение в очередь писателя; в состояние оно попадёт после
+        записи на диск. kind — messages / private / channel_msgs. Возвращает Commit."""
+        return self.write({'op': 'add', 'kind': kind, 'key': key, 'msg': msg})
+
+    def write(self, record):
+        """Ставит запись (add / delete / clear) в очередь писателя"""
+        # Сериализуем в потоке обработчика, а не писателя
+        line = self.encode(record)
+        commit = Commit()
+        with self.lock:
+            if self.lazy and record['kind'] != 'messages':
+                self.pin((record['kind'], record['key']), commit)
+            self.queue.put((line, commit, record))
+            self.since_checkpoint += 1
+            if self.since_checkpoint >= self.checkpoint_every and not self.checkpoint_pending:
+                self.since_checkpoint = 0
+                self.checkpoint_pending = True
+                self.queue.put(ROTATE)
+        return commit
+
+    def encode(self, record):
+        """Во что превращается запись в очереди писателя (storage.SqliteLog — строка таблицы)"""
+        return json.dumps(record, ensure_ascii=False) + '\n'
+
+    def apply(self, record):
+        """Реплика: применяет запись, уже сохранённую главным процессом"""
+        with self.lock:
+            self.apply_locked(record)
+
+    def apply_locked(self, record):
+        op, conv = record.get('op'), (record['kind'], record['key'])
+        # Реплика и SqliteLog изменения для сегментов не копят
+        segments = self.segments if not self.replica else None
+        search = self.search_index
+        if op == 'add':
+            if self.lazy and conv[0] != 'messages':
+                # Сначала прочитать с диска то, что в переписке уже есть
+                self.conversation(*conv)
+            msg = apply_record(self.state, record)
+            if self.lazy and conv[0] != 'messages':
+                self.known[conv] = msg.id
+                self.touch(conv)
+            index = self.positions.get(conv)
+            if index is not None and msg.id is not None:
+                index[msg.id] = len(self.conversation(*conv)) - 1
+            if segments:
+                segments.added(conv, msg)
+            if search is not None:
+                search.added(conv, msg)
+        elif op == 'delete':
+            msgs = self.conversation(*conv)
+            try:
+                position = self.position(*conv, msgs, record['id'])
+            except KeyError:
+                return
+            msg = msgs.pop(position)
+            self.positions.pop(conv, None)
+            if segments:
+                segments.deleted(conv, msg, position)
+            if search is not None:
+                search.deleted(conv, msg)
+        elif op == 'clear':
+            self.conversation(*conv).clear()
+            self.positions.pop(conv, None)
+            if segments:
+                segments.cleared(conv)
+            if search is not None:
+                search.cleared(conv)
+        elif op == 'expire':
+            # Только у реплик: главный процесс удалил сегменты по сроку хранения.
+            # Непрочитанную переписку реплика потом прочтёт уже без них.
+            msgs = self.loaded(*conv)
+            if msgs is not None:
+                del msgs[:record['count']]
+            self.positions.pop(conv, None)
+
+    def conversation(self, kind, key):
+        """Список сообщений одной переписки (пустой, если её ещё нет).
+        В ленивом режиме читает переписку с диска, если её нет в памяти."""
+        if kind == 'messages':
+            return self.state['messages']
+        msgs = self.state[kind].get(key)
+        if msgs is None:
+            if not self.lazy or (kind, key) not in self.known:
+                return []
+            msgs = self.state[kind][key] = self.fetch((kind, key))
+        if self.lazy:
+            self.touch((kind, key))
+        return msgs
+
+    def loaded(self, kind, key):
+        """Список сообщений переписки, если он в памяти, иначе None (с диска не читает)"""
+        if kind == 'messages':
+            return self.state['messages']
+        return self.state[kind].get(key)
+
+    def fetch(self, conv):
+        """Ленивый режим: сообщения переписки с диска (storage.SqliteLog — из базы)"""
+        return self.segments.read_conversation(conv, truncate=not self.replica)
+
+    def touch(self, conv):
+        """Переписка прочитана или к ней обратились — в конец LRU; лишние вытесняются"""
+        resident = self.resident
+        if conv in resident:
+            resident.move_to_end(conv)
+            return
+        resident[conv] = None
+        # Реплика не вытесняет: её опись сегментов не обновляется, и переписка,
+        # прочитанная заново, потеряла бы то, что пришло от главного процесса
+        if len(resident) <= self.cache_size or self.replica:
+            return
+        victims = []
+        for old in resident:
+            if len(resident) - len(victims) <= self.cache_size or old == conv:
+                break
+            if not self.pinned(old):
+                victims.append(old)
+        for old in victims:
+            del resident[old]
+            del self.state[old[0]][old[1]]
+            self.positions.pop(old, None)
+
+    def pinned(self, conv):
+        """Нельзя вытеснять: что-то из переписки ещё не на диске"""
+        return conv in self.unsaved or (self.segments is not None and self.segments.dirty(conv))
+
+    def pin(self, conv, commit):
+        self.unsaved[conv] = self.unsaved.get(conv, 0) + 1
+        commit.add_done_callback(lambda: self.unpin(conv))
+
+    def unpin(self, conv):
+        with self.lock:
+            left = self.unsaved[conv] - 1
+            if left:
+                self.unsaved[conv] = left
+            else:
+                del self.unsaved[conv]
+
+    def page(self, kind, key, before=None, after=None, limit=PAGE_SIZE):
+        """Страница истории: limit сообщений перед before или после after (id
+        сообщения), без курсора — последние limit. Возвращает (сообщения, есть ли ещё
+        дальше в ту же сторону). Неизвестный id — KeyError."""
+        with self.lock:
+            msgs = self.conversation(kind, key)
+            if before is not None:
+                end = self.position(kind, key, msgs, before)
+                start = max(0, end - limit)
+                more = start > 0
+            elif after is not None:
+                start = self.position(kind, key, msgs, after) + 1
+                end = min(len(msgs), start + limit)
+                more = end < len(msgs)
+            else:
+                end = len(msgs)
+                start = max(0, end - limit)
+                more = start > 0
+            return unpack_list(msgs[start:end]), more
+
+    def find(self, kind, key, msg_id):
+        """Сообщение переписки по id (dict); нет такого — KeyError"""
+        with self.lock:
+            msgs = self.conversation(kind, key)
+            return msgs[self.position(kind, key, msgs, msg_id)].to_dict()
+
+    def enable_search(self, index):
+        """Подключает поисковый индекс: читает его файл и доиндексирует историю"""
+        with self.lock:
+            index.load(self.index_sources())
+            self.search_index = index
+
+    def index_sources(self):
+        """Переписки для SearchIndex.load: ((kind, key), сообщения, id последнего).
+        Непрочитанные в ленивом режиме отдаются функцией, читающей их с диска, —
+        индекс позовёт её, только если отстаёт от переписки."""
+        yield ('messages', None), self.state['messages'], None
+        for kind in ('private', 'channel_msgs'):
+            for key, msgs in self.state[kind].items():
+                yield (kind, key), msgs, None
+        for conv, last_id in self.known.items():
+            if conv[1] not in self.state[conv[0]]:
+                yield conv, (lambda conv=conv: self.fetch(conv)), last_id
+
+    def search(self, text, conv=None, before=None, limit=PAGE_SIZE, accept=None):
+        """Страница поиска по всем терминам text: [(kind, key, сообщение dict)] от новых
+        к старым и курсор before следующей страницы (None — дальше ничего).
+        conv — искать только в этой переписке, accept(kind, key) — фильтр доступа."""
+        if self.search_index is None:
+            raise KeyError('поиск выключен')
+        terms = tokens(text)
+        if not terms:
+            return [], None
+        hits = []
+        while len(hits) < limit:
+            wanted = limit - len(hits)
+            docs = self.search_index.scan(terms, before, wanted, conv)
+            for doc, kind, key, msg_id in docs:
+                before = doc
+                if accept and not accept(kind, key):
+                    continue
+                try:
+                    hits.append((kind, key, self.find(kind, key, msg_id)))
+                except KeyError:
+                    # Удалено после сохранения индекса или убрано сроком хранения
+                    self.search_index.forget(doc)
+            if len(docs) < wanted:
+                return hits, None
+        return hits, before
+
+    def since(self, kind, key, after_id, limit):
+        """Сообщения переписки с id больше after_id (не больше limit последних).
+        id растут, поэтому идём с конца и останавливаемся на первом старом —
+        цена пропорциональна пропущенному, а не длине истории."""
+        with self.lock:
+            if self.lazy and kind != 'messages' and self.loaded(kind, key) is None:
+                last_id = self.known.get((kind, key))
+                if (kind, key) not in self.known or (isinstance(last_id, int) and last_id <= after_id):
+                    return []
+            msgs = self.conversation(kind, key)
+            start = len(msgs)
+            while start > 0 and len(msgs) - start < limit:
+                msg_id = msgs[start - 1].id
+                if not isinstance(msg_id, int) or msg_id <= after_id:
+                    break
+                start -= 1
+            return unpack_list(msgs[start:])
+
+    def private_keys(self, user):
+        """Ключи личных переписок пользователя ('<a>_<b>')"""
+        with self.lock:
+            if self.lazy:
+                keys = [key for kind, key in self.known if kind == 'private']
+            else:
+                keys = list(self.state['private'])
+        return [key for key in keys if private_peer(key, user) is not None]
+
+    def position(self, kind, key, msgs, msg_id):
+        index = self.positions.get((kind, key))
+        if index is None:
+            # Строится один раз на переписку, дальше его пополняет append()
+            index = {m.id: i for i, m in enumerate(msgs) if m.id is not None}
+            self.positions[(kind, key)] = index
+        return index[pack_id(msg_id)]
+
+    def writer_loop(self):
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            # always/os: берём всё, что накопилось, пока шла прошлая запись;
+            # interval: ждём до конца окна или до полной пачки
+            deadline = time.monotonic()
+            if self.fsync_policy == 'interval':
+                deadline += self.fsync_interval
+            while len(batch) < self.batch_size and batch[-1] is not ROTATE:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self.write_batch(batch)
+
+    def write_batch(self, batch):
+        rotate = batch[-1] is ROTATE
+        if rotate:
+            batch.pop()
+        error = None
+        if batch:
+            try:
+                self.persist([line for line, _, _ in batch])
+                self.writes += 1
+                self.records += len(batch)
+            except OSError as e:
+                print(f"[LOG] Ошибка записи журнала: {e}")
+                error = e
+            if error is None:
+                # Записи применяет только писатель и по порядку очереди — состояние
+                # всегда совпадает с журналом, а перед ROTATE — ровно с его поколением
+                with self.lock:
+                    for _, _, record in batch:
+                        self.apply_locked(record)
+        for _, commit, _ in batch:
+            commit.done(error)
+        if rotate:
+            try:
+                self.rotate()
+            except OSError as e:
+                print(f"[LOG] Ошибка смены поколения журнала: {e}")
+                self.checkpoint_pending = False
+
+    def persist(self, lines):
+        """Пишет пачку в журнал (storage.SqliteLog — одной транзакцией). При ошибке
+        конец журнала возвращается к началу пачки: недописанная строка иначе склеилась
+        бы с первой строкой следующей пачки, и replay() потерял бы обе."""
+        size = os.fstat(self.file.fileno()).st_size
+        try:
+            self.file.write(''.join(lines))
+            self.file.flush()
+            if self.fsync_policy != 'os':
+                os.fsync(self.file.fileno())
+                self.fsyncs += 1
+        except OSError:
+            self.discard_tail(size)
+            raise
+
+    def discard_tail(self, size):
+        try:
+            # Буфер с недописанным закрывается вместе с файлом
+            self.file.close()
+        except OSError:
+            pass
+        path = self.wal_path(self.generation)
+        try:
+            os.truncate(path, size)
+        except OSError as e:
+            # Обрезать не вышло — журнал продолжается в следующем поколении: replay()
+            # читает все поколения после контрольной точки, а обрывок остаётся
+            # последней строкой старого файла и пропускается
+            print(f"[LOG] Не удалось обрезать {path}: {e}")
+            self.generation += 1
+            path = self.wal_path(self.generation)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def rotate(self):
+        """Переключает журнал на новое поколение и делает контрольную точку в фоне"""
+        if self.fsync_policy == 'os':
+            os.fsync(self.file.fileno())
+        # Новый файл — раньше, чем закрыть старый: не открылся — пишем в прежний
+        new = open(self.wal_path(self.generation + 1), 'a', encoding='utf-8')
+        self.file.close()
+        self.file = new
+        self.generation += 1
+        with self.lock:
+            # Всё до ROTATE уже применено писателем, после — ещё нет
+            pending = self.segments.take()
+        self.checkpoint_thread = threading.Thread(
+            target=self.background_checkpoint, args=(pending, self.generation), daemon=True)
+        self.checkpoint_thread.start()
+
+    def background_checkpoint(self, pending, generation):
+        try:
+            self.checkpoint(pending, generation)
+        except OSError as e:
+            print(f"[LOG] Ошибка контрольной точки: {e}")
+        finally:
+            self.checkpoint_pending = False
+
+    def checkpoint(self, pending, generation):
+        # Не записалось (OSError) — изменения остались в сегментах pending, а журналы
+        # не удаляются: следующая контрольная точка запишет всё с более старого поколения
+        self.segments.flush(pending, generation, self.lock)
+        # Всё, что старше контрольной точки, больше не нужно для восстановления
+        for gen in self.wal_generations():
+            if gen < generation:
+                os.remove(self.wal_path(gen))
+        self.save_search()
+
+    def save_search(self):
+        """Пишет поисковый индекс: при старте доиндексируется только то, чего нет в файле"""
+        if self.search_index is None or self.replica:
+            return
+        try:
+            self.search_index.save()
+        except OSError as e:
+            print(f"[SEARCH] Ошибка сохранения индекса: {e}")
+
+    def compactor_loop(self):
+        while not self.stopping.wait(self.compact_interval):
+            try:
+                self.compact()
+            except OSError as e:
+                print(f"[LOG] Ошибка уплотнения: {e}")
+
+    def compact(self):
+        """Срок хранения (старые сегменты удаляются целиком) и вычистка удалённых
+        сообщений из запечатанных сегментов"""
+        cutoff = None
+        if self.retention_days:
+            cutoff = pack_time((datetime.now() - timedelta(days=self.retention_days)).isoformat())
+        keep = self.retention_messages or None
+        changed = False
+        with self.segments.disk_lock:
+            for conv in list(self.segments.conversations):
+                if cutoff is not None or keep is not None:
+                    with self.lock:
+                        # Непрочитанную (ленивый режим) не читаем: хватает сводки сегментов
+                        msgs = self.loaded(*conv)
+                        total = len(msgs) if msgs is not None else sum(
+                            seg.live for seg in self.segments.conversations[conv])
+                        victims, count = self.segments.expire(conv, total, cutoff, keep)
+                        if msgs is not None:
+                            del msgs[:count]
+                        if count:
+                            self.positions.pop(conv, None)
+                    if victims:
+                        self.segments.drop_files(conv, victims)
+                        changed = True
+                        if count and self.on_expire:
+                            self.on_expire(*conv, count)
+                changed = self.segments.compact(conv, self.lock) or changed
+            if changed:
+                self.segments.write_checkpoint()
+
+    def close(self):
+        self.stopping.set()
+        if self.compactor:
+            self.compactor.join()
+            self.compactor = None
+        if self.writer:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        if self.checkpoint_thread:
+            self.checkpoint_thread.join()
+        if self.file:
+            self.file.close()
+            self.file = None
+        self.save_search()
+
+def replay(path, apply):
+    count = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Недописанная последняя строка после падения — пропускаем
+                continue
+            apply(record)
+            count += 1
+    return count
+
+def read_history(directory=LOG_DIR):
+    """История как есть на диске (журнал или старые JSON-файлы), dict'ами — для переноса в storage.py"""
+    if not os.path.isdir(directory):
+        return import_legacy()
+    log = MessageLog(directory)
+    log.read()
+    return unpack_state(log.state)
+
+def import_legacy():
+    """Первый запуск: берём историю из старых JSON-файлов"""
+    state = empty_state()
+    for kind, path in LEGACY_FILES.items():
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                loaded = json.load(f)
+            if isinstance(loaded, type(state[kind])):
+                state[kind] = loaded
+            print(f"[LOG] Импортирован {path}")
+    return state
+
+def private_peer(key, user):
+    """Собеседник user в личной переписке key ('<a>_<b>') или None, если она не его"""
+    for other in (key[len(user) + 1:] if key.startswith(user + '_') else None,
+                  key[:-len(user) - 1] if key.endswith('_' + user) else None):
+        if other and key == f"{min(user, other)}_{max(user, other)}":
+            return other
+    return None
+
+def iter_state(state):
+    """(kind, key, сообщение) по всему состоянию: общий чат, личные, каналы"""
+    for msg in state.get('messages', []):
+        yield 'messages', None, msg
+    for kind in ('private', 'channel_msgs'):
+        for key, msgs in state.get(kind, {}).items():
+            for msg in msgs:
+                yield kind, key, msg
@@ -23,6 +23,10 @@ import tempfile
 import requests
 from urllib.parse import urlparse
 
+from framing import FramedSocket
+import compression
+import wire
+
 
 # === КОНФИГУРАЦИЯ ===
 class Config:
@@ -657,6 +661,10 @@ class ModernMessengerApp:
         
         self.avatar_cache = {}
         self.server_connected = False
+        # Токен для RESUME: после обрыва и последний полученный id сообщения
+        self.session_token = None
+        self.last_seen_id = 0
+        self.seen_ids = set()
         
         # Создаем необходимые директории
         for dir in ['chat_images', 'chat_videos', 'voice_messages', 'user_avatars']:
@@ -667,19 +675,30 @@ class ModernMessengerApp:
         
         self.create_auth_screen()
     
+    def open_connection(self, timeout):
+        """Единственное место, где открывается сокет: прежнее соединение закрывается,
+        новое ждёт приглашения LOGIN от сервера"""
+        try:
+            if self.client_socket:
+                self.client_socket.close()
+            sock = socket.create_connection((Config.SERVER_HOST, Config.SERVER_PORT), timeout=timeout)
+            self.client_socket = FramedSocket(sock)
+            welcome = self.client_socket.recv_frame()
+            print(f"Подключение: {welcome.decode('utf-8')}")
+            # Сервер предлагает сжатие длинных кадров (история, досылка) и двоичные
+            # кадры сообщений без json.loads — соглашаемся на то, что умеем
+            compression.accept(self.client_socket, welcome)
+            wire.accept(self.client_socket, welcome)
+            return True
+        except Exception as e:
+            print(f"Connection error: {e}")
+            return False
+    
     def auto_connect_to_server(self):
         """Автоматическое подключение к серверу при запуске"""
         def connect():
-            try:
-                self.client_socket = socket.socket()
-                self.client_socket.settimeout(5)
-                self.client_socket.connect((Config.SERVER_HOST, Config.SERVER_PORT))
-                welcome = self.client_socket.recv(1024).decode('utf-8')
-                print(f"Автоматическое подключение: {welcome}")
-                self.root.after(0, lambda: self.update_connection_status(True))
-            except Exception as e:
-                print(f"Автоматическое подключение не удалось: {e}")
-                self.root.after(0, lambda: self.update_connection_status(False))
+            connected = self.open_connection(5)
+            self.root.after(0, lambda: self.update_connection_status(connected))
         
         # Запускаем в отдельном потоке
         threading.Thread(target=connect, daemon=True).start()
@@ -694,6 +713,11 @@ class ModernMessengerApp:
                 self.status_label.config(text="🔴 Сервер отключен", fg=Config.THEME['danger'])
     
     def check_server_status(self, callback):
+        # Есть живое соединение — пробный сокет не нужен
+        if self.server_connected:
+            callback(True)
+            return
+        
         def check():
             try:
                 test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -708,21 +732,9 @@ class ModernMessengerApp:
     
     def connect_to_server(self):
         """Подключение к серверу (для повторных попыток)"""
-        try:
-            if self.client_socket:
-                self.client_socket.close()
-            
-            self.client_socket = socket.socket()
-            self.client_socket.settimeout(10)
-            self.client_socket.connect((Config.SERVER_HOST, Config.SERVER_PORT))
-            welcome = self.client_socket.recv(1024).decode('utf-8')
-            print(f"Подключение: {welcome}")
-            self.update_connection_status(True)
-            return True
-        except Exception as e:
-            print(f"Connection error: {e}")
-            self.update_connection_status(False)
-            return False
+        connected = self.open_connection(10)
+        self.update_connection_status(connected)
+        return connected
     
     def register(self):
         """Регистрация нового пользователя"""
@@ -754,8 +766,8 @@ class ModernMessengerApp:
         
         try:
             # Отправляем запрос на регистрацию
-            self.client_socket.send(f"REGISTER:{username}:{password}".encode('utf-8'))
-            response = self.client_socket.recv(1024).decode('utf-8')
+            self.client_socket.send(f"REGISTER:{username}:{password}")
+            response = self.client_socket.recv_frame().decode('utf-8')
             
             if response == "OK":
                 messagebox.showinfo("Успех", "Регистрация прошла успешно! Теперь вы можете войти.")
@@ -783,8 +795,8 @@ class ModernMessengerApp:
         
         try:
             # Отправляем credentials
-            self.client_socket.send(f"LOGIN:{username}:{password}".encode('utf-8'))
-            response = self.client_socket.recv(1024).decode('utf-8')
+            self.client_socket.send(f"LOGIN:{username}:{password}")
+            response = self.client_socket.recv_frame().decode('utf-8')
             
             if response == "OK":
                 self.current_user = username
@@ -797,37 +809,90 @@ class ModernMessengerApp:
             messagebox.showerror("Ошибка", f"Ошибка при входе: {str(e)}")
     
     def start_receive_thread(self):
+        # Таймаут нужен только на время подключения — иначе поток приёма отвалится на первой паузе в чате
+        self.client_socket.settimeout(None)
         self.receive_thread = threading.Thread(target=self.receive_messages, daemon=True)
         self.receive_thread.start()
     
     def receive_messages(self):
         while True:
             try:
-                msg = self.client_socket.recv(4096).decode('utf-8')
-                if not msg: 
+                frame = self.client_socket.recv_frame()
+                if frame is None:
                     break
+                if frame[:1] == wire.MARK:
+                    # Двоичный кадр сообщения — разбираем здесь же, в потоке приёма
+                    self.root.after(0, lambda d=wire.decode(frame): self.handle_chat_message(*d))
+                    continue
+                msg = frame.decode('utf-8')
+                if msg.startswith("SESSION:"):
+                    self.session_token = msg[8:]
+                    continue
                 self.root.after(0, lambda m=msg: self.handle_server_message(m))
             except Exception as e:
                 print(f"Receive error: {e}")
                 break
+        self.root.after(0, lambda: self.update_connection_status(False))
+        if self.current_user and self.session_token:
+            self.resume_session()
+    
+    def resume_session(self):
+        """После обрыва переподключается по токену: без пароля, сервер досылает
+        только сообщения новее last_seen_id"""
+        def reconnect():
+            delay = 1
+            while self.current_user and self.session_token:
+                if self.open_connection(10):
+                    try:
+                        self.client_socket.send(f"RESUME:{self.session_token}:{self.last_seen_id}")
+                        response = self.client_socket.recv_frame()
+                    except OSError:
+                        response = None
+                    if response == b"OK":
+                        self.root.after(0, lambda: self.update_connection_status(True))
+                        self.start_receive_thread()
+                        return
+                    if response == b"FAIL":
+                        # Токен истёк или сервер сменил секрет — нужен обычный вход
+                        self.session_token = None
+                        return
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+        
+        threading.Thread(target=reconnect, daemon=True).start()
+    
+    def is_new_message(self, data):
+        """Запоминает id; повтор (досылка после RESUME) отбрасывается"""
+        msg_id = data.get('id')
+        if msg_id is None:
+            return True
+        if msg_id in self.seen_ids:
+            return False
+        if len(self.seen_ids) > 10000:
+            self.seen_ids.clear()
+        self.seen_ids.add(msg_id)
+        if str(msg_id).isdigit():
+            self.last_seen_id = max(self.last_seen_id, int(msg_id))
+        return True
     
     def handle_server_message(self, msg):
         print(f"Received: {msg}")
-        if msg.startswith("MSG:"):
-            try:
-                data = json.loads(msg[4:])
-                if self.current_chat_type == "public":
-                    self.display_message(data)
-            except json.JSONDecodeError:
-                print("Invalid JSON received")
-        elif msg.startswith("PRIVATE:"):
-            parts = msg[8:].split(':', 1)
-            if len(parts) == 2 and parts[0] == self.current_private_chat_with:
-                self.display_message(json.loads(parts[1]))
-        elif msg.startswith("CHANNEL:"):
-            parts = msg[8:].split(':', 2)
-            if len(parts) == 3 and parts[0] == self.current_channel_id and parts[1] == "MSG":
-                self.display_message(json.loads(parts[2]))
+        try:
+            parsed = wire.parse_text(msg)
+        except ValueError:
+            print("Invalid JSON received")
+            return
+        if parsed:
+            self.handle_chat_message(*parsed)
+    
+    def handle_chat_message(self, kind, target, data):
+        """Сообщение чата из текстового или двоичного кадра (см. wire.py)"""
+        if kind == 'HISTORY' or not self.is_new_message(data):
+            return
+        if (kind == 'MSG' and self.current_chat_type == "public"
+                or kind == 'PRIVATE' and target == self.current_private_chat_with
+                or kind == 'CHANNEL' and target == self.current_channel_id):
+            self.display_message(data)
     
     def display_message(self, msg):
         if not hasattr(self, 'scrollable_frame'):
@@ -857,11 +922,11 @@ class ModernMessengerApp:
         
         try:
             if self.current_chat_type == "public":
-                self.client_socket.send(f"MSG:{text}".encode('utf-8'))
+                self.client_socket.send(f"MSG:{text}")
             elif self.current_chat_type == "private":
-                self.client_socket.send(f"PRIVATE:{self.current_private_chat_with}:{text}".encode('utf-8'))
+                self.client_socket.send(f"PRIVATE:{self.current_private_chat_with}:{text}")
             elif self.current_chat_type == "channel":
-                self.client_socket.send(f"CHANNEL:{self.current_channel_id}:MSG:{text}".encode('utf-8'))
+                self.client_socket.send(f"CHANNEL:{self.current_channel_id}:MSG:{text}")
             
             self.message_entry.delete(0, tk.END)
             
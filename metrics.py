@@ -0,0 +1,244 @@
+# metrics.py — счётчики и гистограммы сервера Tandau в формате Prometheus
+#
+# Что видно (имена метрик — ниже, у их определений):
+#   кадры от клиентов и клиентам по видам (MSG, PRIVATE, HISTORY, ... — что до
+#   первого двоеточия; bin1 — по виду в заголовке) и их байты; в тех же байтах —
+#   тела загрузок и скачиваний, которые идут мимо кадров (sendfile и т. п.);
+#   размер рассылки — сколько получателей у одного сообщения или служебного кадра;
+#   задержка сохранения — от MessageLog.write() до подтверждения пачки (Commit.done);
+#   ожидание блокировок locks.py — clients, channels и блокировок переписок;
+#   глубина исходящей очереди соединения сразу после постановки кадра.
+# Плюс мгновенные значения, которые считаются при чтении (Gauge): соединения,
+# кадры во всех очередях, самая длинная очередь.
+#
+# Отдаётся текстом Prometheus (render) по HTTP на локальном порту администратора
+# (serve, --metrics-port): GET /metrics. В режиме воркеров у каждого процесса
+# свой порт — см. cluster.worker_argv.
+#
+# Событие на горячем пути стоит одну блокировку и пару операций со словарём
+# (benchmarks/bench_metrics.py: 0.4–0.9 мкс при ~0.3 мкс на голый `with Lock`):
+# метрики, которые меняются вместе (кадр клиенту — вид, байты и глубина
+# очереди), делят одну блокировку и обновляются под ней разом (frame_out).
+# Гистограммы — с фиксированными границами, без квантилей: bisect и +1 в списке.
+# Свободные блокировки locks.py общую блокировку метрик не трогают вовсе (LockWaits).
+import threading
+import weakref
+from collections import defaultdict
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from framing import HEADER
+import wire
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Виды кадров — значения метки type; всё остальное считается как other, чтобы
+# произвольный текст от клиента не плодил рядов
+COMMANDS = ('MSG', 'PRIVATE', 'CHANNEL', 'HISTORY', 'SEARCH', 'DELETE', 'DELETED', 'CLEAR', 'CLEARED',
+            'STATS', 'UNSAVED', 'FILE', 'PRESENCE', 'ONLINE', 'OFFLINE', 'THROTTLED', 'SESSION', 'RESUMED',
+            'LOGIN', 'RESUME', 'UPLOAD', 'DOWNLOAD', 'OK', 'FAIL', 'EXISTS', 'DONE', 'COMPRESS', 'ENCODING')
+COMMAND_NAMES = {name: name for name in COMMANDS}
+COMMAND_NAMES.update({name.encode('ascii'): name for name in COMMANDS})
+NAME_LIMIT = 12
+BIN1 = wire.MARK[0]
+
+# Границы гистограмм: секунды и штуки
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+LOCK_BUCKETS = (0, 0.000001, 0.00001, 0.0001, 0.001, 0.01, 0.1, 1)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+def command(text):
+    """Вид кадра до заголовка длины (str, bytes или bin1 из wire.encode) — метка type"""
+    if isinstance(text, str):
+        end = text.find(':', 0, NAME_LIMIT)
+    elif text[:1] == wire.MARK:
+        return wire.KIND_NAMES.get(text[1], 'other') if len(text) > 1 else 'other'
+    else:
+        end = text.find(b':', 0, NAME_LIMIT)
+    return COMMAND_NAMES.get(text[:end] if end > 0 else text[:NAME_LIMIT], 'other')
+
+def frame_command(frame):
+    """Вид готового кадра (с заголовком длины): текст или bin1 (сжатые — compressed)"""
+    head = bytes(frame[HEADER.size:HEADER.size + NAME_LIMIT])
+    first = head[0] if head else None
+    if first == BIN1:
+        return wire.KIND_NAMES.get(head[1], 'other') if len(head) > 1 else 'other'
+    if first == 0:
+        return 'compressed'
+    end = head.find(b':')
+    return COMMAND_NAMES.get(head[:end] if end > 0 else head, 'other')
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def number(value):
+    if isinstance(value, float):
+        return repr(value) if value == value and abs(value) != float('inf') else ('+Inf' if value > 0 else 'NaN')
+    return str(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, label=None, lock=None):
+        self.name = name
+        self.help = help
+        # Имя метки (одной) или None; значения — ключи rows
+        self.label = label
+        self.lock = lock or threading.Lock()
+        self.rows = {}
+        REGISTRY.append(self)
+
+    def labels(self, value, extra=''):
+        parts = []
+        if self.label is not None:
+            parts.append(f'{self.label}="{escape(value)}"')
+        if extra:
+            parts.append(extra)
+        return '{' + ','.join(parts) + '}' if parts else ''
+
+    def snapshot(self):
+        with self.lock:
+            return {label: list(row) if isinstance(row, list) else row for label, row in self.rows.items()}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples(self.snapshot()))
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, label=None, lock=None):
+        super().__init__(name, help, label, lock)
+        # Горячий путь (frame_in/frame_out) пишет rows[label] += n под self.lock сам
+        self.rows = defaultdict(int)
+
+    def inc(self, label=None, value=1):
+        with self.lock:
+            self.rows[label] += value
+
+    def samples(self, rows):
+        if not rows and self.label is None:
+            rows = {None: 0}
+        return [f'{self.name}{self.labels(label)} {number(value)}' for label, value in sorted(rows.items(), key=sort_key)]
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets, label=None, lock=None):
+        super().__init__(name, help, label, lock)
+        self.bounds = tuple(buckets)
+
+    def observe(self, value, label=None):
+        with self.lock:
+            self.put(value, label)
+
+    def put(self, value, label=None):
+        """observe() без блокировки. Строка: счётчики корзин (последняя — +Inf) и сумма."""
+        row = self.rows.get(label)
+        if row is None:
+            row = self.rows[label] = [0] * (len(self.bounds) + 2)
+        row[bisect_left(self.bounds, value)] += 1
+        row[-1] += value
+
+    def samples(self, rows):
+        if not rows and self.label is None:
+            rows = {None: [0] * (len(self.bounds) + 2)}
+        lines = []
+        les = [f'le="{number(float(bound))}"' for bound in self.bounds + (float('inf'),)]
+        for label, row in sorted(rows.items(), key=sort_key):
+            total = 0
+            for le, count in zip(les, row):
+                total += count
+                lines.append(f'{self.name}_bucket{self.labels(label, le)} {total}')
+            lines.append(f'{self.name}_sum{self.labels(label)} {number(row[-1])}')
+            lines.append(f'{self.name}_count{self.labels(label)} {total}')
+        return lines
+
+class LockWaits(Histogram):
+    """Ожидание блокировок. Захваты без ожидания TimedLock (locks.py) считает сам,
+    под только что захваченной блокировкой, — общая блокировка метрик не нужна;
+    при чтении они добавляются в корзину le=0. Блокировок конечное число
+    (locks.STRIPES на переписки), брошенные — уходят из timers сами."""
+    def __init__(self, name, help, buckets, label=None):
+        super().__init__(name, help, buckets, label)
+        self.timers = weakref.WeakSet()
+
+    def snapshot(self):
+        rows = super().snapshot()
+        for timer in list(self.timers):
+            if timer.free:
+                row = rows.setdefault(timer.name, [0] * (len(self.bounds) + 2))
+                row[0] += timer.free
+        return rows
+
+class Gauge(Metric):
+    """Мгновенное значение: функция зовётся при каждом чтении метрик"""
+    kind = 'gauge'
+
+    def __init__(self, name, help, read=None):
+        super().__init__(name, help)
+        self.read = read
+
+    def render(self):
+        value = self.read() if self.read else 0
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge', f'{self.name} {number(value)}']
+
+def sort_key(item):
+    return '' if item[0] is None else str(item[0])
+
+REGISTRY = []
+
+IN_LOCK = threading.Lock()
+messages_in = Counter('tandau_frames_in_total', 'Кадры от клиентов по видам', 'type', IN_LOCK)
+bytes_in = Counter('tandau_bytes_in_total', 'Байты от клиентов: кадры (с заголовком длины) и тела загрузок', lock=IN_LOCK)
+# Кадр клиенту: вид, байты и глубина очереди — под одной блокировкой (frame_out)
+OUT_LOCK = threading.Lock()
+messages_out = Counter('tandau_frames_out_total', 'Кадры клиентам по видам', 'type', OUT_LOCK)
+bytes_out = Counter('tandau_bytes_out_total', 'Байты клиентам: кадры в исходящих очередях и тела скачиваний', lock=OUT_LOCK)
+send_queue_depth = Histogram('tandau_send_queue_depth', 'Глубина исходящей очереди соединения после постановки кадра',
+                             SIZE_BUCKETS, lock=OUT_LOCK)
+fanout = Histogram('tandau_fanout_recipients', 'Получателей у одной рассылки', SIZE_BUCKETS, 'kind')
+persist_seconds = Histogram('tandau_persist_seconds', 'От записи в журнал до подтверждения пачки', LATENCY_BUCKETS)
+lock_wait_seconds = LockWaits('tandau_lock_wait_seconds', 'Ожидание блокировок locks.py', LOCK_BUCKETS, 'lock')
+
+def frame_in(kind, size, types=messages_in.rows, total=bytes_in.rows):
+    with IN_LOCK:
+        types[kind] += 1
+        total[None] += size
+
+def frame_out(kind, size, depth, types=messages_out.rows, total=bytes_out.rows, put=send_queue_depth.put):
+    with OUT_LOCK:
+        types[kind] += 1
+        total[None] += size
+        put(depth)
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Prometheus опрашивает каждые несколько секунд — в консоль сервера не пишем
+        pass
+
+def serve(port, host='127.0.0.1'):
+    """HTTP /metrics в фоновом потоке; по умолчанию только с этой машины"""
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    print(f"[METRICS] http://{host}:{httpd.server_address[1]}/metrics")
+    return httpd
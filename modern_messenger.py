@@ -1131,7 +1131,8 @@ class ModernMessengerApp:
             widget.destroy()
         
         if messages:
-            for msg in messages[-50:]:
+            # Страница истории уже ограничена сервером (limit в HISTORY:)
+            for msg in messages:
                 if not isinstance(msg, dict):
                     continue
                 
@@ -0,0 +1,250 @@
+# outbound.py — исходящие очереди соединений с ограничением размера
+#
+# broadcast() и обработчики больше не пишут в сокет сами: send() кладёт кадр
+# в очередь соединения и сразу возвращается, а очередь разбирает свой писатель
+# (поток в threaded-режиме, задача в asyncio). Медленный читатель копит только
+# свою очередь. Что делать при переполнении, решает политика (OVERFLOW_POLICIES):
+#   drop_oldest — выбросить самый старый кадр;
+#   disconnect  — разорвать соединение, клиент переподключится;
+#   coalesce    — склеить кадры присутствия (PRESENCE:-дельты и ONLINE:/OFFLINE:)
+#                 в одну дельту, где у каждого пользователя последнее состояние;
+#                 если склеивать нечего — разорвать соединение.
+# Каждый поставленный кадр учитывается в metrics.frame_out: вид, байты и глубина
+# очереди после постановки. Вид берётся из текста до сжатия (send), от рассылки
+# (send_frame(frame, kind)) или из заголовка готового кадра.
+import asyncio
+import json
+import socket
+import threading
+from collections import deque
+
+from framing import FramedSocket, HEADER, encode_frame, send_buffers
+import metrics
+
+QUEUE_LIMIT = 1024
+OVERFLOW_POLICIES = ('drop_oldest', 'disconnect', 'coalesce')
+PRESENCE_PREFIXES = ((b'ONLINE:', True), (b'OFFLINE:', False))
+DELTA_PREFIX = b'PRESENCE:'
+
+def presence_state(frame):
+    """{пользователь: в сети} из кадра присутствия или None для остальных кадров.
+    Рассылки не сжимаются (shared_frame), так что кадр присутствия — всегда текст."""
+    head = bytes(frame[HEADER.size:HEADER.size + len(DELTA_PREFIX)])
+    if head.startswith(DELTA_PREFIX):
+        try:
+            delta = json.loads(bytes(frame[HEADER.size + len(DELTA_PREFIX):]))
+        except ValueError:
+            return None
+        state = dict.fromkeys(delta.get('online', ()), True)
+        state.update(dict.fromkeys(delta.get('offline', ()), False))
+        return state
+    for prefix, online in PRESENCE_PREFIXES:
+        if head.startswith(prefix):
+            return {bytes(frame[HEADER.size + len(prefix):]).decode('utf-8'): online}
+    return None
+
+def presence_frame(state):
+    """Одна PRESENCE:-дельта из склеенного состояния"""
+    delta = {'online': [u for u, on in state.items() if on],
+             'offline': [u for u, on in state.items() if not on]}
+    return encode_frame(f"PRESENCE:{json.dumps(delta, ensure_ascii=False)}".encode('utf-8'))
+
+class OutboundQueue:
+    """Ограниченная очередь исходящих кадров без привязки к транспорту.
+    Хранит готовые кадры: при рассылке это один общий буфер на всех получателей."""
+    def __init__(self, limit=QUEUE_LIMIT, policy='drop_oldest'):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Неизвестная политика переполнения: {policy}")
+        self.limit = limit
+        self.policy = policy
+        self.items = deque()
+        self.dropped = 0
+
+    def push(self, frame):
+        """Добавляет кадр. False — очередь переполнена и соединение надо закрыть."""
+        if len(self.items) >= self.limit:
+            if self.policy == 'drop_oldest':
+                self.items.popleft()
+                self.dropped += 1
+            elif self.policy == 'coalesce':
+                frame = self.coalesce(frame)
+                if frame is None:
+                    return False
+            else:
+                return False
+        self.items.append(frame)
+        return True
+
+    def coalesce(self, frame):
+        """Освобождает место, склеивая кадры присутствия. Дельты применяются по
+        порядку, поэтому склейка двух — это их объединение, где у пользователя
+        остаётся более позднее состояние. Возвращает кадр, который надо поставить
+        в конец очереди, или None, если склеивать нечего."""
+        state = presence_state(frame)
+        queued = [i for i, item in enumerate(self.items) if presence_state(item) is not None]
+        if state is not None and queued:
+            # Новый кадр присутствия вбирает последний из очереди и встаёт в конец
+            i = queued[-1]
+            merged = presence_state(self.items[i])
+            merged.update(state)
+            del self.items[i]
+            self.dropped += 1
+            return presence_frame(merged)
+        if len(queued) >= 2:
+            # Кадр другого вида: место освобождает склейка двух кадров присутствия
+            first, second = queued[-2], queued[-1]
+            merged = presence_state(self.items[first])
+            merged.update(presence_state(self.items[second]))
+            self.items[second] = presence_frame(merged)
+            del self.items[first]
+            self.dropped += 1
+            return frame
+        return None
+
+    def take_all(self):
+        """Забирает все накопленные кадры — писатель отдаёт их одним sendmsg/writelines"""
+        frames = list(self.items)
+        self.items.clear()
+        return frames
+
+    def __len__(self):
+        return len(self.items)
+
+class QueuedConnection(FramedSocket):
+    """Threaded-режим: приём как у FramedSocket, отправка — через очередь и поток-писатель"""
+    def __init__(self, sock, limit=QUEUE_LIMIT, policy='drop_oldest'):
+        super().__init__(sock)
+        self.outbox = OutboundQueue(limit, policy)
+        self.ready = threading.Condition()
+        self.closed = False
+        # Что клиент согласовал до входа: сжатие (compression.pack) и кадры bin1 (wire.py)
+        self.deflate = None
+        self.binary = False
+        self.writer = threading.Thread(target=self.writer_loop, daemon=True)
+        self.writer.start()
+
+    def send(self, payload):
+        kind = metrics.command(payload)
+        if self.deflate:
+            payload = self.deflate(payload)
+        return self.queue_frame(encode_frame(payload), kind)
+
+    def send_frame(self, frame, kind=None):
+        # Рассылка знает вид кадра заранее и не разбирает заголовок на каждого получателя
+        return self.queue_frame(frame, kind or metrics.frame_command(frame))
+
+    def queue_frame(self, frame, kind):
+        with self.ready:
+            if self.closed:
+                return 0
+            if not self.outbox.push(frame):
+                self.abort()
+                return 0
+            depth = len(self.outbox)
+            self.ready.notify()
+        metrics.frame_out(kind, len(frame), depth)
+        return len(frame)
+
+    def writer_loop(self):
+        while True:
+            with self.ready:
+                while not self.outbox and not self.closed:
+                    self.ready.wait()
+                if not self.outbox and self.closed:
+                    return
+                frames = self.outbox.take_all()
+            try:
+                send_buffers(self.sock, frames)
+            except OSError:
+                self.abort()
+                return
+
+    def abort(self):
+        # shutdown будит recv() в потоке handle_client, тот снимает пользователя с учёта
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def stop_writer(self):
+        """Дожидается отправки очереди и останавливает писателя —
+        дальше в сокет пишет сам вызывающий (например, sendfile())"""
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+        self.writer.join()
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+        self.writer.join(timeout=1)
+        self.sock.close()
+
+class AsyncQueuedConnection:
+    """asyncio-режим: send() из обработчиков кладёт кадр в очередь, задача-писатель
+    отдаёт её транспорту и ждёт drain(), не раздувая буфер медленного клиента.
+    send() из другого потока (aio_server.OFFLOADED) передаёт кадр в event loop."""
+    def __init__(self, writer, limit=QUEUE_LIMIT, policy='drop_oldest'):
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.thread = threading.get_ident()
+        self.outbox = OutboundQueue(limit, policy)
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.deflate = None
+        self.binary = False
+        self.task = asyncio.get_running_loop().create_task(self.writer_loop())
+
+    def send(self, payload):
+        kind = metrics.command(payload)
+        if self.deflate:
+            payload = self.deflate(payload)
+        return self.queue_frame(encode_frame(payload), kind)
+
+    def send_frame(self, frame, kind=None):
+        return self.queue_frame(frame, kind or metrics.frame_command(frame))
+
+    def queue_frame(self, frame, kind):
+        if threading.get_ident() != self.thread:
+            self.loop.call_soon_threadsafe(self.queue_frame, frame, kind)
+            return len(frame)
+        if self.closed:
+            return 0
+        if not self.outbox.push(frame):
+            self.abort()
+            return 0
+        self.ready.set()
+        metrics.frame_out(kind, len(frame), len(self.outbox))
+        return len(frame)
+
+    async def writer_loop(self):
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                if self.outbox:
+                    self.writer.writelines(self.outbox.take_all())
+                    await self.writer.drain()
+        except (ConnectionError, OSError):
+            self.abort()
+
+    async def flush(self):
+        """Отдаёт очередь транспорту и ждёт, пока клиент её примет"""
+        if self.outbox and not self.closed:
+            self.writer.writelines(self.outbox.take_all())
+        await self.writer.drain()
+
+    def abort(self):
+        self.closed = True
+        self.ready.set()
+        self.writer.transport.abort()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+        # Хвост очереди отдаём транспорту: close() допишет буфер перед закрытием
+        if self.outbox:
+            self.writer.writelines(self.outbox.take_all())
+        self.writer.close()
@@ -0,0 +1,55 @@
+# presence.py — агрегатор событий присутствия
+#
+# Раньше каждый вход и выход рассылался всем сразу (ONLINE:/OFFLINE: — O(N)
+# отправок на событие), и после рестарта сервера N переподключений давали
+# O(N²) кадров. Теперь изменения копятся INTERVAL секунд и уходят одним
+# кадром-дельтой:
+#
+#   PRESENCE:{"online": ["a", "b"], "offline": ["c"]}
+#
+# Пользователь, который за окно успел выйти и вернуться, схлопывается до
+# итогового состояния; если оно совпадает с уже разосланным — в дельту не
+# попадает вовсе. interval=0 — старое поведение: ONLINE:/OFFLINE: сразу.
+import json
+import threading
+
+INTERVAL = 0.25
+
+def thread_timer(delay, fn):
+    timer = threading.Timer(delay, fn)
+    timer.daemon = True
+    timer.start()
+
+class PresenceAggregator:
+    def __init__(self, publish, interval=INTERVAL):
+        # publish(text) — как разослать кадр (server.announce);
+        # call_later(delay, fn) — таймер; aio_server подменяет на loop.call_later
+        self.publish = publish
+        self.interval = interval
+        self.call_later = thread_timer
+        self.pending = {}
+        self.visible = set()
+        self.armed = False
+        self.lock = threading.Lock()
+
+    def changed(self, user, online):
+        if not self.interval:
+            self.publish(f"{'ONLINE' if online else 'OFFLINE'}:{user}")
+            return
+        with self.lock:
+            self.pending[user] = online
+            if self.armed:
+                return
+            self.armed = True
+        self.call_later(self.interval, self.flush)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.armed = False
+            online = [u for u, on in pending.items() if on and u not in self.visible]
+            offline = [u for u, on in pending.items() if not on and u in self.visible]
+            self.visible.update(online)
+            self.visible.difference_update(offline)
+        if online or offline:
+            self.publish(f"PRESENCE:{json.dumps({'online': online, 'offline': offline}, ensure_ascii=False)}")
@@ -0,0 +1,114 @@
+# ratelimit.py — ограничение частоты действий (token bucket)
+#
+# Каждое действие берёт жетон из двух вёдер: пользователя и его IP (с одного
+# адреса может сидеть несколько аккаунтов, а один аккаунт — с разных
+# адресов). Вёдра раздельные по видам действий (LIMITS):
+#   message — MSG: и PRIVATE:;
+#   channel — сообщения в канал (CHANNEL:<id>:MSG:);
+#   upload  — загрузка файла (UPLOAD: и FILE:);
+#   search  — поиск по истории (SEARCH:).
+# Ведро пополняется со скоростью rate жетонов в секунду до burst.
+# Что делать с нарушителем, решает политика (RATE_POLICIES):
+#   throttle   — действие отбрасывается, клиент получает THROTTLED:<вид>:<мс до жетона>
+#                (один раз, пока снова не уложится в лимит);
+#   disconnect — соединение разрывается;
+#   off        — без ограничений.
+# Счётчики отказов (hits) — для мониторинга, см. STATS: в server.py.
+import threading
+import time
+from collections import deque
+
+RATE_POLICIES = ('throttle', 'disconnect', 'off')
+
+# вид → {область: (жетонов в секунду, ёмкость ведра)}
+LIMITS = {
+    'message': {'user': (5, 20), 'ip': (20, 100)},
+    'channel': {'user': (2, 10), 'ip': (10, 50)},
+    'upload': {'user': (0.2, 5), 'ip': (1, 20)},
+    'search': {'user': (1, 10), 'ip': (5, 30)}
+}
+
+# Полные вёдра ничего не помнят — их можно выбросить, когда вёдер стало много.
+# Чистка идёт по кругу: новое ведро проверяет не больше PRUNE_BATCH старых,
+# чтобы под общей блокировкой не перебирать все вёдра разом.
+PRUNE_ABOVE = 100000
+PRUNE_BATCH = 64
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Секунды до следующего жетона"""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+class RateLimiter:
+    def __init__(self, limits=LIMITS, policy='throttle'):
+        if policy not in RATE_POLICIES:
+            raise ValueError(f"Неизвестная политика ограничения: {policy}")
+        self.limits = limits
+        self.policy = policy
+        self.buckets = {}
+        # Ключи вёдер в порядке обхода чистки
+        self.prune_order = deque()
+        self.hits = {(kind, scope): 0 for kind, scopes in limits.items() for scope in scopes}
+        self.allowed = {kind: 0 for kind in limits}
+        self.lock = threading.Lock()
+
+    def check(self, kind, user, ip):
+        """Берёт жетон из вёдер пользователя и IP. Возвращает 0, если действие
+        разрешено, иначе — секунды до следующего жетона."""
+        if self.policy == 'off':
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            buckets = []
+            for scope, key in (('user', user), ('ip', ip)):
+                rate, burst = self.limits[kind][scope]
+                bucket = self.buckets.get((kind, scope, key))
+                if bucket is None:
+                    if len(self.buckets) >= PRUNE_ABOVE:
+                        self.prune(now)
+                    bucket = self.buckets[(kind, scope, key)] = TokenBucket(rate, burst, now)
+                    self.prune_order.append((kind, scope, key))
+                bucket.refill(now)
+                if bucket.tokens < 1:
+                    self.hits[(kind, scope)] += 1
+                    return bucket.wait_time()
+                buckets.append(bucket)
+            # Жетон списывается, только если хватило обоим вёдрам
+            for bucket in buckets:
+                bucket.tokens -= 1
+            self.allowed[kind] += 1
+            return 0
+
+    def prune(self, now):
+        """Проверяет до PRUNE_BATCH вёдер с начала круга: полные выбрасывает,
+        остальные переносит в конец"""
+        order = self.prune_order
+        for _ in range(min(PRUNE_BATCH, len(order))):
+            key = order.popleft()
+            bucket = self.buckets[key]
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self.buckets[key]
+            else:
+                order.append(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'policy': self.policy,
+                'allowed': dict(self.allowed),
+                'rejected': {f"{kind}/{scope}": n for (kind, scope), n in self.hits.items()},
+                'buckets': len(self.buckets)
+            }
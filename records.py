@@ -0,0 +1,144 @@
+# records.py — компактное представление сообщения в памяти сервера
+#
+# История в message_log держится в памяти целиком, и dict на сообщение стоит
+# дорого: сам словарь (~180 байт), свои копии строк user, timestamp и id у каждого
+# сообщения, прочитанного из JSON (~60–80 байт каждая). Message хранит то же в
+# __slots__:
+#   id        int для числовых id (ids.py), строка для прочих, None — поля нет
+#   user      строка через sys.intern — одна копия на пользователя
+#   text      поле message
+#   time      микросекунды от 1970-01-01 по тем же настенным часам, что и
+#             datetime.now().isoformat() (без часового пояса); строка, если
+#             timestamp в другом виде
+#   is_admin  True / False / None — поля нет
+#   extra     прочие поля (image, reply_to, ...) или None
+# Наружу (страницы истории, досылка, снимок) сообщение уходит обратно dict'ом
+# (to_dict) — JSON на проводе и на диске не меняется.
+import sys
+from datetime import date, timedelta
+
+EPOCH = date(1970, 1, 1)
+
+# Разбор и сборка ISO-строки через datetime стоят ~3 мкс на сообщение. Время
+# собирается из кусков: дата — из кэша (одна строка на день истории), часы и
+# минуты:секунды — из готовых таблиц.
+DAY_PREFIXES = {}   # номер дня → 'YYYY-MM-DDT'
+DAYS = {}           # 'YYYY-MM-DDT' → номер дня
+HOURS = ['%02d:' % h for h in range(24)]
+MINUTES = ['%02d:%02d' % divmod(i, 60) for i in range(3600)]
+HOUR_SECONDS = {text: h * 3600 for h, text in enumerate(HOURS)}
+MINUTE_SECONDS = {text: i for i, text in enumerate(MINUTES)}
+
+# Поля, у которых есть слот; остальные — в extra
+FIELDS = ('user', 'message', 'timestamp', 'is_admin', 'id')
+
+def pack_id(value):
+    """id сообщения → ключ в памяти: число, если это каноническая десятичная запись"""
+    if isinstance(value, str) and value.isascii() and value.isdigit() and (value[0] != '0' or value == '0'):
+        return int(value)
+    return value
+
+def unpack_id(value):
+    return str(value) if isinstance(value, int) else value
+
+def day_of(prefix):
+    """'YYYY-MM-DDT' → номер дня от EPOCH или None, если строка не такая"""
+    try:
+        day = date.fromisoformat(prefix[:10])
+    except ValueError:
+        return None
+    if prefix[10:] != 'T' or day.isoformat() != prefix[:10]:
+        return None
+    number = (day - EPOCH).days
+    DAYS[prefix] = number
+    DAY_PREFIXES[number] = prefix
+    return number
+
+def pack_time(value):
+    """ISO-время без часового пояса → int; всё, что не восстановится байт в байт, остаётся строкой"""
+    day = DAYS.get(value[:11])
+    if day is None:
+        day = day_of(value[:11])
+    hour = HOUR_SECONDS.get(value[11:14])
+    minute = MINUTE_SECONDS.get(value[14:19])
+    if day is None or hour is None or minute is None:
+        return value
+    second = day * 86400 + hour + minute
+    if len(value) == 19:
+        return second * 1000000
+    # isoformat() пишет микросекунды, только если они не нулевые
+    digits = value[20:]
+    if len(value) == 26 and value[19] == '.' and digits.isdigit() and digits.isascii() and digits != '000000':
+        return second * 1000000 + int(digits)
+    return value
+
+def unpack_time(value):
+    if not isinstance(value, int):
+        return value
+    second, micro = divmod(value, 1000000)
+    day, second = divmod(second, 86400)
+    prefix = DAY_PREFIXES.get(day)
+    if prefix is None:
+        prefix = (EPOCH + timedelta(day)).isoformat() + 'T'
+        DAYS[prefix] = day
+        DAY_PREFIXES[day] = prefix
+    hour, second = divmod(second, 3600)
+    text = prefix + HOURS[hour] + MINUTES[second]
+    return f"{text}.{micro:06d}" if micro else text
+
+class Message:
+    __slots__ = ('id', 'user', 'text', 'time', 'is_admin', 'extra')
+
+    def __init__(self, msg):
+        get = msg.get
+        user, text, timestamp, is_admin, msg_id = get('user'), get('message'), get('timestamp'), get('is_admin'), get('id')
+        self.user = sys.intern(user) if isinstance(user, str) else None
+        self.text = text if isinstance(text, str) else None
+        self.time = pack_time(timestamp) if isinstance(timestamp, str) else None
+        self.is_admin = is_admin if isinstance(is_admin, bool) else None
+        self.id = pack_id(msg_id) if isinstance(msg_id, str) else None
+        self.extra = None
+        kept = ((self.user is not None) + (self.text is not None) + (self.time is not None)
+                + (self.is_admin is not None) + (self.id is not None))
+        if kept < len(msg):
+            # Лишние поля или поля не того типа — как есть, в extra
+            self.extra = {key: value for key, value in msg.items()
+                          if key not in FIELDS or not isinstance(value, bool if key == 'is_admin' else str)}
+
+    def to_dict(self):
+        """Сообщение в том виде, в каком его создал server.handle_*"""
+        msg = {}
+        if self.user is not None:
+            msg['user'] = self.user
+        if self.text is not None:
+            msg['message'] = self.text
+        if self.time is not None:
+            msg['timestamp'] = unpack_time(self.time)
+        if self.is_admin is not None:
+            msg['is_admin'] = self.is_admin
+        if self.id is not None:
+            msg['id'] = unpack_id(self.id)
+        if self.extra:
+            msg.update(self.extra)
+        return msg
+
+def pack(msg):
+    return msg if isinstance(msg, Message) else Message(msg)
+
+def unpack_list(messages):
+    return [m.to_dict() for m in messages]
+
+def pack_state(state):
+    """Состояние message_log (messages / private / channel_msgs) из dict'ов в Message"""
+    return {
+        'messages': [pack(m) for m in state['messages']],
+        'private': {k: [pack(m) for m in v] for k, v in state['private'].items()},
+        'channel_msgs': {k: [pack(m) for m in v] for k, v in state['channel_msgs'].items()}
+    }
+
+def unpack_state(state):
+    return {
+        'messages': unpack_list(state['messages']),
+        'private': {k: unpack_list(v) for k, v in state['private'].items()},
+        'channel_msgs': {k: unpack_list(v) for k, v in state['channel_msgs'].items()}
+    }
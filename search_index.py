@@ -0,0 +1,396 @@
+# search_index.py — полнотекстовый поиск по истории сервера
+#
+# Обратный индекс: термин → возрастающий список номеров документов (doc), где
+# документ — сообщение переписки в порядке поступления. Для каждого doc хранятся
+# номер переписки (convs) и id сообщения (ids), поэтому выдача идёт от новых к
+# старым простым проходом по спискам с конца, а курсор страницы — номер doc.
+#
+# Токены — слова (\w+) в нижнем регистре, ё → е. Русские слова приводятся к
+# основе отбрасыванием падежного окончания (stem), чтобы «сообщения» находили
+# «сообщение» и «сообщением». Однобуквенные слова и служебные (STOP_WORDS) не
+# индексируются. Запрос — все его термины сразу (AND).
+#
+# Индекс пополняет MessageLog.apply_locked (под блокировкой журнала): added —
+# новое сообщение, deleted — документ помечается мёртвым, cleared — переписка
+# получает новый номер, а документы старого становятся невидимы. Что убрал срок
+# хранения и что удалено после последнего сохранения индекса, отсеивается при
+# выдаче: MessageLog.search сверяет каждое попадание с журналом (forget).
+#
+# На диске (search.idx) — строка JSON с описью и двоичные секции, которые
+# читаются array.frombytes без разбора по документам:
+#   convs     array('I')  номер переписки каждого документа
+#   ids       array('q')  id сообщения; -1 — нечисловой id (он в описи, other_ids)
+#   alive     bytes       1 — документ жив
+#   terms     utf-8       термины через \n по возрастанию
+#   starts    array('I')  начало списка каждого термина в postings (+ общий конец)
+#   postings  array('I')  номера документов всех терминов подряд
+# Файл пишется в фоне каждые SAVE_EVERY новых документов, а ещё после каждой
+# контрольной точки журнала и при остановке (MessageLog.save_search); при старте он
+# читается, и доиндексируются только сообщения, которых в нём ещё нет: в описи
+# у каждой переписки id последнего её сообщения, дошедшего до индекса (с текстом
+# или без), и переписку, где он совпадает с последним в журнале, не нужно даже
+# читать — так ленивый старт журнала (message_log.py, lazy) остаётся ленивым.
+# Массивы пишутся в порядке байт машины — файл не переносится между платформами
+# (при несовпадении индекс просто строится заново).
+import heapq
+import json
+import os
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+
+VERSION = 2
+SAVE_EVERY = 100000
+MAX_ID = (1 << 63) - 1
+
+WORD = re.compile(r'\w+')
+# Кэш слово → термин: словарь переписки невелик, а стемминг — десяток endswith
+STEMS = {}
+STEMS_LIMIT = 500000
+MIN_STEM = 3
+
+# Окончания существительных и прилагательных, длинные — первыми
+ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ей', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях',
+    'ов', 'ев', 'ую', 'юю', 'ых', 'их', 'ию', 'ия', 'ии', 'ью', 'ья', 'ье',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+
+STOP_WORDS = frozenset((
+    'и', 'в', 'во', 'не', 'что', 'он', 'на', 'я', 'с', 'со', 'как', 'а', 'то', 'все', 'она',
+    'так', 'его', 'но', 'да', 'ты', 'к', 'у', 'же', 'вы', 'за', 'бы', 'по', 'ее', 'мне', 'от',
+    'меня', 'о', 'из', 'ему', 'ли', 'если', 'или', 'ни', 'до', 'вас', 'вам', 'там', 'ей', 'они',
+    'тут', 'для', 'мы', 'тебя', 'их', 'чем', 'без', 'под', 'кто', 'при', 'об', 'над', 'нас', 'про',
+    'них', 'им', 'это', 'эта', 'этот', 'the', 'and', 'to', 'of', 'in', 'is', 'it',
+))
+
+def stem(word):
+    """Слово в нижнем регистре → термин; '' — слово не индексируется"""
+    if len(word) < 2 or word in STOP_WORDS:
+        return ''
+    if 'а' <= word[-1] <= 'я':
+        for ending in ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+                return word[:-len(ending)]
+    return word
+
+def tokens(text):
+    """Множество терминов текста"""
+    result = set()
+    for word in WORD.findall(text.lower().replace('ё', 'е')):
+        term = STEMS.get(word)
+        if term is None:
+            if len(STEMS) >= STEMS_LIMIT:
+                STEMS.clear()
+            term = STEMS[word] = sys.intern(stem(word))
+        if term:
+            result.add(term)
+    return result
+
+def contains(parts, doc):
+    for part in parts:
+        if part and part[0] <= doc <= part[-1]:
+            i = bisect_left(part, doc)
+            return part[i] == doc
+    return False
+
+class SearchIndex:
+    def __init__(self, path, readonly=False, save_every=SAVE_EVERY):
+        # readonly — реплика воркера: читает файл главного процесса, но не пишет его
+        self.path = path
+        self.readonly = readonly
+        self.save_every = save_every
+        self.lock = threading.Lock()
+        # Фоновое сохранение и сохранение от журнала не пишут файл одновременно
+        self.save_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Документы
+        self.convs = array('I')
+        self.ids = array('q')
+        self.alive = bytearray()
+        self.other_ids = {}
+        # Переписки: номер → [kind, key, id последнего сообщения]; живые — в numbers
+        self.conversations = []
+        self.numbers = {}
+        self.dead = set()
+        # Списки документов: сохранённая часть одним массивом (terms / starts /
+        # postings), затем замороженная на время сохранения и свежая — по термину
+        self.terms = []
+        self.term_index = {}
+        self.starts = array('I', (0,))
+        self.postings = array('I')
+        self.frozen = {}
+        self.fresh = {}
+        self.unsaved = 0
+        self.saver = None
+
+    def __len__(self):
+        return len(self.convs)
+
+    def doc_id(self, doc):
+        value = self.ids[doc]
+        return self.other_ids[doc] if value < 0 else value
+
+    def parts(self, term):
+        """Список документов термина — до трёх возрастающих кусков"""
+        result = []
+        i = self.term_index.get(term)
+        if i is not None:
+            result.append(memoryview(self.postings)[self.starts[i]:self.starts[i + 1]])
+        for layer in (self.frozen, self.fresh):
+            docs = layer.get(term)
+            if docs:
+                result.append(docs)
+        return result
+
+    # --- изменения (под блокировкой журнала) ---
+
+    def added(self, conv, msg):
+        if msg.id is None:
+            return
+        terms = tokens(msg.text) if msg.text else None
+        with self.lock:
+            number = self.numbers.get(conv)
+            if number is None:
+                number = self.numbers[conv] = len(self.conversations)
+                self.conversations.append([conv[0], conv[1], msg.id])
+            else:
+                self.conversations[number][2] = msg.id
+            if not terms:
+                return
+            doc = len(self.convs)
+            self.convs.append(number)
+            if isinstance(msg.id, int) and 0 <= msg.id <= MAX_ID:
+                self.ids.append(msg.id)
+            else:
+                self.ids.append(-1)
+                self.other_ids[doc] = msg.id
+            self.alive.append(1)
+            fresh = self.fresh
+            for term in terms:
+                docs = fresh.get(term)
+                if docs is None:
+                    fresh[term] = array('I', (doc,))
+                else:
+                    docs.append(doc)
+            self.unsaved += 1
+            if self.unsaved < self.save_every or self.saver is not None:
+                return
+            saver = self.saver = threading.Thread(target=self.background_save, daemon=True)
+        saver.start()
+
+    def deleted(self, conv, msg):
+        """Документ удалённого сообщения ищется по самому редкому его термину"""
+        terms = tokens(msg.text) if msg.id is not None and msg.text else None
+        if not terms:
+            return
+        with self.lock:
+            number = self.numbers.get(conv)
+            parts = min((self.parts(term) for term in terms), key=lambda p: sum(map(len, p)))
+            for part in reversed(parts):
+                for i in range(len(part) - 1, -1, -1):
+                    doc = part[i]
+                    if self.convs[doc] == number and self.doc_id(doc) == msg.id:
+                        self.alive[doc] = 0
+                        return
+
+    def cleared(self, conv):
+        with self.lock:
+            number = self.numbers.pop(conv, None)
+            if number is not None:
+                self.dead.add(number)
+
+    def forget(self, doc):
+        """Попадание, которого уже нет в журнале"""
+        with self.lock:
+            self.alive[doc] = 0
+
+    # --- поиск ---
+
+    def scan(self, terms, before, count, conv=None):
+        """До count живых документов со всеми терминами, с номерами меньше before,
+        от новых к старым: [(doc, kind, key, id)]. Меньше count — дальше ничего нет."""
+        found = []
+        with self.lock:
+            number = None
+            if conv is not None:
+                number = self.numbers.get(conv)
+                if number is None:
+                    return found
+            lists = [self.parts(term) for term in terms]
+            if not lists or not all(lists):
+                return found
+            # Идём по самому короткому списку, остальные проверяем бинарным поиском
+            lists.sort(key=lambda p: sum(map(len, p)))
+            driver, others = lists[0], lists[1:]
+            convs, alive, dead = self.convs, self.alive, self.dead
+            for part in reversed(driver):
+                end = len(part) if before is None else bisect_left(part, before)
+                for i in range(end - 1, -1, -1):
+                    doc = part[i]
+                    if not alive[doc]:
+                        continue
+                    c = convs[doc]
+                    if c in dead or (number is not None and c != number):
+                        continue
+                    if others and not all(contains(p, doc) for p in others):
+                        continue
+                    kind, key, _ = self.conversations[c]
+                    found.append((doc, kind, key, self.doc_id(doc)))
+                    if len(found) >= count:
+                        return found
+        return found
+
+    # --- загрузка ---
+
+    def load(self, sources):
+        """Читает файл индекса и доиндексирует сообщения журнала, которых в нём нет.
+        sources — ((kind, key), сообщения, id последнего) по всем перепискам журнала;
+        вместо списка сообщений может быть функция, которая его прочитает.
+        Вызывается под блокировкой журнала до первых записей."""
+        try:
+            self.read()
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[SEARCH] Индекс {self.path} не прочитан ({e}), строится заново")
+            self.reset()
+        loaded = len(self)
+        present = set()
+        tails = []
+        for conv, msgs, last_id in sources:
+            present.add(conv)
+            if callable(msgs):
+                number = self.numbers.get(conv)
+                if number is not None and self.conversations[number][2] == last_id:
+                    continue
+                msgs = msgs()
+            tails.append([(conv, msg) for msg in msgs[self.unindexed(conv, msgs):]])
+        # Номера документов — порядок выдачи, поэтому переписки сливаются по id (времени)
+        for conv, msg in heapq.merge(*tails, key=order):
+            self.added(conv, msg)
+        # Переписки, которых больше нет (очищены, пока сервер стоял)
+        for conv in list(self.numbers):
+            if conv not in present:
+                self.cleared(conv)
+        print(f"[SEARCH] Индекс: {loaded} документов из файла, доиндексировано {len(self) - loaded}")
+
+    def unindexed(self, conv, msgs):
+        """Позиция первого сообщения переписки, которого нет в индексе"""
+        number = self.numbers.get(conv)
+        if number is None:
+            return 0
+        last = self.conversations[number][2]
+        for i in range(len(msgs) - 1, -1, -1):
+            msg_id = msgs[i].id
+            # id растут — меньший id значит, что последнее сообщение удалено позже
+            if msg_id == last or (isinstance(msg_id, int) and isinstance(last, int) and msg_id < last):
+                return i + 1
+        # Последнего сообщения нет вовсе — переписку индексируем заново
+        self.cleared(conv)
+        return 0
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            header = json.loads(f.readline())
+            if header['version'] != VERSION or header['byteorder'] != sys.byteorder:
+                raise ValueError('другой формат')
+            sections = {}
+            for name, size in header['sizes']:
+                sections[name] = f.read(size)
+                if len(sections[name]) != size:
+                    raise ValueError('файл обрезан')
+        self.reset()
+        self.convs.frombytes(sections['convs'])
+        self.ids.frombytes(sections['ids'])
+        self.alive = bytearray(sections['alive'])
+        self.other_ids = {int(doc): value for doc, value in header['other_ids'].items()}
+        self.conversations = header['conversations']
+        self.dead = set(header['dead'])
+        self.numbers = {(kind, key): number for number, (kind, key, _) in enumerate(self.conversations)
+                        if number not in self.dead}
+        self.terms = sections['terms'].decode('utf-8').split('\n') if sections['terms'] else []
+        self.term_index = {term: i for i, term in enumerate(self.terms)}
+        self.starts = array('I')
+        self.starts.frombytes(sections['starts'])
+        self.postings.frombytes(sections['postings'])
+        if not (len(self.convs) == len(self.ids) == len(self.alive) == header['docs']
+                and len(self.starts) == len(self.terms) + 1 and self.starts[-1] == len(self.postings)):
+            raise ValueError('секции не сходятся')
+
+    # --- сохранение ---
+
+    def background_save(self):
+        try:
+            self.save()
+        except OSError as e:
+            print(f"[SEARCH] Ошибка сохранения индекса: {e}")
+        finally:
+            self.saver = None
+
+    def save(self):
+        """Сливает свежие списки с сохранённой частью и (кроме реплики) пишет файл.
+        Добавления в это время идут в новый fresh."""
+        with self.save_lock:
+            self.save_locked()
+
+    def save_locked(self):
+        with self.lock:
+            self.frozen, self.fresh = self.fresh, {}
+            unsaved, self.unsaved = self.unsaved, 0
+            header = {
+                'version': VERSION,
+                'byteorder': sys.byteorder,
+                'docs': len(self.convs),
+                'conversations': [list(c) for c in self.conversations],
+                'dead': sorted(self.dead),
+                'other_ids': {str(doc): value for doc, value in self.other_ids.items()},
+            }
+            docs = [('convs', self.convs.tobytes()), ('ids', self.ids.tobytes()), ('alive', bytes(self.alive))]
+        # Сохранённая часть и frozen до конца слияния не меняются — сливаем без блокировки
+        frozen, old_index, old_starts, old_postings = self.frozen, self.term_index, self.starts, self.postings
+        terms = sorted(set(self.terms).union(frozen))
+        starts = array('I')
+        postings = array('I')
+        for term in terms:
+            starts.append(len(postings))
+            i = old_index.get(term)
+            if i is not None:
+                postings += old_postings[old_starts[i]:old_starts[i + 1]]
+            more = frozen.get(term)
+            if more:
+                postings += more
+        starts.append(len(postings))
+        # Слитое заменяет frozen в памяти до записи: ошибка записи его не теряет
+        with self.lock:
+            self.terms, self.term_index, self.starts, self.postings = (
+                terms, {term: i for i, term in enumerate(terms)}, starts, postings)
+            self.frozen = {}
+        if self.readonly:
+            return
+        sections = docs + [('terms', '\n'.join(terms).encode('utf-8')),
+                           ('starts', starts.tobytes()), ('postings', postings.tobytes())]
+        header['sizes'] = [(name, len(data)) for name, data in sections]
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(json.dumps(header, ensure_ascii=False).encode('utf-8') + b'\n')
+                for _, data in sections:
+                    f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except OSError:
+            # Файл остался прежним — следующее сохранение запишет и эти документы
+            with self.lock:
+                self.unsaved += unsaved
+            raise
+
+def order(item):
+    msg_id = item[1].id
+    return msg_id if isinstance(msg_id, int) else -1
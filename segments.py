@@ -0,0 +1,467 @@
+# segments.py — история на диске: сегменты по перепискам
+#
+#   message_log/
+#       checkpoint.json                      {"generation": 7, "segments": {"<переписка>": [[номер, строк, ...], ...]}}
+#       wal-000007.log                       записи после контрольной точки (message_log.py)
+#       segments/<переписка>/00000003.seg    сообщения, по одной JSON-строке
+#       segments/<переписка>/deleted.log     id удалённых, но ещё не вычищенных из сегментов
+#
+# Каталог переписки — её имя через quote(); имя длиннее DIR_LIMIT (предел ФС на
+# имя файла) укорачивается и дополняется хешем полного имени (conversation_dir).
+#
+# Раньше контрольная точка журнала была снимком всего состояния, который
+# переписывался целиком. Теперь в контрольной точке (flush) на диск уходит только
+# то, что пришло с прошлой: новые сообщения дописываются в последний сегмент своей
+# переписки, а когда в нём SEGMENT_SIZE строк — начинается следующий. Сегменты,
+# кроме последнего, запечатаны: их меняет только уплотнитель (compact).
+#
+# checkpoint.json — опись: сколько строк каждого сегмента входит в историю. Всё,
+# что дописано сверх описи (контрольная точка не успела завершиться), при
+# загрузке отрезается — эти записи ещё лежат в журнале и проиграются из него.
+# Кроме номера и числа строк, в описи у сегмента его сводка (Segment.entry):
+# сколько сообщений из него живы, самое новое время и диапазон id. По ней
+# ленивый режим журнала (message_log.py, lazy) знает о переписке всё, что нужно
+# сроку хранения, уплотнителю и досылке, не читая её сегментов: сама переписка
+# читается (read_conversation) при первом обращении. Опись без сводки (старый
+# формат) при ленивом старте читается один раз целиком.
+#
+# Контрольная точка — всё или ничего: если хоть одна переписка не записалась,
+# дописанное отрезается, изменения возвращаются в pending до следующей, а опись
+# в памяти и поколение журнала остаются прежними — старые журналы не удаляются.
+#
+# Удаление сообщения — запись в журнале; из памяти сообщение уходит сразу, из
+# запечатанного сегмента — позже: id попадает в deleted.log, и уплотнитель
+# переписывает сегмент без него. Очистка переписки и срок хранения (retention)
+# удаляют сегменты файлами целиком — без перезаписи остальной истории.
+import hashlib
+import json
+import os
+import threading
+from urllib.parse import quote
+
+from records import pack, pack_id
+
+SEGMENT_SIZE = 10000
+CHECKPOINT = 'checkpoint.json'
+DELETED = 'deleted.log'
+# Длина имени каталога переписки (NAME_MAX); что длиннее — с хешем вместо хвоста
+DIR_LIMIT = 255
+
+def conversation_name(kind, key):
+    return kind if kind == 'messages' else f"{kind}:{key}"
+
+def split_name(name):
+    kind, _, key = name.partition(':')
+    return kind, (key if kind != 'messages' else None)
+
+def conversation_dir(name):
+    """Имя каталога переписки. Короткие — quote() имени, как раньше; длинные
+    ограничены DIR_LIMIT: начало имени и sha256 полного имени."""
+    quoted = quote(name, safe='')
+    if len(quoted) <= DIR_LIMIT:
+        return quoted
+    digest = hashlib.sha256(name.encode('utf-8')).hexdigest()
+    return f"{quoted[:DIR_LIMIT - len(digest) - 1]}~{digest}"
+
+def segment_file(number):
+    return f'{number:08d}.seg'
+
+def write_lines(path, lines, mode):
+    with open(path, mode, encoding='utf-8') as f:
+        f.write(''.join(lines))
+        f.flush()
+        os.fsync(f.fileno())
+
+def replace_lines(path, lines):
+    """Атомарная перезапись: запечатанный сегмент подменяется целиком или никак"""
+    tmp = path + '.tmp'
+    write_lines(tmp, lines, 'w')
+    os.replace(tmp, path)
+
+class Segment:
+    def __init__(self, number):
+        self.number = number
+        # Строк в файле (по описи) и сообщений из него в памяти: удалённое
+        # уходит из памяти сразу, а из файла — только при уплотнении
+        self.lines = 0
+        self.live = 0
+        # Самое новое время (records.Message.time) и диапазон числовых id —
+        # по ним срок хранения и уплотнитель решают, не читая файл
+        self.newest = None
+        self.first_id = None
+        self.last_id = None
+
+    def note(self, msg):
+        if isinstance(msg.time, int) and (self.newest is None or msg.time > self.newest):
+            self.newest = msg.time
+        if isinstance(msg.id, int):
+            self.first_id = msg.id if self.first_id is None else min(self.first_id, msg.id)
+            self.last_id = msg.id if self.last_id is None else max(self.last_id, msg.id)
+
+    def entry(self):
+        """Строка описи: [номер, строк, живых, самое новое время, первый id, последний id]"""
+        return [self.number, self.lines, self.live, self.newest, self.first_id, self.last_id]
+
+    @classmethod
+    def from_entry(cls, entry):
+        seg = cls(entry[0])
+        seg.lines = entry[1]
+        if len(entry) >= 6:
+            seg.live, seg.newest, seg.first_id, seg.last_id = entry[2:6]
+        return seg
+
+    def copy(self):
+        return Segment.from_entry(self.entry())
+
+    def may_contain(self, ids):
+        """Может ли в сегменте быть одно из ids (нечисловые id — всегда может)"""
+        if self.first_id is None:
+            return True
+        return any(not isinstance(i, int) or self.first_id <= i <= self.last_id for i in ids)
+
+class Pending:
+    """Изменения переписки после последней контрольной точки"""
+    def __init__(self):
+        self.clear = False
+        self.messages = []
+        self.deleted = set()
+
+    def merge(self, newer):
+        """Изменения, не попавшие в контрольную точку, плюс пришедшие после них"""
+        if newer is None:
+            return self
+        if newer.clear:
+            return newer
+        self.messages.extend(newer.messages)
+        self.deleted |= newer.deleted
+        return self
+
+class SegmentStore:
+    """Сегменты всех переписок. Опись (conversations) и счётчики live меняются под
+    блокировкой журнала; файлы и checkpoint.json — только под self.disk_lock."""
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.root = os.path.join(directory, 'segments')
+        self.segment_size = segment_size
+        # Поколение журнала, с которого начинается то, чего ещё нет в сегментах
+        self.generation = None
+        # (kind, key) → [Segment] от старых к новым
+        self.conversations = {}
+        # (kind, key) → Pending; flushing — взятое контрольной точкой, пока она идёт
+        self.pending = {}
+        self.flushing = {}
+        # (kind, key) → id из deleted.log (ключи как records.Message.id)
+        self.tombstones = {}
+        self.disk_lock = threading.Lock()
+
+    @property
+    def checkpoint_path(self):
+        return os.path.join(self.directory, CHECKPOINT)
+
+    def exists(self):
+        return os.path.exists(self.checkpoint_path)
+
+    def path(self, conv, name=''):
+        return os.path.join(self.root, conversation_dir(conversation_name(*conv)), name)
+
+    # --- загрузка ---
+
+    def load(self, state, lazy=False):
+        """Читает опись и сегменты в state (списки records.Message). lazy — сегменты
+        переписок, кроме общего чата, не читаются: в state попадает только общий чат."""
+        with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        self.generation = checkpoint['generation']
+        for name, entries in checkpoint['segments'].items():
+            conv = split_name(name)
+            self.conversations[conv] = [Segment.from_entry(entry) for entry in entries]
+            tombstones = self.read_tombstones(conv)
+            if tombstones:
+                self.tombstones[conv] = tombstones
+            if lazy and conv[0] != 'messages' and all(len(entry) >= 6 for entry in entries):
+                continue
+            msgs = self.read_conversation(conv)
+            if not lazy or conv[0] == 'messages':
+                if conv[0] == 'messages':
+                    state['messages'].extend(msgs)
+                else:
+                    state[conv[0]][conv[1]] = msgs
+        self.remove_strays(checkpoint['segments'])
+
+    def read_conversation(self, conv, truncate=True):
+        """Сообщения переписки из её сегментов по описи, без удалённых. Заодно
+        пересчитывает сводку сегментов. Под блокировкой журнала (или до её появления)."""
+        tombstones = self.tombstones.get(conv, ())
+        msgs = []
+        for seg in self.conversations.get(conv, []):
+            seg.live = 0
+            for msg in self.read_segment(conv, seg, seg.lines, truncate):
+                seg.note(msg)
+                if msg.id is None or msg.id not in tombstones:
+                    msgs.append(msg)
+                    seg.live += 1
+        return msgs
+
+    def last_id(self, conv):
+        """id самого нового сообщения переписки на диске (None — неизвестен)"""
+        segs = self.conversations.get(conv)
+        return segs[-1].last_id if segs else None
+
+    def read_segment(self, conv, seg, lines, truncate=True):
+        """Первые lines строк сегмента; всё, что дописано сверх описи, отрезается
+        (truncate=False — реплика: файлы главного процесса она не трогает)"""
+        path = self.path(conv, segment_file(seg.number))
+        if not os.path.exists(path):
+            # Сегмент удалён (очистка, срок хранения), а опись не успела обновиться
+            return []
+        msgs = []
+        end = 0
+        with open(path, 'rb+' if truncate else 'rb') as f:
+            for _ in range(lines):
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break
+                msgs.append(pack(json.loads(line)))
+                end = f.tell()
+            if truncate and f.seek(0, os.SEEK_END) > end:
+                f.truncate(end)
+        seg.lines = len(msgs)
+        return msgs
+
+    def read_tombstones(self, conv):
+        path = self.path(conv, DELETED)
+        if not os.path.exists(path):
+            return set()
+        ids = set()
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    ids.add(pack_id(json.loads(line)))
+                except json.JSONDecodeError:
+                    continue
+        return ids
+
+    def remove_strays(self, listed):
+        """Сегменты, которых нет в описи, — от контрольной точки, не дошедшей до конца"""
+        if not os.path.isdir(self.root):
+            return
+        dirs = {conversation_dir(name): entries for name, entries in listed.items()}
+        for dirname in os.listdir(self.root):
+            keep = {segment_file(entry[0]) for entry in dirs.get(dirname) or []}
+            for name in os.listdir(os.path.join(self.root, dirname)):
+                if name.endswith(('.seg', '.tmp')) and name not in keep:
+                    os.remove(os.path.join(self.root, dirname, name))
+
+    # --- учёт изменений (под блокировкой журнала) ---
+
+    def changes(self, conv):
+        pending = self.pending.get(conv)
+        if pending is None:
+            pending = self.pending[conv] = Pending()
+        return pending
+
+    def added(self, conv, msg):
+        self.changes(conv).messages.append(msg)
+
+    def deleted(self, conv, msg, position):
+        """Сообщение на позиции position удалено из памяти"""
+        segs = self.conversations.get(conv, [])
+        for seg in segs:
+            if position < seg.live:
+                seg.live -= 1
+                break
+            position -= seg.live
+        # Ещё не записанное просто не попадёт в сегмент, записанное — в deleted.log
+        self.changes(conv).deleted.add(msg.id)
+
+    def cleared(self, conv):
+        for seg in self.conversations.get(conv, []):
+            seg.live = 0
+        self.pending[conv] = pending = Pending()
+        pending.clear = True
+
+    def take(self):
+        """Изменения для контрольной точки; дальше копятся новые"""
+        pending, self.pending = self.pending, {}
+        self.flushing = pending
+        return pending
+
+    def dirty(self, conv):
+        """Есть ли у переписки изменения, которых ещё нет в сегментах"""
+        return conv in self.pending or conv in self.flushing
+
+    # --- контрольная точка (фоновый поток журнала) ---
+
+    def flush(self, pending, generation, lock):
+        """Дописывает изменения в сегменты и обновляет опись. После возврата
+        журналы поколений меньше generation больше не нужны. Ошибка записи
+        (OSError) уходит вызывающему, а изменения остаются в pending."""
+        with self.disk_lock:
+            written = {}
+            appended = []
+            try:
+                for conv, changes in pending.items():
+                    written[conv] = self.flush_conversation(conv, changes, appended)
+            except OSError:
+                self.undo(appended)
+                with lock:
+                    for conv, changes in pending.items():
+                        self.pending[conv] = changes.merge(self.pending.get(conv))
+                    self.flushing = {}
+                raise
+            with lock:
+                for conv, (segs, added, copied) in written.items():
+                    if copied:
+                        # live копии — как у оригинала сейчас: удалённое во время записи учтено
+                        copied[1].live = copied[0].live
+                    # Удалённое и очищенное, пока шла запись, в live не попадает
+                    now = self.pending.get(conv)
+                    for seg, msgs in added:
+                        if now is not None and now.clear:
+                            continue
+                        seg.live += sum(1 for m in msgs if now is None or m.id is None or m.id not in now.deleted)
+                    self.conversations[conv] = segs
+                self.flushing = {}
+            self.generation = generation
+            self.write_checkpoint()
+
+    def flush_conversation(self, conv, changes, appended):
+        """Пишет изменения переписки. Опись не трогает: возвращает новый список
+        сегментов (дописанный последний — копией), что куда добавлено и пару
+        (оригинал, копия). В appended — (файл, размер до записи) для undo()."""
+        old = self.conversations.get(conv, [])
+        next_number = old[-1].number + 1 if old else 0
+        if changes.clear:
+            self.drop_files(conv, old, all_files=True)
+            segs = []
+        else:
+            segs = list(old)
+        os.makedirs(self.path(conv), exist_ok=True)
+        msgs = [m for m in changes.messages if m.id is None or m.id not in changes.deleted]
+        if not changes.clear:
+            # Удалённые из уже записанных сегментов — в deleted.log для уплотнителя
+            fresh = {m.id for m in changes.messages}
+            self.add_tombstones(conv, changes.deleted - fresh, appended)
+        added = []
+        copied = None
+        while msgs:
+            if segs and segs[-1].lines < self.segment_size:
+                if copied is None and segs[-1] in old:
+                    copied = (segs[-1], segs[-1].copy())
+                    segs[-1] = copied[1]
+                seg = segs[-1]
+                mode = 'a'
+            else:
+                seg = Segment(next_number)
+                next_number += 1
+                segs.append(seg)
+                mode = 'w'
+            path = self.path(conv, segment_file(seg.number))
+            appended.append((path, os.path.getsize(path) if mode == 'a' and os.path.exists(path) else 0))
+            chunk, msgs = msgs[:self.segment_size - seg.lines], msgs[self.segment_size - seg.lines:]
+            write_lines(path, [json.dumps(m.to_dict(), ensure_ascii=False) + '\n' for m in chunk], mode)
+            seg.lines += len(chunk)
+            for m in chunk:
+                seg.note(m)
+            added.append((seg, chunk))
+        return segs, added, copied
+
+    def undo(self, appended):
+        """Неудавшаяся контрольная точка: файлы обрезаются до размера по описи"""
+        for path, size in reversed(appended):
+            try:
+                if size:
+                    os.truncate(path, size)
+                elif os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                print(f"[LOG] Не удалось откатить {path}: {e}")
+
+    def add_tombstones(self, conv, ids, appended):
+        if not ids:
+            return
+        path = self.path(conv, DELETED)
+        appended.append((path, os.path.getsize(path) if os.path.exists(path) else 0))
+        write_lines(path, [json.dumps(str(i)) + '\n' for i in ids], 'a')
+        self.tombstones.setdefault(conv, set()).update(ids)
+
+    def write_checkpoint(self):
+        checkpoint = {
+            'generation': self.generation,
+            'segments': {conversation_name(*conv): [seg.entry() for seg in segs]
+                         for conv, segs in self.conversations.items() if segs}
+        }
+        replace_lines(self.checkpoint_path, [json.dumps(checkpoint, ensure_ascii=False)])
+
+    def drop_files(self, conv, segs, all_files=False):
+        """Удаление сегментов — unlink файлов, остальная история не трогается"""
+        for seg in segs:
+            path = self.path(conv, segment_file(seg.number))
+            if os.path.exists(path):
+                os.remove(path)
+        if all_files:
+            self.tombstones.pop(conv, None)
+            if os.path.exists(self.path(conv, DELETED)):
+                os.remove(self.path(conv, DELETED))
+
+    # --- срок хранения и уплотнение (поток уплотнителя) ---
+
+    def expire(self, conv, total, cutoff, keep):
+        """Запечатанные сегменты с начала переписки, которые пора удалить:
+        все сообщения старше cutoff или сверх keep последних. Под блокировкой журнала;
+        возвращает (сегменты, сколько сообщений убрать из начала списка в памяти)."""
+        segs = self.conversations.get(conv, [])
+        victims = []
+        count = 0
+        for seg in segs[:-1]:
+            old = cutoff is not None and seg.newest is not None and seg.newest < cutoff
+            extra = keep is not None and total - count - seg.live >= keep
+            if not (old or extra):
+                break
+            victims.append(seg)
+            count += seg.live
+        if victims:
+            self.conversations[conv] = segs[len(victims):]
+        return victims, count
+
+    def compact(self, conv, lock):
+        """Переписывает запечатанные сегменты без удалённых сообщений. Под disk_lock;
+        файл подменяется под блокировкой журнала lock — вместе с числом строк в описи,
+        чтобы ленивое чтение переписки не увидело одно без другого."""
+        ids = self.tombstones.get(conv)
+        segs = self.conversations.get(conv, [])
+        if not ids:
+            return False
+        found = set()
+        for seg in segs[:-1]:
+            if not seg.may_contain(ids):
+                continue
+            path = self.path(conv, segment_file(seg.number))
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = [f.readline() for _ in range(seg.lines)]
+            kept = []
+            for line in lines:
+                msg_id = pack_id(json.loads(line).get('id'))
+                if msg_id is not None and msg_id in ids:
+                    found.add(msg_id)
+                else:
+                    kept.append(line)
+            if len(kept) < len(lines):
+                write_lines(path + '.tmp', kept, 'w')
+                with lock:
+                    os.replace(path + '.tmp', path)
+                    seg.lines = len(kept)
+        # Что не нашлось и старше первого сегмента — ушло вместе со сроком хранения.
+        # Без id первого сегмента сравнивать не с чем — отметки остаются (и для
+        # незапечатанного последнего сегмента, который здесь не переписывается)
+        oldest = segs[0].first_id if segs else None
+        remaining = {i for i in ids - found
+                     if not (isinstance(i, int) and oldest is not None and i < oldest)}
+        if remaining == ids:
+            return False
+        if remaining:
+            self.tombstones[conv] = remaining
+            replace_lines(self.path(conv, DELETED), [json.dumps(str(i)) + '\n' for i in remaining])
+        else:
+            self.drop_files(conv, [], all_files=True)
+        return True
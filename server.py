@@ -4,94 +4,458 @@ import threading
 import json
 import os
 import hashlib
+import argparse
+import signal
+import sys
 from datetime import datetime
 
+from framing import shared_frame, HEADER
+from outbound import QueuedConnection, OVERFLOW_POLICIES
+from message_log import MessageLog, FSYNC_POLICIES, PAGE_SIZE, read_history, private_peer
+from segments import SEGMENT_SIZE
+from search_index import SearchIndex
+import storage
+from locks import LockManager
+from channel_index import ChannelIndex
+import ids
+from sessions import SessionTokens
+from presence import PresenceAggregator
+from ratelimit import RateLimiter, RATE_POLICIES
+import uploads
+import downloads
+import compression
+import wire
+import metrics
+from uploads import UploadError
+
 HOST = '0.0.0.0'
 PORT = 5555
 
-print("""
+BANNER = """
 ╔═══════════════════════════════════════╗
 ║       Tandau Messenger Server         ║
 ║        IP: 72.44.48.182:5555           ║
 ║        Админ: saltys                  ║
 ╚═══════════════════════════════════════╝
-""")
-
-# Папки
-for dir in ['chat_images', 'chat_videos', 'voice_messages', 'user_avatars']:
-    os.makedirs(dir, exist_ok=True)
+"""
 
-# Файлы
+# Файлы (история сообщений живёт в журнале message_log/, см. message_log.py)
 FILES = {
     'users': 'users.json',
-    'messages': 'messages.json',
-    'private': 'private_messages.json',
-    'channels': 'channels.json',
-    'channel_msgs': 'channel_messages.json'
+    'channels': 'channels.json'
 }
+# Где хранятся пользователи, каналы и история (см. local_storage.py, storage.py): json — файлы выше
+# и message_log/, sqlite — одна база storage.DB_FILE. Открывается в open_store().
+store = None
 
 data = {}
-for k, f in FILES.items():
-    if os.path.exists(f):
-        with open(f, 'r', encoding='utf-8') as file:
-            data[k] = json.load(file)
-    else:
-        data[k] = [] if k in ['messages', 'channel_msgs'] else {}
-
 clients = {}
-lock = threading.Lock()
+locks = LockManager()
+channel_index = ChannelIndex()
+message_log = MessageLog()
+
+# Исходящие очереди соединений (см. outbound.py), настраиваются из main()
+SEND_QUEUE_LIMIT = 1024
+OVERFLOW_POLICY = 'drop_oldest'
+
+# Лимит размера загружаемого файла (см. uploads.py)
+UPLOAD_LIMIT = uploads.MAX_UPLOAD_SIZE
+# Входы и выходы рассылаются пачками раз в presence.interval (см. presence.py)
+presence = PresenceAggregator(lambda text: announce(text))
+# Токены сессии для RESUME: и сколько пропущенных сообщений досылать при нём
+sessions = SessionTokens()
+REPLAY_LIMIT = 1000
+# Максимум сообщений в одной странице HISTORY: и SEARCH:
+HISTORY_LIMIT = 200
+# Полнотекстовый поиск SEARCH: (см. search_index.py); файл индекса — рядом с историей
+SEARCH = True
+SEARCH_FILE = 'search.idx'
+# Хранилище файлов по SHA-256: докачка и пересылка без повторной загрузки
+content_store = uploads.ContentStore()
+# Предлагать ли клиентам двоичные кадры сообщений (см. wire.py)
+BINARY_WIRE = True
+# Лимиты частоты сообщений и загрузок по пользователю и IP (см. ratelimit.py)
+limiter = RateLimiter()
+# Кому уже отправлен THROTTLED: по этому виду — повторно не шлём, пока не уложится в лимит
+throttled = set()
+# Счётчики и гистограммы (metrics.py) отдаются по HTTP на этом порту localhost; 0 — не отдаются
+METRICS_PORT = 0
+
+def queue_depths():
+    with locks.clients:
+        targets = list(clients.values())
+    return [len(conn.outbox) for conn in targets]
+
+metrics.Gauge('tandau_connections', 'Вошедшие пользователи', lambda: len(clients))
+metrics.Gauge('tandau_send_queue_frames', 'Кадров во всех исходящих очередях', lambda: sum(queue_depths()))
+metrics.Gauge('tandau_send_queue_max', 'Самая длинная исходящая очередь', lambda: max(queue_depths(), default=0))
+
+def load_data():
+    # Папки
+    for dir in ['chat_images', 'chat_videos', 'voice_messages', 'user_avatars']:
+        os.makedirs(dir, exist_ok=True)
+
+    data['users'] = store.users()
+    data['channels'] = store.channels()
+    channel_index.load(data['channels'])
+    sessions.load()
+    # messages / private / channel_msgs: снимок + хвост журнала
+    data.update(message_log.load())
+    if SEARCH:
+        message_log.enable_search(SearchIndex(search_path(), readonly=message_log.replica))
+
+def search_path():
+    if message_log.segments:
+        return os.path.join(message_log.directory, SEARCH_FILE)
+    return f"{storage.DB_FILE}.{SEARCH_FILE}"
+
+def open_store(backend, replica=False):
+    """Открывает хранилище. Для sqlite история тоже в базе — message_log заменяется
+    на storage.SqliteLog, а база без отметки о переносе заполняется из JSON-файлов и журнала."""
+    global store, message_log
+    if backend == 'json':
+        store = storage.JsonFiles(FILES['users'], FILES['channels'])
+        return
+    store = storage.ServerStorage(storage.DB_FILE)
+    if not replica and not store.migrated():
+        files = storage.JsonFiles(FILES['users'], FILES['channels'])
+        storage.migrate_server(store, files.users(), files.channels(), read_history())
+    message_log = storage.SqliteLog(store)
 
 def broadcast(msg, exclude=None):
-    with lock:
-        for client in list(clients.values()):
-            if client != exclude:
-                try:
-                    client.send(msg.encode('utf-8'))
-                except:
-                    pass
-
-def handle_client(conn, addr):
+    # Кадр кодируется один раз и один и тот же буфер уходит в очереди всех получателей
+    frame = shared_frame(msg)
+    # Под блокировкой реестра только снимаем список — send_frame() лишь ставит кадр в очередь
+    with locks.clients:
+        targets = list(clients.values())
+    metrics.fanout.observe(len(targets) - (exclude in targets), 'broadcast')
+    kind = metrics.frame_command(frame)
+    for client in targets:
+        if client != exclude:
+            try:
+                client.send_frame(frame, kind)
+            except:
+                pass
+
+def check_password(username, password):
+    users = data['users']
+    return username in users and users[username]['password'] == hashlib.sha256(password.encode()).hexdigest()
+
+def authenticate(auth, conn, addr):
+    """Проверяет строку LOGIN:<user>:<password> или RESUME:<token>:<last_seen_id>
+    и регистрирует соединение. Возвращает имя пользователя или None.
+    Общая для обоих режимов сервера."""
+    if auth.startswith('RESUME:'):
+        return resume(auth, conn, addr)
+    if not auth.startswith('LOGIN:'):
+        return None
+    username, password = auth[6:].split(':', 1)
+    if not check_password(username, password):
+        conn.send(b'FAIL')
+        return None
+    conn.send(b'OK')
+    conn.send(f"SESSION:{sessions.issue(username)}")
+    go_online(username, conn)
+    print(f"[+] {username} вошёл ({addr[0]})")
+    return username
+
+def resume(auth, conn, addr):
+    """RESUME:<token>:<last_seen_id> — вход по токену без проверки пароля.
+    После OK досылает сообщения новее last_seen_id (0 — ничего не досылать)."""
+    token, _, last_seen = auth[7:].partition(':')
+    username = sessions.verify(token)
+    if username is None or username not in data['users']:
+        conn.send(b'FAIL')
+        return None
+    conn.send(b'OK')
+    conn.send(f"SESSION:{sessions.issue(username)}")
+    # Сначала в реестр, потом досылка: сообщение между ними придёт дважды,
+    # но не потеряется — клиент отбрасывает повтор по id
+    go_online(username, conn)
+    replayed = replay_missed(username, conn, int(last_seen) if last_seen.isdigit() else 0)
+    print(f"[+] {username} вернулся по токену, дослано {replayed} ({addr[0]})")
+    return username
+
+def go_online(username, conn):
+    with locks.clients:
+        clients[username] = conn
+    with locks.channels:
+        channel_index.user_online(username)
+    presence.changed(username, True)
+
+def replay_missed(user, conn, last_seen):
+    """Досылает сообщения новее last_seen во всех переписках пользователя
+    в порядке id, в тех же кадрах, что и живая доставка. Завершает RESUMED:<n>."""
+    if not last_seen:
+        conn.send("RESUMED:0")
+        return 0
+    with locks.channels:
+        channel_ids = list(channel_index.user_channels.get(user, ()))
+    missed = [(msg, 'MSG', None) for msg in
+              message_log.since('messages', None, last_seen, REPLAY_LIMIT)]
+    for key in message_log.private_keys(user):
+        for msg in message_log.since('private', key, last_seen, REPLAY_LIMIT):
+            missed.append((msg, 'PRIVATE', user))
+    for cid in channel_ids:
+        for msg in message_log.since('channel_msgs', cid, last_seen, REPLAY_LIMIT):
+            missed.append((msg, 'CHANNEL', cid))
+    # Больше REPLAY_LIMIT — досылаем самые свежие, остальное клиент берёт через HISTORY:
+    missed.sort(key=lambda item: int(item[0]['id']))
+    missed = missed[-REPLAY_LIMIT:]
+    for msg, kind, target in missed:
+        conn.send(wire.encode(kind, target, msg, conn.binary))
+    conn.send(f"RESUMED:{len(missed)}")
+    return len(missed)
+
+def disconnect(username, conn):
+    with locks.clients:
+        # После RESUME: с нового соединения старое закрывается позже — его
+        # обработчик не должен снимать с учёта уже вернувшегося пользователя
+        if clients.get(username) is not conn:
+            return
+        del clients[username]
+    with locks.channels:
+        channel_index.user_offline(username)
+    presence.changed(username, False)
+    print(f"[-] {username} вышел")
+
+def wait_for_commit(commit, deliver, order, failed):
+    """Threaded-режим: рассылка встаёт в очередь переписки order (locks.delivery)
+    ещё под блокировкой переписки, то есть в порядке журнала. Возвращает finish():
+    его поток отправителя зовёт уже без блокировки (finish_store) — ждёт, пока
+    пачка станет долговечной, и рассылает готовое (рассылка и есть подтверждение).
+    Так сообщения и одной переписки, и разных попадают в одну пачку.
+    Пачка не записалась — вместо рассылки failed(ошибка)."""
+    order.put(commit, deliver, failed)
+    def finish():
+        commit.wait()
+        order.drain()
+    return finish
+
+# aio_server подменяет на версию, которая не блокирует event loop
+after_commit = wait_for_commit
+
+def finish_store(finish):
+    """Вторая половина store_message / store_removal — после выхода из блокировки
+    переписки: ожидание коммита и рассылка (threaded-режим; иначе finish — None)"""
+    if finish:
+        finish()
+
+def deliver(kind, key, msg):
+    """Рассылает сохранённое сообщение получателям, подключённым к этому процессу"""
+    if kind == 'messages':
+        # Кадр в каждой кодировке (JSON, bin1) собирается один раз на всех получателей
+        frame = wire.ChatFrame('MSG', None, msg)
+        with locks.clients:
+            targets = list(clients.values())
+        metrics.fanout.observe(len(targets), kind)
+        for conn in targets:
+            conn.send_frame(frame.for_conn(conn), frame.kind)
+    elif kind == 'private':
+        sender = msg['user']
+        recipient = key[len(sender) + 1:] if key.startswith(sender + '_') else key[:-len(sender) - 1]
+        sent = 0
+        for u in [sender, recipient]:
+            conn = clients.get(u)
+            if conn:
+                conn.send(wire.encode('PRIVATE', u, msg, conn.binary))
+                sent += 1
+        metrics.fanout.observe(sent, kind)
+    elif kind == 'channel_msgs':
+        frame = wire.ChatFrame('CHANNEL', key, msg)
+        # Индекс уже знает, кто из подписчиков в сети — офлайн-подписчиков не перебираем
+        with locks.channels:
+            online = list(channel_index.online_subscribers(key))
+        metrics.fanout.observe(len(online), kind)
+        for sub in online:
+            conn = clients.get(sub)
+            if conn:
+                conn.send_frame(frame.for_conn(conn), frame.kind)
+
+def report_unsaved(record, user, error):
+    """Запись не дошла до диска: получатели о ней не узнают, отправителю — ответ
+    с error. Сообщение — UNSAVED:{"chat_type", "target", "id", "error"}, удаление
+    и очистка — DELETED:/CLEARED: с error, как при отказе."""
+    kind, key = record['kind'], record['key']
+    reply = {'chat_type': CHAT_TYPES[kind], 'target': key, 'error': f"не сохранено: {error}"}
+    if kind == 'private':
+        reply['target'] = private_peer(key, user)
+    if record['op'] == 'add':
+        command = 'UNSAVED'
+        reply['id'] = record['msg']['id']
+    elif record['op'] == 'delete':
+        command = 'DELETED'
+        reply['id'] = record['id']
+    else:
+        command = 'CLEARED'
+    conn = clients.get(user)
+    if conn:
+        conn.send(f"{command}:{wire.to_json(reply)}")
+
+def deliver_removal(record):
+    """DELETED:/CLEARED: получателям переписки, подключённым к этому процессу"""
+    kind, key = record['kind'], record['key']
+    command = 'DELETED' if record['op'] == 'delete' else 'CLEARED'
+    reply = {'chat_type': CHAT_TYPES[kind], 'target': key}
+    if record['op'] == 'delete':
+        reply['id'] = record['id']
+    if kind == 'messages':
+        broadcast(f"{command}:{wire.to_json(reply)}")
+    elif kind == 'private':
+        # target у каждого свой — собеседник
+        first, second = record['users']
+        for u, other in ((first, second), (second, first)):
+            conn = clients.get(u)
+            if conn:
+                conn.send(f"{command}:{wire.to_json(dict(reply, target=other))}")
+    elif kind == 'channel_msgs':
+        frame = shared_frame(f"{command}:{wire.to_json(reply)}")
+        with locks.channels:
+            online = list(channel_index.online_subscribers(key))
+        for sub in online:
+            conn = clients.get(sub)
+            if conn:
+                conn.send_frame(frame, command)
+
+# Четыре точки, которые cluster.py подменяет в режиме воркеров (--workers):
+# там журнал и channels.json ведёт главный процесс, а события идут через шину.
+
+def store_message(kind, key, msg):
+    """Пишет сообщение в журнал и после коммита рассылает его. Вызывается под
+    блокировкой переписки; что вернула — передать finish_store() после неё."""
+    commit = message_log.append(kind, key, msg)
+    record = {'op': 'add', 'kind': kind, 'key': key, 'msg': msg}
+    return after_commit(commit, lambda: deliver(kind, key, msg), locks.delivery(conversation_key(kind, key)),
+                        lambda error: report_unsaved(record, msg['user'], error))
+
+def store_removal(record, user):
+    """Пишет в журнал удаление сообщения или очистку переписки (message_log.py)
+    и после коммита сообщает получателям. Вызывается под блокировкой переписки,
+    как store_message; user — кто просил, ему ответ, если не записалось."""
+    commit = message_log.write(record)
+    kind, key = record['kind'], record['key']
+    return after_commit(commit, lambda: deliver_removal(record), locks.delivery(conversation_key(kind, key)),
+                        lambda error: report_unsaved(record, user, error))
+
+def announce(text):
+    """Служебный кадр всем пользователям: PRESENCE: (или ONLINE:/OFFLINE:), FILE:"""
+    broadcast(text)
+
+def subscription_changed(cid, action, user):
+    """Подписка изменилась (под locks.channels)"""
+    store.set_subscribed(cid, user, action == 'JOIN')
+
+def rate_limit(kind, user, ip, conn, notify=True):
+    """Берёт жетон у limiter. 0 — можно, иначе секунды до следующей попытки;
+    при политике disconnect заодно рвёт соединение"""
+    wait = limiter.check(kind, user, ip)
+    if not wait:
+        throttled.discard((kind, user))
+        return 0
+    if limiter.policy == 'disconnect':
+        print(f"[!] {user} ({ip}) превысил лимит {kind} — отключён")
+        conn.abort()
+    elif notify and (kind, user) not in throttled:
+        throttled.add((kind, user))
+        conn.send(f"THROTTLED:{kind}:{int(wait * 1000) + 1}")
+    return wait
+
+def rate_kind(msg):
+    """Какое ведро тратит команда; None — без ограничения"""
+    if msg.startswith(('MSG:', 'PRIVATE:')):
+        return 'message'
+    if msg.startswith('CHANNEL:') and msg.split(':', 3)[2:3] == ['MSG']:
+        return 'channel'
+    if msg.startswith('SEARCH:'):
+        return 'search'
+    return None
+
+def dispatch(msg, username, conn, ip):
+    """Разбирает текстовую команду протокола (кроме FILE:, которой нужен поток байт)"""
+    kind = rate_kind(msg)
+    if kind and rate_limit(kind, username, ip, conn):
+        return
+    handle_command(msg, username, conn)
+
+def handle_command(msg, username, conn):
+    """Команда после проверки лимитов; aio_server зовёт её и из пула потоков"""
+    if msg.startswith('MSG:'):
+        handle_public(msg[4:], username)
+    elif msg.startswith('PRIVATE:'):
+        handle_private(msg[8:], username)
+    elif msg.startswith('CHANNEL:'):
+        handle_channel(msg[8:], username)
+    elif msg.startswith('HISTORY:'):
+        handle_history(msg[8:], username)
+    elif msg.startswith('SEARCH:'):
+        handle_search(msg[7:], username)
+    elif msg.startswith('DELETE:'):
+        handle_delete(msg[7:], username)
+    elif msg.startswith('CLEAR:'):
+        handle_clear(msg[6:], username)
+    elif msg.startswith('STATS:'):
+        handle_stats(username, conn)
+
+def login_prompt():
+    """Приглашение LOGIN, а после двоеточия — что клиент может включить до входа"""
+    offers = []
+    if compression.THRESHOLD:
+        offers.append(compression.CODEC)
+    if BINARY_WIRE:
+        offers.append(wire.CODEC)
+    return 'LOGIN:' + ','.join(offers) if offers else 'LOGIN'
+
+def negotiate(frame, conn):
+    """Кадр согласования перед входом: COMPRESS:<кодек> или ENCODING:<кодек>.
+    Включает предложенное и возвращает True; любой другой кадр — False."""
+    if compression.THRESHOLD and frame == compression.REQUEST:
+        conn.deflate = compression.pack
+    elif BINARY_WIRE and frame == wire.REQUEST:
+        conn.binary = True
+    else:
+        return False
+    return True
+
+def handle_client(sock, addr):
+    conn = QueuedConnection(sock, SEND_QUEUE_LIMIT, OVERFLOW_POLICY)
     username = None
     try:
-        conn.send(b'LOGIN')
-        auth = conn.recv(1024).decode('utf-8')
-        if not auth.startswith('LOGIN:'):
-            conn.close()
+        conn.send(login_prompt())
+        auth = conn.recv_frame()
+        while auth is not None and negotiate(auth, conn):
+            auth = conn.recv_frame()
+        if auth is None:
+            return
+        auth = auth.decode('utf-8')
+        metrics.frame_in(metrics.command(auth), len(auth.encode('utf-8')) + HEADER.size)
+        if auth.startswith('UPLOAD:'):
+            # Отдельное соединение под загрузку — чат пользователя идёт своим потоком
+            handle_upload(auth, conn, addr)
+            return
+        if auth.startswith('DOWNLOAD:'):
+            handle_download(auth, conn, addr)
+            return
+        username = authenticate(auth, conn, addr)
+        if not username:
             return
-        username, password = auth[6:].split(':', 1)
-        with lock:
-            users = data['users']
-            if username in users and users[username]['password'] == hashlib.sha256(password.encode()).hexdigest():
-                conn.send(b'OK')
-                clients[username] = conn
-                broadcast(f"ONLINE:{username}")
-                print(f"[+] {username} вошёл ({addr[0]})")
-            else:
-                conn.send(b'FAIL')
-                conn.close()
-                return
 
-        while True:
-            msg = conn.recv(4096).decode('utf-8')
-            if not msg: break
+        for frame in conn:
+            if conn.closed:
+                # Отключён лимитом (rate_limit) — недочитанное из буфера не исполняем
+                break
+            msg = frame.decode('utf-8')
+            metrics.frame_in(metrics.command(msg), len(frame) + HEADER.size)
 
-            if msg.startswith('MSG:'):
-                handle_public(msg[4:], username)
-            elif msg.startswith('PRIVATE:'):
-                handle_private(msg[8:], username)
-            elif msg.startswith('CHANNEL:'):
-                handle_channel(msg[8:], username)
-            elif msg.startswith('FILE:'):
-                handle_file(msg[5:], conn, username)
+            if msg.startswith('FILE:'):
+                handle_file(msg[5:], conn, username, addr[0])
+            else:
+                dispatch(msg, username, conn, addr[0])
 
     except Exception as e:
         print(f"Ошибка клиента {addr}: {e}")
     finally:
         if username:
-            with lock:
-                clients.pop(username, None)
-            broadcast(f"OFFLINE:{username}")
-            print(f"[-] {username} вышел")
+            disconnect(username, conn)
         conn.close()
 
 def handle_public(text, user):
@@ -100,84 +464,445 @@ def handle_public(text, user):
         'message': text,
         'timestamp': datetime.now().isoformat(),
         'is_admin': data['users'].get(user, {}).get('is_admin', False),
-        'id': str(int(datetime.now().timestamp() * 1000))
+        'id': ids.new_id()
     }
-    with lock:
-        data['messages'].append(msg)
-        with open(FILES['messages'], 'w', encoding='utf-8') as f:
-            json.dump(data['messages'], f, ensure_ascii=False, indent=4)
-    broadcast(f"MSG:{json.dumps(msg)}")
+    with locks.conversation('public'):
+        finish = store_message('messages', None, msg)
+    finish_store(finish)
 
 def handle_private(data_str, sender):
     recipient, text = data_str.split(':', 1)
+    if recipient not in data['users']:
+        # Переписка с несуществующим именем так и осталась бы в журнале и сегментах
+        return
     msg = {
         'user': sender,
         'message': text,
         'timestamp': datetime.now().isoformat(),
-        'id': str(int(datetime.now().timestamp() * 1000))
+        'id': ids.new_id()
     }
     key = f"{min(sender, recipient)}_{max(sender, recipient)}"
-    with lock:
-        if key not in data['private']:
-            data['private'][key] = []
-        data['private'][key].append(msg)
-        with open(FILES['private'], 'w', encoding='utf-8') as f:
-            json.dump(data['private'], f, ensure_ascii=False, indent=4)
-    for u in [sender, recipient]:
-        if u in clients:
-            clients[u].send(f"PRIVATE:{u}:{json.dumps(msg)}".encode('utf-8'))
+    with locks.conversation(f"private:{key}"):
+        finish = store_message('private', key, msg)
+    finish_store(finish)
 
 def handle_channel(data_str, user):
     parts = data_str.split(':', 2)
     if len(parts) < 3: return
     cid, action, payload = parts
     if action == 'MSG':
-        with lock:
-            if cid not in data['channel_msgs']:
-                data['channel_msgs'][cid] = []
-            msg = {
-                'user': user,
-                'message': payload,
-                'timestamp': datetime.now().isoformat(),
-                'id': str(int(datetime.now().timestamp() * 1000))
-            }
-            data['channel_msgs'][cid].append(msg)
-            with open(FILES['channel_msgs'], 'w', encoding='utf-8') as f:
-                json.dump(data['channel_msgs'], f, ensure_ascii=False, indent=4)
-        subs = data['channels'].get(cid, {}).get('subscribers', [])
-        for sub in subs:
-            if sub in clients:
-                clients[sub].send(f"CHANNEL:{cid}:MSG:{json.dumps(msg)}".encode('utf-8'))
-
-def handle_file(info, conn, user):
+        with locks.channels:
+            if cid not in data['channels']:
+                return
+        msg = {
+            'user': user,
+            'message': payload,
+            'timestamp': datetime.now().isoformat(),
+            'id': ids.new_id()
+        }
+        with locks.conversation(f"channel:{cid}"):
+            finish = store_message('channel_msgs', cid, msg)
+        finish_store(finish)
+    elif action in ('JOIN', 'LEAVE'):
+        with locks.channels:
+            if cid not in data['channels']:
+                ok = False
+            elif action == 'JOIN':
+                ok = channel_index.subscribe(cid, user)
+            else:
+                ok = channel_index.unsubscribe(cid, user)
+            if ok:
+                subscription_changed(cid, action, user)
+        conn = clients.get(user)
+        if conn:
+            conn.send(f"CHANNEL:{cid}:{action}:{'OK' if ok else 'FAIL'}")
+
+# kind журнала → chat_type протокола
+CHAT_TYPES = {'messages': 'public', 'private': 'private', 'channel_msgs': 'channel'}
+
+def conversation_key(kind, key):
+    """Ключ переписки в locks.py: 'public', 'private:<a>_<b>', 'channel:<id>'"""
+    if kind == 'messages':
+        return 'public'
+    if kind == 'private':
+        return f"private:{key}"
+    return f"channel:{key}"
+
+def conversation_lock(kind, key):
+    """Та же блокировка переписки, под которой handle_public / handle_private /
+    handle_channel сохраняют сообщения"""
+    return locks.conversation(conversation_key(kind, key))
+
+def history_conversation(query, user):
+    """Переписка из запроса истории → (kind, key) в журнале; чужую — KeyError"""
+    chat, target = query.get('chat_type', 'public'), query.get('target')
+    if chat == 'public':
+        return 'messages', None
+    if chat == 'private':
+        if target not in data['users']:
+            raise KeyError(f'нет пользователя {target}')
+        return 'private', f"{min(user, target)}_{max(user, target)}"
+    if chat == 'channel':
+        if not can_read_channel(target, user):
+            raise KeyError(f'нет доступа к каналу {target}')
+        return 'channel_msgs', target
+    raise KeyError(f'неизвестный тип чата {chat}')
+
+def can_read_channel(cid, user):
+    with locks.channels:
+        channel = data['channels'].get(cid)
+        return channel is not None and bool(channel.get('is_public') or channel_index.is_subscribed(cid, user))
+
+def can_read(kind, key, user):
+    """Видны ли пользователю сообщения переписки в поиске (администратору — все)"""
+    if kind == 'messages' or data['users'].get(user, {}).get('is_admin'):
+        return True
+    if kind == 'private':
+        return private_peer(key, user) is not None
+    return can_read_channel(key, user)
+
+def handle_history(request, user):
+    """HISTORY:{"chat_type", "target", "before" | "after", "limit"} — страница истории.
+    Ответ только запросившему: HISTORY:{"chat_type", "target", "messages", "more"}"""
+    reply = {}
+    try:
+        query = json.loads(request)
+        reply = {'chat_type': query.get('chat_type', 'public'), 'target': query.get('target')}
+        kind, key = history_conversation(query, user)
+        limit = max(1, min(int(query.get('limit', PAGE_SIZE)), HISTORY_LIMIT))
+        reply['messages'], reply['more'] = message_log.page(
+            kind, key, query.get('before'), query.get('after'), limit)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        reply['error'] = f"неверный запрос истории: {e}"
+    conn = clients.get(user)
+    if conn:
+        conn.send(wire.encode('HISTORY', reply.get('target'), reply, conn.binary))
+
+def handle_search(request, user):
+    """SEARCH:{"query", "chat_type", "target", "before", "limit"} — поиск по истории;
+    без chat_type — по всем доступным перепискам. Ответ только запросившему:
+    SEARCH:{"query", "hits", "next"} — hits от новых к старым (сообщение + chat_type
+    и target), next — before следующей страницы или null."""
+    reply = {}
+    try:
+        query = json.loads(request)
+        reply = {'query': query['query']}
+        conv = history_conversation(query, user) if query.get('chat_type') else None
+        limit = max(1, min(int(query.get('limit', PAGE_SIZE)), HISTORY_LIMIT))
+        before = query.get('before')
+        found, reply['next'] = message_log.search(
+            query['query'], conv, None if before is None else int(before), limit,
+            lambda kind, key: can_read(kind, key, user))
+        hits = []
+        for kind, key, msg in found:
+            target = key
+            if kind == 'private':
+                # Своя переписка — собеседник, как в PRIVATE:; чужая (администратор) — ключ
+                target = private_peer(key, user) or key
+            hits.append(dict(msg, chat_type=CHAT_TYPES[kind], target=target))
+        reply['hits'] = hits
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        reply['error'] = f"неверный запрос поиска: {e}"
+    conn = clients.get(user)
+    if conn:
+        conn.send(f"SEARCH:{wire.to_json(reply)}")
+
+def handle_delete(request, user):
+    """DELETE:{"chat_type", "target", "id"} — удаляет своё сообщение (администратор — любое).
+    Получателям переписки — DELETED:{"chat_type", "target", "id"}, ошибка — только запросившему."""
+    reply = {}
+    try:
+        query = json.loads(request)
+        reply = {'chat_type': query.get('chat_type', 'public'), 'target': query.get('target'), 'id': query.get('id')}
+        kind, key = history_conversation(query, user)
+        msg = message_log.find(kind, key, query['id'])
+        if msg.get('user') != user and not data['users'].get(user, {}).get('is_admin'):
+            raise KeyError('чужое сообщение')
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        reply['error'] = f"нельзя удалить: {e}"
+        conn = clients.get(user)
+        if conn:
+            conn.send(f"DELETED:{wire.to_json(reply)}")
+        return
+    record = {'op': 'delete', 'kind': kind, 'key': key, 'id': msg['id']}
+    if kind == 'private':
+        record['users'] = [user, query['target']]
+    with conversation_lock(kind, key):
+        finish = store_removal(record, user)
+    finish_store(finish)
+
+def handle_clear(request, user):
+    """CLEAR:{"chat_type", "target"} — администратор очищает общий чат или канал.
+    Получателям — CLEARED:{"chat_type", "target"}, ошибка — только запросившему."""
+    reply = {}
+    try:
+        query = json.loads(request)
+        reply = {'chat_type': query.get('chat_type', 'public'), 'target': query.get('target')}
+        if not data['users'].get(user, {}).get('is_admin'):
+            raise KeyError('только для администратора')
+        kind, key = history_conversation(query, user)
+        if kind == 'private':
+            raise KeyError('личную переписку очистить нельзя')
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        reply['error'] = f"нельзя очистить: {e}"
+        conn = clients.get(user)
+        if conn:
+            conn.send(f"CLEARED:{wire.to_json(reply)}")
+        return
+    with conversation_lock(kind, key):
+        finish = store_removal({'op': 'clear', 'kind': kind, 'key': key}, user)
+    finish_store(finish)
+
+def handle_stats(user, conn):
+    """STATS: — счётчики сервера для мониторинга, только администраторам"""
+    if not data['users'].get(user, {}).get('is_admin'):
+        return
+    stats = {'online': len(clients), 'rate_limits': limiter.stats()}
+    conn.send(f"STATS:{wire.to_json(stats)}")
+
+def media_path(filename):
+    filename = os.path.basename(filename)
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in ['.png','.jpg','.jpeg','.gif','.bmp']:
+        return os.path.join('chat_images', filename)
+    elif ext in ['.mp4','.avi','.mov','.mkv']:
+        return os.path.join('chat_videos', filename)
+    else:
+        return os.path.join('voice_messages', filename)
+
+def parse_upload(auth):
+    """UPLOAD:<user>:<password>:<имя файла>:<размер>[:<sha256>] →
+    (user, имя файла, размер, sha256 или None)"""
+    username, rest = auth[7:].split(':', 1)
+    sha = None
+    head, last = rest.rsplit(':', 1)
+    if not last.isdigit():
+        sha = uploads.parse_sha256(last)
+        rest = head
+    password, filename, size = rest.rsplit(':', 2)
+    if not check_password(username, password):
+        raise UploadError('неверный логин или пароль')
+    filename, size = uploads.parse_upload_info(f"{filename}:{size}", UPLOAD_LIMIT)
+    return username, filename, size, sha
+
+def handle_upload(auth, conn, addr):
+    upload = None
     try:
-        filename, size_str = info.split(':')
-        size = int(size_str)
-        ext = os.path.splitext(filename)[1].lower()
-        if ext in ['.png','.jpg','.jpeg','.gif','.bmp']:
-            path = os.path.join('chat_images', filename)
-        elif ext in ['.mp4','.avi','.mov','.mkv']:
-            path = os.path.join('chat_videos', filename)
+        user, filename, size, sha = parse_upload(auth)
+        wait = rate_limit('upload', user, addr[0], conn, notify=False)
+        if wait:
+            conn.send(f"FAIL:слишком много загрузок, повторите через {wait:.0f} с")
+            return
+        if sha and content_store.has(sha):
+            # Файл уже есть (пересылка) — только новое имя, тело не передаётся
+            content_store.link(sha, media_path(filename))
+            conn.send(b'EXISTS')
+            print(f"[F] {user} переслал {filename} из хранилища ({addr[0]})")
+            announce(f"FILE:{filename}")
+            return
+        if sha:
+            upload = content_store.open_upload(sha, size)
+    except (ValueError, OSError) as e:
+        conn.send(f"FAIL:{e}")
+        return
+    try:
+        if upload:
+            conn.send(f"OK:{sha}:{upload.offset}")
+            start = upload.offset
+            try:
+                uploads.receive_resumable(conn.sock, upload, conn.take_buffered())
+            finally:
+                # Тело идёт мимо кадров — в байты от клиентов добавляем сами, и оборванное тоже
+                metrics.bytes_in.inc(value=upload.offset - start)
+            content_store.link(sha, media_path(filename))
         else:
-            path = os.path.join('voice_messages', filename)
-        with open(path, 'wb') as f:
-            received = 0
-            while received < size:
-                data = conn.recv(4096)
-                if not data: break
-                f.write(data)
-                received += len(data)
-        broadcast(f"FILE:{filename}")
+            conn.send(b'OK')
+            uploads.receive_stream(conn.sock, media_path(filename), size, conn.take_buffered())
+            metrics.bytes_in.inc(value=size)
+    except (UploadError, OSError) as e:
+        print(f"Ошибка загрузки {filename} от {user}: {e}")
+        conn.send(f"FAIL:{e}")
+        return
+    finally:
+        if upload:
+            upload.close()
+    conn.send(b'DONE')
+    print(f"[F] {user} загрузил {filename} ({size} байт, {addr[0]})")
+    announce(f"FILE:{filename}")
+
+def parse_download(request):
+    """DOWNLOAD:<user>:<password>:<имя файла>[:<диапазон>] → (user, имя файла, диапазон)"""
+    username, password, filename, spec = downloads.split_request(request)
+    if not check_password(username, password):
+        raise downloads.DownloadError('неверный логин или пароль')
+    return username, uploads.safe_filename(filename), spec
+
+def handle_download(request, conn, addr):
+    try:
+        user, filename, spec = parse_download(request)
+        f, start, length, total = downloads.open_range(media_path(filename), spec)
+    except (ValueError, OSError) as e:
+        conn.send(f"FAIL:{e}")
+        return
+    with f:
+        conn.send(f"OK:{start}:{length}:{total}")
+        # Ответ должен уйти раньше тела: дожидаемся очереди, дальше сокет наш
+        conn.stop_writer()
+        if length:
+            metrics.bytes_out.inc(value=conn.sock.sendfile(f, offset=start, count=length))
+    print(f"[D] {user} скачал {filename} [{start}+{length} из {total}] ({addr[0]})")
+
+def handle_file(info, conn, user, ip):
+    """Старый путь: файл кадрами по соединению чата (см. handle_upload для отдельного)"""
+    try:
+        filename, size = uploads.parse_upload_info(info, UPLOAD_LIMIT)
+        if rate_limit('upload', user, ip, conn):
+            # Отказать в этом протоколе нельзя — тело уже в пути, дочитываем вхолостую
+            uploads.skip_frames(conn, size)
+            metrics.bytes_in.inc(value=size)
+            return
+        uploads.receive_frames(conn, media_path(filename), size)
+        metrics.bytes_in.inc(value=size)
+        announce(f"FILE:{filename}")
     except Exception as e:
         print(f"Ошибка файла: {e}")
 
-# Запуск
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-server.bind((HOST, PORT))
-server.listen()
-print(f"[SERVER] Запущен на {HOST}:{PORT}")
+def serve_threaded(host, port, reuse_port=False):
+    """Классический режим: отдельный поток на каждое соединение"""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Воркеры (cluster.py) слушают один порт, соединения делит ядро
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.bind((host, port))
+    server.listen()
+    print(f"[SERVER] Запущен на {host}:{port} (threaded)")
+
+    while True:
+        conn, addr = server.accept()
+        threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+
+def main():
+    global SEND_QUEUE_LIMIT, OVERFLOW_POLICY, UPLOAD_LIMIT, BINARY_WIRE, SEARCH, limiter
+    parser = argparse.ArgumentParser(description='Tandau Messenger Server')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--mode', choices=['threaded', 'asyncio'], default='threaded',
+                        help='threaded — поток на соединение, asyncio — один event loop на все соединения')
+    parser.add_argument('--storage', choices=storage.BACKENDS, default='json',
+                        help=f'json — users.json, channels.json и журнал message_log/, '
+                             f'sqlite — всё в {storage.DB_FILE} (при первом запуске импорт из json)')
+    parser.add_argument('--fsync', choices=FSYNC_POLICIES, default=message_log.fsync_policy,
+                        help='always — fsync каждой пачки, interval — раз в --fsync-interval-ms, os — без fsync')
+    parser.add_argument('--fsync-interval-ms', type=float, default=message_log.fsync_interval * 1000)
+    parser.add_argument('--batch-size', type=int, default=message_log.batch_size,
+                        help='максимум сообщений в одной записи журнала')
+    parser.add_argument('--segment-size', type=int, default=SEGMENT_SIZE,
+                        help='сообщений в одном сегменте переписки (message_log/segments/)')
+    parser.add_argument('--retention-days', type=float, default=0,
+                        help='удалять сегменты, где все сообщения старше стольких дней, 0 — хранить всё '
+                             '(только --storage json)')
+    parser.add_argument('--retention-messages', type=int, default=0,
+                        help='хранить в переписке не меньше стольких последних сообщений, '
+                             'более старые сегменты удалять; 0 — хранить всё (только --storage json)')
+    parser.add_argument('--lazy-history', action='store_true',
+                        help='при старте читать только общий чат, личные переписки и каналы — '
+                             'при первом обращении')
+    parser.add_argument('--history-cache', type=int, default=message_log.cache_size,
+                        help='с --lazy-history: сколько личных переписок и каналов держать в памяти')
+    parser.add_argument('--no-search', action='store_true',
+                        help='без полнотекстового поиска SEARCH: (индекс не строится и не держится в памяти)')
+    parser.add_argument('--send-queue', type=int, default=SEND_QUEUE_LIMIT,
+                        help='максимум кадров в исходящей очереди соединения')
+    parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default=OVERFLOW_POLICY,
+                        help='что делать с переполненной очередью медленного клиента')
+    parser.add_argument('--max-upload-mb', type=int, default=UPLOAD_LIMIT // (1024 * 1024),
+                        help='максимальный размер загружаемого файла')
+    parser.add_argument('--node-id', type=int, default=None,
+                        help=f'номер узла в id сообщений (0..{ids.MAX_NODE}), уникальный для каждого сервера; '
+                             f'по умолчанию TANDAU_NODE_ID, иначе 0. С --workers обязателен: '
+                             f'воркеры получают следующие номера')
+    parser.add_argument('--presence-interval-ms', type=float, default=presence.interval * 1000,
+                        help='окно склейки ONLINE/OFFLINE в один кадр PRESENCE:, 0 — без склейки')
+    parser.add_argument('--rate-limit', choices=RATE_POLICIES, default=limiter.policy,
+                        help='что делать с превысившим лимит частоты: throttle — отбрасывать, '
+                             'disconnect — отключать, off — без лимитов')
+    parser.add_argument('--compress-threshold', type=int, default=compression.THRESHOLD,
+                        help='сжимать кадры клиентам от стольких байт (если клиент согласен), 0 — не сжимать')
+    parser.add_argument('--no-binary-wire', action='store_true',
+                        help='не предлагать клиентам двоичные кадры сообщений bin1')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help='порт на 127.0.0.1 с метриками в формате Prometheus (GET /metrics); '
+                             '0 — выключено; воркеры — на следующих портах')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='число процессов-воркеров на одном порту (SO_REUSEPORT, см. cluster.py)')
+    parser.add_argument('--bus', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    SEND_QUEUE_LIMIT = args.send_queue
+    OVERFLOW_POLICY = args.overflow
+    UPLOAD_LIMIT = args.max_upload_mb * 1024 * 1024
+    default_node = args.node_id is None and ids.node_from_env() is None
+    if args.node_id is None:
+        if args.workers > 1 and default_node:
+            parser.error('с --workers нужен --node-id (или TANDAU_NODE_ID): иначе id сообщений '
+                         'разных серверов совпадут')
+        args.node_id = 0 if default_node else ids.node_from_env()
+    last_node = args.node_id + (args.workers if args.workers > 1 and not args.bus else 0)
+    if not 0 <= args.node_id or last_node > ids.MAX_NODE:
+        parser.error(f'номера узлов {args.node_id}..{last_node} вне 0..{ids.MAX_NODE}')
+    if args.storage == 'sqlite' and (args.retention_days or args.retention_messages):
+        # Срок хранения удаляет сегменты журнала, а в SqliteLog их нет
+        parser.error('--retention-days и --retention-messages работают только с --storage json')
+    ids.configure(args.node_id)
+    limiter = RateLimiter(policy=args.rate_limit)
+    presence.interval = args.presence_interval_ms / 1000
+    compression.THRESHOLD = args.compress_threshold
+    BINARY_WIRE = not args.no_binary_wire
+    SEARCH = not args.no_search
+
+    open_store(args.storage, replica=bool(args.bus))
+    message_log.fsync_policy = args.fsync
+    message_log.fsync_interval = args.fsync_interval_ms / 1000
+    message_log.batch_size = args.batch_size
+    message_log.retention_days = args.retention_days
+    message_log.retention_messages = args.retention_messages
+    message_log.lazy = args.lazy_history
+    message_log.cache_size = args.history_cache
+    if message_log.segments:
+        message_log.segments.segment_size = args.segment_size
+
+    if args.bus:
+        # Воркер кластера: журнал пишет главный процесс, здесь — реплика
+        message_log.replica = True
+    else:
+        print(BANNER)
+        if default_node:
+            print("[ID] Номер узла 0 (--node-id не задан): серверам с общей историей нужны разные номера")
+    load_data()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    # SIGTERM — как Ctrl+C: журнал дописывается, поисковый индекс сохраняется
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        if args.bus or args.workers > 1:
+            import cluster
+            if args.bus:
+                cluster.run_worker(args)
+            else:
+                cluster.run_cluster(args)
+        elif args.mode == 'asyncio':
+            import aio_server
+            aio_server.serve(args.host, args.port)
+        else:
+            serve_threaded(args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        message_log.close()
 
-while True:
-    conn, addr = server.accept()
-    threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
\ No newline at end of file
+if __name__ == '__main__':
+    # Вспомогательные модули делают `import server` — пусть получат этот же модуль, а не вторую копию
+    sys.modules.setdefault('server', sys.modules[__name__])
+    main()
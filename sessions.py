@@ -0,0 +1,60 @@
+# sessions.py — подписанные токены сессии для быстрого переподключения
+#
+# После LOGIN сервер выдаёт токен SESSION:<token>. При обрыве клиент
+# переподключается кадром RESUME:<token>:<last_seen_id> — без пароля и без
+# sha256 пароля, а сервер досылает только пропущенное (см. server.resume).
+#
+# Токен — <имя в base64url>.<истекает, unix>.<HMAC-SHA256 усечённый до 16 байт>.
+# Сервер ничего не хранит про выданные токены: проверка — один HMAC.
+# Секрет лежит в файле, поэтому токены переживают перезапуск сервера и
+# массовое переподключение после рестарта не проверяет пароли заново.
+import base64
+import hashlib
+import hmac
+import os
+import time
+
+SECRET_FILE = 'session_secret'
+TOKEN_TTL = 30 * 24 * 3600
+
+def b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+def b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+class SessionTokens:
+    def __init__(self, secret_file=SECRET_FILE, ttl=TOKEN_TTL):
+        self.secret_file = secret_file
+        self.ttl = ttl
+        self.secret = None
+
+    def load(self):
+        """Читает секрет подписи или создаёт новый (все старые токены тогда недействительны)"""
+        if os.path.exists(self.secret_file):
+            with open(self.secret_file, 'rb') as f:
+                self.secret = f.read()
+            return
+        self.secret = os.urandom(32)
+        fd = os.open(self.secret_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.secret)
+
+    def sign(self, body):
+        return b64encode(hmac.new(self.secret, body.encode('ascii'), hashlib.sha256).digest()[:16])
+
+    def issue(self, username):
+        body = f"{b64encode(username.encode('utf-8'))}.{int(time.time()) + self.ttl}"
+        return f"{body}.{self.sign(body)}"
+
+    def verify(self, token):
+        """Имя пользователя из токена или None, если подпись неверна или срок истёк"""
+        try:
+            user_b64, expires, signature = token.split('.')
+            if not hmac.compare_digest(signature, self.sign(f"{user_b64}.{expires}")):
+                return None
+            if int(expires) < time.time():
+                return None
+            return b64decode(user_b64).decode('utf-8')
+        except (ValueError, TypeError, UnicodeError):
+            return None
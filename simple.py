@@ -15,11 +15,15 @@ from kivy.clock import Clock
 from kivy.graphics import Color, Rectangle
 from kivy.metrics import dp
 
-import json
-import os
 import hashlib
 from datetime import datetime
 
+from ids import new_id
+from local_storage import open_local
+
+# Где приложение хранит данные: sqlite или json (см. local_storage.py)
+STORAGE_BACKEND = 'sqlite'
+
 class ChatBubble(BoxLayout):
     def __init__(self, message_data, **kwargs):
         super().__init__(**kwargs)
@@ -435,10 +439,11 @@ class ChatScreen(Screen):
         messages = app.get_messages(
             self.current_chat_type,
             self.current_private_with,
-            self.current_channel_id
+            self.current_channel_id,
+            limit=30  # Последние 30 сообщений
         )
         
-        for msg in messages[-30:]:  # Последние 30 сообщений
+        for msg in messages:
             if not isinstance(msg, dict):
                 continue
             
@@ -681,26 +686,17 @@ class MessengerApp(App):
         super().__init__(**kwargs)
         self.current_user = None
         self.is_admin = False
-        self.data_file = "messenger_data.json"
+        # SQLite (при первом запуске переносит messenger_data.json) или старый JSON, см. local_storage.py
+        self.storage = open_local(STORAGE_BACKEND)
         self.initialize_data()
     
     def initialize_data(self):
-        if not os.path.exists(self.data_file):
-            data = {
-                "users": {
-                    "admin": {
-                        "password": self.hash_password("admin123"),
-                        "is_admin": True,
-                        "registered": datetime.now().isoformat()
-                    }
-                },
-                "messages": [],
-                "private_messages": {},
-                "channels": {},
-                "channel_messages": {}
-            }
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+        if not self.storage.users():
+            self.storage.add_user("admin", {
+                "password": self.hash_password("admin123"),
+                "is_admin": True,
+                "registered": datetime.now().isoformat()
+            })
     
     def hash_password(self, password):
         return hashlib.sha256(password.encode()).hexdigest()
@@ -714,12 +710,10 @@ class MessengerApp(App):
     
     def login(self, username, password):
         try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            if username in data["users"] and data["users"][username]["password"] == self.hash_password(password):
+            user = self.storage.user(username)
+            if user and user["password"] == self.hash_password(password):
                 self.current_user = username
-                self.is_admin = data["users"][username].get("is_admin", False)
+                self.is_admin = user.get("is_admin", False)
                 return True
         except Exception as e:
             print(f"Ошибка входа: {e}")
@@ -728,45 +722,30 @@ class MessengerApp(App):
     
     def register(self, username, password):
         try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            if username in data["users"]:
-                return False
-            
-            data["users"][username] = {
+            return self.storage.add_user(username, {
                 "password": self.hash_password(password),
                 "is_admin": False,
                 "registered": datetime.now().isoformat()
-            }
-            
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
-            return True
+            })
         except Exception as e:
             print(f"Ошибка регистрации: {e}")
             return False
     
-    def get_messages(self, chat_type="public", private_with=None, channel_id=None):
+    def get_messages(self, chat_type="public", private_with=None, channel_id=None, limit=None):
         try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
             if chat_type == "public":
-                return data.get("messages", [])
+                return self.storage.messages('messages', limit=limit)
             elif chat_type == "private" and private_with:
-                private_messages = data.get("private_messages", {})
                 chat_key = f"{self.current_user}_{private_with}"
                 chat_key_alt = f"{private_with}_{self.current_user}"
                 
                 for key in [chat_key, chat_key_alt]:
-                    if key in private_messages:
-                        return private_messages[key]
+                    messages = self.storage.messages('private', key, limit=limit)
+                    if messages:
+                        return messages
                 return []
             elif chat_type == "channel" and channel_id:
-                channel_messages = data.get("channel_messages", {})
-                return channel_messages.get(channel_id, [])
+                return self.storage.messages('channel_msgs', channel_id, limit=limit)
                 
         except Exception as e:
             print(f"Ошибка загрузки сообщений: {e}")
@@ -775,41 +754,20 @@ class MessengerApp(App):
     
     def send_message(self, message_text, chat_type="public", private_with=None, channel_id=None):
         try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
             message_data = {
                 'user': self.current_user,
                 'message': message_text,
                 'timestamp': datetime.now().isoformat(),
                 'is_admin': self.is_admin,
-                'id': str(int(datetime.now().timestamp()))
+                'id': new_id()
             }
             
             if chat_type == "public":
-                if "messages" not in data:
-                    data["messages"] = []
-                data["messages"].append(message_data)
-                
+                self.storage.add_message('messages', None, message_data)
             elif chat_type == "private" and private_with:
-                if "private_messages" not in data:
-                    data["private_messages"] = {}
-                
-                chat_key = f"{self.current_user}_{private_with}"
-                if chat_key not in data["private_messages"]:
-                    data["private_messages"][chat_key] = []
-                data["private_messages"][chat_key].append(message_data)
-                
+                self.storage.add_message('private', f"{self.current_user}_{private_with}", message_data)
             elif chat_type == "channel" and channel_id:
-                if "channel_messages" not in data:
-                    data["channel_messages"] = {}
-                
-                if channel_id not in data["channel_messages"]:
-                    data["channel_messages"][channel_id] = []
-                data["channel_messages"][channel_id].append(message_data)
-            
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+                self.storage.add_message('channel_msgs', channel_id, message_data)
             
             return True
         except Exception as e:
@@ -818,45 +776,25 @@ class MessengerApp(App):
     
     def get_users(self):
         try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            return list(data.get("users", {}).keys())
+            return list(self.storage.users())
         except:
             return []
     
     def get_channels(self):
         try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            return data.get("channels", {})
+            return self.storage.channels()
         except:
             return {}
     
     def create_channel(self, name, description=""):
         try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            if "channels" not in data:
-                data["channels"] = {}
-            
-            channel_id = str(int(datetime.now().timestamp()))
-            data["channels"][channel_id] = {
+            self.storage.add_channel(new_id(), {
                 'name': name,
                 'description': description,
                 'owner': self.current_user,
                 'created': datetime.now().isoformat(),
                 'subscribers': [self.current_user]
-            }
-            
-            # Создаем место для сообщений канала
-            if "channel_messages" not in data:
-                data["channel_messages"] = {}
-            data["channel_messages"][channel_id] = []
-            
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
+            })
             return True
         except Exception as e:
             print(f"Ошибка создания канала: {e}")
@@ -864,27 +802,13 @@ class MessengerApp(App):
     
     def get_stats(self):
         try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
-            
-            return {
-                'users': len(data.get("users", {})),
-                'messages': len(data.get("messages", [])),
-                'channels': len(data.get("channels", {}))
-            }
+            return self.storage.stats()
         except:
             return {'users': 0, 'messages': 0, 'channels': 0}
     
     def clear_all_messages(self):
         try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            data["messages"] = []
-            
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
+            self.storage.clear_messages('messages')
             return True
         except Exception as e:
             print(f"Ошибка очистки: {e}")
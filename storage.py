@@ -0,0 +1,109 @@
+# storage.py — история сообщений сервера в SQLite
+#
+# Хранилища пользователей и каналов и сама база — в local_storage.py (их же
+# открывают Kivy-приложения); здесь то, что нужно только серверу:
+#   ServerStorage — SqliteStorage с чтением истории в состояние message_log;
+#   SqliteLog     — журнал сообщений сервера (message_log.MessageLog) поверх
+#                   ServerStorage: тот же групповой коммит, пачка — одна транзакция.
+import json
+import sqlite3
+import threading
+
+from local_storage import (BACKENDS, DB_FILE, INSERT_MESSAGE, DELETE_MESSAGE, CLEAR_MESSAGES,
+                           JsonFiles, SqliteStorage, conversation_key, split_conversation,
+                           migrate_server)
+from message_log import MessageLog, apply_record, empty_state
+from records import pack, pack_id
+
+class ServerStorage(SqliteStorage):
+    """База сервера: записи журнала и чтение истории для message_log"""
+    def record_statement(self, record):
+        """Запись журнала (message_log.py: add / delete / clear) → (sql, параметры)"""
+        conversation = conversation_key(record['kind'], record['key'])
+        if record['op'] == 'add':
+            return INSERT_MESSAGE, self.message_row(record['kind'], record['key'], record['msg'])
+        if record['op'] == 'delete':
+            return DELETE_MESSAGE, (conversation, record['id'])
+        return CLEAR_MESSAGES, (conversation,)
+
+    def load_history(self):
+        """Вся история в виде состояния message_log: messages / private / channel_msgs"""
+        state = empty_state()
+        for conversation, body in self.query('SELECT conversation, body FROM messages ORDER BY seq'):
+            kind, key = split_conversation(conversation)
+            apply_record(state, {'op': 'add', 'kind': kind, 'key': key, 'msg': json.loads(body)})
+        return state
+
+    def load_conversation(self, kind, key):
+        """Одна переписка в виде списка records.Message — по индексу messages_by_conversation"""
+        rows = self.query('SELECT body FROM messages WHERE conversation = ? ORDER BY seq',
+                          (conversation_key(kind, key),))
+        return [pack(json.loads(body)) for (body,) in rows]
+
+    def conversation_heads(self):
+        """{(kind, key): id последнего сообщения} по всем перепискам, кроме общего чата"""
+        rows = self.query('SELECT conversation, id FROM messages WHERE seq IN '
+                          '(SELECT MAX(seq) FROM messages GROUP BY conversation)')
+        return {split_conversation(conversation): pack_id(msg_id)
+                for conversation, msg_id in rows if conversation != 'messages'}
+
+class SqliteLog(MessageLog):
+    """Журнал сообщений сервера в ServerStorage. Очередь, пачки и подтверждения —
+    из MessageLog; вместо файла wal-*.log пачка пишется одной транзакцией,
+    а контрольные точки и сегменты не нужны: база сама и есть состояние."""
+    def __init__(self, store):
+        super().__init__(checkpoint_every=float('inf'))
+        self.store = store
+        self.segments = None
+
+    def encode(self, record):
+        return self.store.record_statement(record)
+
+    def fetch(self, conv):
+        return self.store.load_conversation(*conv)
+
+    def load(self):
+        if self.replica:
+            # Реплика читает всё сразу: в базе может уже быть сообщение, которое
+            # главный процесс ещё только пришлёт ей по шине
+            self.lazy = False
+        if self.lazy:
+            # Сразу — только общий чат; остальные переписки читает fetch() при обращении
+            self.state = empty_state()
+            self.state['messages'] = self.store.load_conversation('messages', None)
+            self.known = self.store.conversation_heads()
+            total = len(self.state['messages'])
+        else:
+            self.state = self.store.load_history()
+            total = len(self.state['messages']) + sum(
+                len(msgs) for kind in ('private', 'channel_msgs') for msgs in self.state[kind].values())
+        if self.replica:
+            print(f"[DB] Реплика истории из {self.store.path}: {total} сообщений")
+            return self.state
+        self.store.set_synchronous(self.fsync_policy)
+        self.writer = threading.Thread(target=self.writer_loop, daemon=True)
+        self.writer.start()
+        print(f"[DB] История загружена из {self.store.path}: {total} сообщений, fsync: {self.fsync_policy}")
+        return self.state
+
+    def persist(self, statements):
+        """Пачка — одна транзакция: при ошибке откатывается целиком"""
+        # Подряд идущие вставки — одним executemany
+        grouped = []
+        for sql, params in statements:
+            if grouped and grouped[-1][0] == sql:
+                grouped[-1][1].append(params)
+            else:
+                grouped.append((sql, [params]))
+        try:
+            self.store.transaction(grouped)
+        except sqlite3.Error as e:
+            # MessageLog.write_batch ждёт OSError — как у файла журнала
+            raise OSError(str(e)) from e
+
+    def close(self):
+        if self.writer:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        self.save_search()
@@ -0,0 +1,68 @@
+# Тесты compression.py: сжатие кадров, пределы распаковки, согласование
+import os
+import zlib
+
+import pytest
+
+import compression
+from compression import MARK, THRESHOLD, accept, offered, pack, unpack
+from framing import FrameError, MAX_FRAME_SIZE
+
+HISTORY = ('HISTORY:{"chat_type": "public", "target": null, "messages": [' + ', '.join(
+    '{"user": "алия", "message": "привет, как дела? %d", "timestamp": "2026-10-17T12:00:00", '
+    '"is_admin": false, "id": "%d"}' % (i, 237271194498 + i) for i in range(50)) + '], "more": true}')
+
+def test_round_trip_long_frame():
+    packed = pack(HISTORY)
+    assert packed[:1] == MARK
+    assert len(packed) < len(HISTORY.encode('utf-8')) // 3
+    assert unpack(packed) == HISTORY.encode('utf-8')
+
+def test_short_frames_are_not_packed():
+    short = b'x' * (THRESHOLD - 1)
+    assert pack(short) is short
+    assert unpack(short) is short
+
+def test_incompressible_frame_stays_raw():
+    noise = os.urandom(THRESHOLD * 4)
+    if noise[:1] == MARK:
+        noise = b'A' + noise[1:]
+    assert pack(noise) == noise
+
+def test_unpack_limits_decompressed_size():
+    c = zlib.compressobj(compression.LEVEL, zlib.DEFLATED, -15, zdict=compression.DICTIONARY)
+    bomb = MARK + c.compress(b'\0' * (MAX_FRAME_SIZE + 1)) + c.flush()
+    with pytest.raises(FrameError):
+        unpack(bomb)
+
+def test_unpack_rejects_truncated_stream():
+    with pytest.raises(FrameError):
+        unpack(pack(HISTORY)[:-8])
+
+def test_unpack_rejects_garbage():
+    with pytest.raises(zlib.error):
+        unpack(MARK + b'\xff\xff\xff')
+
+@pytest.mark.parametrize('welcome, codecs', [
+    (b'LOGIN', []),
+    (b'LOGIN:zlib1', [b'zlib1']),
+    (b'LOGIN:zlib1,bin1', [b'zlib1', b'bin1']),
+])
+def test_offered(welcome, codecs):
+    assert offered(welcome) == codecs
+
+class Conn:
+    def __init__(self):
+        self.sent = []
+        self.inflate = None
+
+    def send(self, payload):
+        self.sent.append(payload)
+
+def test_accept_only_when_offered():
+    conn = Conn()
+    assert not accept(conn, b'LOGIN')
+    assert conn.sent == [] and conn.inflate is None
+    assert accept(conn, b'LOGIN:bin1,zlib1')
+    assert conn.sent == [compression.REQUEST]
+    assert conn.inflate(pack(HISTORY)) == HISTORY.encode('utf-8')
@@ -0,0 +1,50 @@
+# Тесты downloads.py: диапазоны байт и разбор DOWNLOAD:
+import pytest
+
+from downloads import DownloadError, parse_range, split_request
+
+@pytest.mark.parametrize('spec, total, expected', [
+    ('', 1000, (0, 1000)),
+    ('', 0, (0, 0)),
+    ('0-99', 1000, (0, 100)),
+    ('100-199', 1000, (100, 100)),
+    ('999-999', 1000, (999, 1)),
+    # Конец за файлом обрезается по размеру
+    ('900-5000', 1000, (900, 100)),
+    ('100-', 1000, (100, 900)),
+    # Докачка целого файла просит последний байт (downloads.fetch)
+    ('999-', 1000, (999, 1)),
+    ('-500', 1000, (500, 500)),
+    ('-5000', 1000, (0, 1000)),
+    ('-0', 1000, (1000, 0)),
+    # Пустой файл: диапазон от нуля — пустой ответ, а не ошибка
+    ('0-', 0, (0, 0)),
+    ('0-0', 0, (0, 0)),
+])
+def test_parse_range(spec, total, expected):
+    assert parse_range(spec, total) == expected
+
+@pytest.mark.parametrize('spec, total', [
+    ('-', 1000),
+    ('abc', 1000),
+    ('1-2-3', 1000),
+    ('10', 1000),
+    ('1000-', 1000),
+    ('1000-1000', 1000),
+    ('500-100', 1000),
+    ('5-', 0),
+])
+def test_parse_range_rejects(spec, total):
+    with pytest.raises(DownloadError):
+        parse_range(spec, total)
+
+@pytest.mark.parametrize('request_line, expected', [
+    ('DOWNLOAD:a:pw:chat_images/1.jpg', ('a', 'pw', 'chat_images/1.jpg', '')),
+    ('DOWNLOAD:a:pw:chat_images/1.jpg:100-', ('a', 'pw', 'chat_images/1.jpg', '100-')),
+    ('DOWNLOAD:a:pw:video.mp4:-500', ('a', 'pw', 'video.mp4', '-500')),
+    # Двоеточие в пароле, и «-» — имя файла, а не диапазон
+    ('DOWNLOAD:a:p:w:-', ('a', 'p:w', '-', '')),
+    ('DOWNLOAD:a:p:w:x.jpg:0-9', ('a', 'p:w', 'x.jpg', '0-9')),
+])
+def test_split_request(request_line, expected):
+    assert split_request(request_line) == expected
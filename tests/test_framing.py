@@ -0,0 +1,112 @@
+# Тесты framing.py: кадры с префиксом длины, сборка из потока, сокет и asyncio
+import asyncio
+import socket
+import threading
+
+import pytest
+
+import framing
+from framing import (HEADER, IOV_MAX, FrameDecoder, FrameError, FramedSocket, encode_frame,
+                     read_frame, send_buffers, shared_frame)
+
+def test_encode_frame_prefixes_length():
+    assert encode_frame(b'abc') == b'\x00\x00\x00\x03abc'
+    assert encode_frame('привет') == HEADER.pack(12) + 'привет'.encode('utf-8')
+    assert bytes(shared_frame('x')) == encode_frame(b'x')
+
+def test_encode_frame_rejects_oversized(monkeypatch):
+    monkeypatch.setattr(framing, 'MAX_FRAME_SIZE', 10)
+    assert encode_frame(b'x' * 10)
+    with pytest.raises(FrameError):
+        encode_frame(b'x' * 11)
+
+def test_decoder_reassembles_byte_by_byte():
+    payloads = [b'', b'a', b'hello', 'сообщение'.encode('utf-8')]
+    stream = b''.join(encode_frame(p) for p in payloads)
+    decoder = FrameDecoder()
+    frames = []
+    for i in range(len(stream)):
+        frames.extend(decoder.feed(stream[i:i + 1]))
+    assert frames == payloads
+    assert decoder.buffer == bytearray()
+
+def test_decoder_many_frames_in_one_chunk_and_limit():
+    stream = b''.join(encode_frame(b'%d' % i) for i in range(5)) + encode_frame(b'tail')[:3]
+    decoder = FrameDecoder()
+    assert decoder.feed(stream, limit=2) == [b'0', b'1']
+    assert decoder.feed(b'') == [b'2', b'3', b'4']
+    # Начало следующего кадра остаётся в буфере
+    assert decoder.buffer == bytearray(encode_frame(b'tail')[:3])
+    assert decoder.feed(encode_frame(b'tail')[3:]) == [b'tail']
+
+def test_decoder_rejects_oversized_header():
+    decoder = FrameDecoder(max_frame_size=4)
+    with pytest.raises(FrameError):
+        decoder.feed(HEADER.pack(5))
+
+def test_framed_socket_round_trip_and_raw_tail():
+    a, b = socket.socketpair()
+    sender, receiver = FramedSocket(a), FramedSocket(b)
+    try:
+        sender.send('OK:0:4:4')
+        a.sendall(b'body')
+        assert receiver.recv_frame(last=True) == b'OK:0:4:4'
+        # Сырые байты за последним кадром не разбираются как кадр
+        raw = receiver.take_buffered()
+        while len(raw) < 4:
+            raw += b.recv(4 - len(raw))
+        assert raw == b'body'
+        sender.send(b'next')
+        sender.close()
+        assert list(receiver) == [b'next']
+        assert receiver.recv_frame() is None
+    finally:
+        receiver.close()
+
+def test_send_buffers_more_than_iov_max():
+    a, b = socket.socketpair()
+    buffers = [encode_frame(b'%d' % i) for i in range(IOV_MAX * 2 + 3)]
+    expected = b''.join(buffers)
+    received = bytearray()
+    try:
+        reader = threading.Thread(target=lambda: received.extend(_read_exactly(b, len(expected))))
+        reader.start()
+        send_buffers(a, buffers)
+        reader.join()
+    finally:
+        a.close()
+        b.close()
+    assert bytes(received) == expected
+
+def _read_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def read_all(data):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        frames = []
+        while True:
+            frame = await read_frame(reader)
+            if frame is None:
+                return frames
+            frames.append(frame)
+    return asyncio.run(run())
+
+def test_read_frame_async():
+    assert read_all(encode_frame(b'one') + encode_frame(b'')) == [b'one', b'']
+    # Обрыв внутри заголовка — просто конец соединения
+    assert read_all(encode_frame(b'one') + HEADER.pack(3)[:2]) == [b'one']
+
+def test_read_frame_async_truncated_body_and_oversized():
+    with pytest.raises(asyncio.IncompleteReadError):
+        read_all(encode_frame(b'two')[:5])
+    with pytest.raises(FrameError):
+        read_all(HEADER.pack(framing.MAX_FRAME_SIZE + 1))
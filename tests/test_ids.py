@@ -0,0 +1,68 @@
+# Тесты ids.py: поля snowflake, порядок, переполнение счётчика, часы назад
+import pytest
+
+import ids
+from ids import EPOCH_MS, MAX_NODE, NODE_BITS, SEQUENCE_BITS, SEQUENCE_MASK, SnowflakeGenerator
+
+def fields(value):
+    return (value >> (NODE_BITS + SEQUENCE_BITS),
+            (value >> SEQUENCE_BITS) & MAX_NODE,
+            value & SEQUENCE_MASK)
+
+def freeze(monkeypatch, ms):
+    """Часы ids.py стоят на EPOCH_MS + ms, пока их не передвинут через clock[0]"""
+    clock = [ms]
+    monkeypatch.setattr(ids.time, 'time_ns', lambda: (EPOCH_MS + clock[0]) * 1000000)
+    return clock
+
+def test_ids_are_unique_and_increasing():
+    gen = SnowflakeGenerator(3)
+    values = [gen.next_id() for _ in range(20000)]
+    assert values == sorted(values)
+    assert len(set(values)) == len(values)
+    assert {fields(v)[1] for v in values} == {3}
+
+def test_layout(monkeypatch):
+    freeze(monkeypatch, 12345)
+    gen = SnowflakeGenerator(MAX_NODE)
+    assert fields(gen.next_id()) == (12345, MAX_NODE, 0)
+    assert fields(gen.next_id()) == (12345, MAX_NODE, 1)
+
+def test_sequence_overflow_borrows_next_millisecond(monkeypatch):
+    freeze(monkeypatch, 1000)
+    gen = SnowflakeGenerator(1)
+    values = [gen.next_id() for _ in range(SEQUENCE_MASK + 2)]
+    assert fields(values[-2]) == (1000, 1, SEQUENCE_MASK)
+    assert fields(values[-1]) == (1001, 1, 0)
+    assert values == sorted(set(values))
+
+def test_clock_going_back_keeps_order(monkeypatch):
+    clock = freeze(monkeypatch, 5000)
+    gen = SnowflakeGenerator(0)
+    first = gen.next_id()
+    clock[0] = 4000
+    second = gen.next_id()
+    assert second > first
+    assert fields(second)[0] == 5000
+    clock[0] = 6000
+    assert fields(gen.next_id()) == (6000, 0, 0)
+
+@pytest.mark.parametrize('node', [-1, MAX_NODE + 1])
+def test_node_out_of_range(node):
+    with pytest.raises(ValueError):
+        SnowflakeGenerator(node)
+
+def test_node_from_env(monkeypatch):
+    monkeypatch.setenv('TANDAU_NODE_ID', '17')
+    assert SnowflakeGenerator().node_id == 17
+    monkeypatch.delenv('TANDAU_NODE_ID')
+    assert 0 <= SnowflakeGenerator().node_id <= MAX_NODE
+
+def test_configure_and_new_id(monkeypatch):
+    monkeypatch.setattr(ids, 'generator', ids.generator)
+    ids.configure(9)
+    value = ids.new_id()
+    assert value.isdigit() and value[0] != '0'
+    assert fields(int(value))[1] == 9
+    # Новые id больше старых «миллисекундных» (time.time() * 1000)
+    assert int(value) > 1735689600000
@@ -0,0 +1,121 @@
+# Тесты message_log.py: проигрывание журнала после перезапуска, обрывки
+# строк, контрольные точки и откат хвоста при ошибке записи
+import json
+import os
+
+import pytest
+
+import message_log
+from message_log import MessageLog, replay
+
+@pytest.fixture
+def log_dir(tmp_path, monkeypatch):
+    # load() нового каталога импортирует старые JSON-файлы из текущего каталога
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path / 'log')
+
+def open_log(directory, **kwargs):
+    log = MessageLog(directory, fsync_policy='always', **kwargs)
+    log.load()
+    return log
+
+def add(log, text, msg_id, kind='messages', key=None):
+    commit = log.append(kind, key, {'user': 'a', 'message': text, 'id': str(msg_id)})
+    assert commit.wait(5)
+    return commit
+
+def texts(log, kind='messages', key=None):
+    return [m.text for m in log.conversation(kind, key)]
+
+def test_replay_after_restart(log_dir):
+    log = open_log(log_dir)
+    for i in range(1, 6):
+        add(log, f'm{i}', i)
+    add(log, 'p1', 6, 'private', 'a_b')
+    assert log.write({'op': 'delete', 'kind': 'messages', 'key': None, 'id': '2'}).wait(5)
+    log.close()
+
+    log = open_log(log_dir)
+    assert texts(log) == ['m1', 'm3', 'm4', 'm5']
+    assert texts(log, 'private', 'a_b') == ['p1']
+    log.close()
+
+def test_replay_skips_torn_last_line(log_dir):
+    log = open_log(log_dir)
+    add(log, 'whole', 1)
+    path = log.wal_path(log.generation)
+    log.close()
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"op": "add", "kind": "messages", "key": nu')
+
+    applied = []
+    assert replay(path, applied.append) == 1
+    log = open_log(log_dir)
+    assert texts(log) == ['whole']
+    log.close()
+
+def test_rotation_and_checkpoints_keep_everything(log_dir):
+    log = open_log(log_dir, checkpoint_every=3)
+    for i in range(1, 11):
+        add(log, f'm{i}', i)
+    log.close()
+    # Старые поколения журнала удаляются после контрольной точки
+    assert len(log.wal_generations()) <= 2
+
+    log = open_log(log_dir)
+    assert texts(log) == [f'm{i}' for i in range(1, 11)]
+    log.close()
+
+def test_failed_write_is_not_applied_and_tail_is_truncated(log_dir, monkeypatch):
+    log = open_log(log_dir)
+    add(log, 'before', 1)
+    path = log.wal_path(log.generation)
+    size = os.path.getsize(path)
+
+    real_fsync = os.fsync
+    def failing_fsync(fd):
+        raise OSError(5, 'Input/output error')
+    monkeypatch.setattr(message_log.os, 'fsync', failing_fsync)
+    commit = log.append('messages', None, {'user': 'a', 'message': 'lost', 'id': '2'})
+    assert commit.wait(5)
+    assert isinstance(commit.error, OSError)
+    # В состояние попадает только долговечное, недописанное из файла убрано
+    assert texts(log) == ['before']
+    assert os.path.getsize(path) == size
+
+    monkeypatch.setattr(message_log.os, 'fsync', real_fsync)
+    commit = add(log, 'after', 3)
+    assert commit.error is None
+    log.close()
+
+    with open(path, encoding='utf-8') as f:
+        assert [json.loads(line)['msg']['message'] for line in f] == ['before', 'after']
+    log = open_log(log_dir)
+    assert texts(log) == ['before', 'after']
+    log.close()
+
+def test_failed_truncate_moves_to_next_generation(log_dir, monkeypatch):
+    log = open_log(log_dir)
+    add(log, 'before', 1)
+    generation = log.generation
+
+    real_fsync = os.fsync
+    def failing_fsync(fd):
+        # Недописанная строка остаётся в файле: обрезать его тоже не удаётся
+        raise OSError(5, 'Input/output error')
+    def failing_truncate(path, size):
+        raise OSError(30, 'Read-only file system')
+    monkeypatch.setattr(message_log.os, 'fsync', failing_fsync)
+    monkeypatch.setattr(message_log.os, 'truncate', failing_truncate)
+    with open(log.wal_path(generation), 'a', encoding='utf-8') as f:
+        f.write('{"op": "add", "kind": "mess')
+    assert log.append('messages', None, {'user': 'a', 'message': 'lost', 'id': '2'}).wait(5)
+    assert log.generation == generation + 1
+
+    monkeypatch.setattr(message_log.os, 'fsync', real_fsync)
+    add(log, 'after', 3)
+    log.close()
+
+    log = open_log(log_dir)
+    assert texts(log) == ['before', 'after']
+    log.close()
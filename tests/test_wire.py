@@ -0,0 +1,86 @@
+# Тесты wire.py: текстовые кадры и bin1 туда и обратно, повреждённые кадры
+import pytest
+
+import wire
+from wire import ChatFrame, WireError, decode, encode, encode_binary, encode_text, parse, parse_text
+
+MSG = {'user': 'алия', 'message': 'привет, мир 👋', 'timestamp': '2026-10-17T12:00:00.123456',
+       'is_admin': False, 'id': '237271194498'}
+
+def round_trip(kind, target, data):
+    frame = encode_binary(kind, target, data)
+    assert frame[:1] == wire.MARK
+    return decode(frame)
+
+@pytest.mark.parametrize('kind, target', [('MSG', None), ('PRIVATE', 'бек'), ('CHANNEL', '42')])
+def test_binary_round_trip(kind, target):
+    assert round_trip(kind, target, MSG) == (kind, target, MSG)
+
+def test_binary_matches_text():
+    for kind, target in (('MSG', None), ('PRIVATE', 'b'), ('CHANNEL', 'c1')):
+        text = encode_text(kind, target, MSG)
+        assert parse(text.encode('utf-8')) == parse(encode(kind, target, MSG, True))
+
+@pytest.mark.parametrize('msg', [
+    # Поля, которых нет, не появляются после разбора
+    {},
+    {'message': ''},
+    {'user': 'a', 'is_admin': True},
+    # id не из ids.py — в extra как есть
+    {'user': 'a', 'id': 'uuid-1'},
+    {'user': 'a', 'id': '0123'},
+    {'user': 'a', 'id': str(1 << 64)},
+    {'user': 'a', 'id': 17},
+    # Прочие поля и нестроковые значения
+    {'user': 'a', 'message': None, 'image': 'chat_images/1.jpg', 'reply_to': '5'},
+    {'user': 'a', 'timestamp': 'x' * 300},
+])
+def test_record_edge_cases(msg):
+    assert round_trip('MSG', None, msg)[2] == msg
+
+def test_history_round_trip():
+    page = {'chat_type': 'private', 'target': 'b', 'messages': [MSG, dict(MSG, id='2')], 'more': True}
+    assert round_trip('HISTORY', 'b', page) == ('HISTORY', 'b', page)
+    empty = {'chat_type': 'public', 'target': None, 'messages': [], 'more': False}
+    assert round_trip('HISTORY', None, empty) == ('HISTORY', None, empty)
+
+def test_history_error_stays_text():
+    reply = {'chat_type': 'public', 'target': None, 'error': 'нет доступа'}
+    assert encode_binary('HISTORY', None, reply) is None
+    assert encode('HISTORY', None, reply, True) == encode_text('HISTORY', None, reply)
+
+def test_text_encoding():
+    assert encode('MSG', None, {'a': 'б'}, False) == 'MSG:{"a": "б"}'
+    assert encode('CHANNEL', '7', {}, False) == 'CHANNEL:7:MSG:{}'
+
+def test_parse_text():
+    assert parse_text('MSG:{"x": 1}') == ('MSG', None, {'x': 1})
+    assert parse_text('PRIVATE:b:{"m": "a:b"}') == ('PRIVATE', 'b', {'m': 'a:b'})
+    assert parse_text('CHANNEL:7:MSG:{"x": 1}') == ('CHANNEL', '7', {'x': 1})
+    assert parse_text('HISTORY:{"target": "b", "messages": []}')[:2] == ('HISTORY', 'b')
+    # Не сообщения
+    assert parse_text('CHANNEL:7:JOIN') is None
+    assert parse_text('PRESENCE:{}') is None
+    assert parse(b'FILE:x.jpg') is None
+
+@pytest.mark.parametrize('frame', [
+    wire.MARK,
+    wire.MARK + b'\x09',
+    encode_binary('MSG', None, MSG)[:-3],
+    encode_binary('PRIVATE', 'b', MSG)[:4],
+    encode_binary('HISTORY', None, {'chat_type': 'public', 'target': None, 'messages': [MSG], 'more': False})[:-1],
+])
+def test_corrupted_frames(frame):
+    with pytest.raises(WireError):
+        decode(frame)
+
+class Conn:
+    def __init__(self, binary):
+        self.binary = binary
+
+def test_chat_frame_encodes_once_per_encoding():
+    chat = ChatFrame('PRIVATE', 'b', MSG)
+    text, binary = chat.for_conn(Conn(False)), chat.for_conn(Conn(True))
+    assert chat.for_conn(Conn(False)) is text
+    assert chat.for_conn(Conn(True)) is binary
+    assert parse(bytes(text)[4:]) == parse(bytes(binary)[4:]) == ('PRIVATE', 'b', MSG)
@@ -0,0 +1,296 @@
+# uploads.py — приём файлов отдельным потоком, мимо обработки сообщений
+#
+# Файл загружается по отдельному соединению, чтобы 500 МБ видео не стояли
+# в одной очереди с сообщениями чата этого пользователя:
+#
+#   клиент → UPLOAD:<user>:<password>:<имя файла>:<размер>   (кадр)
+#   сервер → OK  или  FAIL:<причина>                          (кадр)
+#   клиент → <размер> байт тела без кадров
+#   сервер → DONE  или  FAIL:<причина>                        (кадр)
+#
+# Тело читается recv_into() в один переиспользуемый буфер и пишется во
+# временный *.part рядом с целевым файлом; по завершении *.part атомарно
+# переименовывается, так что недокачанный файл никогда не виден под своим именем.
+#
+# Если клиент знает SHA-256 файла, загрузка идёт через хранилище по хешу
+# (ContentStore) и может продолжаться после обрыва:
+#
+#   клиент → UPLOAD:<user>:<password>:<имя файла>:<размер>:<sha256>
+#   сервер → EXISTS               такой файл уже есть — тело не нужно вовсе
+#            OK:<upload_id>:<offset>   прислать тело начиная с offset
+#
+# upload_id — это sha256: недокачанный кусок лежит в media_store/partial/<sha256>.part
+# и переживает переподключение. Готовый объект хранится один раз в
+# media_store/<sha[:2]>/<sha256>, а в chat_images/ и т.д. под именем
+# из сообщения появляется жёсткая ссылка на него. Пока кусок дописывается,
+# partial/<sha256>.lock держит блокировку flock: второй загрузке того же файла —
+# из этого процесса или другого воркера кластера — сервер отвечает FAIL.
+import hashlib
+import os
+import shutil
+import socket
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from framing import FramedSocket
+
+MAX_UPLOAD_SIZE = 1024 * 1024 * 1024
+RECV_BUFFER = 1024 * 1024
+STORE_DIR = 'media_store'
+
+class UploadError(ValueError):
+    pass
+
+def parse_upload_info(info, max_size=MAX_UPLOAD_SIZE):
+    """Разбирает '<имя файла>:<размер>' и проверяет заявленный размер"""
+    filename, size_str = info.rsplit(':', 1)
+    filename = safe_filename(filename)
+    size = int(size_str)
+    if size < 0 or size > max_size:
+        raise UploadError(f'размер {size} вне лимита {max_size}')
+    return filename, size
+
+def parse_sha256(value):
+    value = value.lower()
+    if len(value) != 64 or any(c not in '0123456789abcdef' for c in value):
+        raise UploadError('неверный sha256')
+    return value
+
+def safe_filename(filename):
+    # Имя выбирает клиент — отрезаем любые каталоги, чтобы не выйти из папки медиа
+    filename = os.path.basename(filename.replace('\\', '/'))
+    if not filename or filename.startswith('.'):
+        raise UploadError('недопустимое имя файла')
+    return filename
+
+def open_part(path):
+    """Временный файл в той же папке — os.replace() тогда атомарен"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.part')
+    return os.fdopen(fd, 'wb'), tmp
+
+def finish_part(tmp, path, received, size):
+    if received != size:
+        os.remove(tmp)
+        raise UploadError(f'получено {received} из {size} байт')
+    os.replace(tmp, path)
+
+def receive_stream(sock, path, size, buffered=b''):
+    """Читает ровно size байт из сокета в файл через один переиспользуемый буфер"""
+    buffer = bytearray(min(RECV_BUFFER, max(size, 1)))
+    view = memoryview(buffer)
+    f, tmp = open_part(path)
+    try:
+        with f:
+            f.write(buffered[:size])
+            received = min(len(buffered), size)
+            while received < size:
+                n = sock.recv_into(view, min(len(buffer), size - received))
+                if not n:
+                    break
+                f.write(view[:n])
+                received += n
+    except BaseException:
+        os.remove(tmp)
+        raise
+    finish_part(tmp, path, received, size)
+
+class ContentStore:
+    """Файлы по SHA-256: каждый уникальный файл хранится один раз"""
+    def __init__(self, directory=STORE_DIR):
+        self.directory = directory
+
+    def object_path(self, sha):
+        return os.path.join(self.directory, sha[:2], sha)
+
+    def part_path(self, sha):
+        return os.path.join(self.directory, 'partial', sha + '.part')
+
+    def lock_path(self, sha):
+        return os.path.join(self.directory, 'partial', sha + '.lock')
+
+    def has(self, sha):
+        return os.path.exists(self.object_path(sha))
+
+    def open_upload(self, sha, size):
+        lock = self.acquire(sha)
+        try:
+            return ResumableUpload(self, sha, size, lock)
+        except BaseException:
+            self.release(lock)
+            raise
+
+    def acquire(self, sha):
+        """Блокировка загрузки sha между потоками и процессами, без ожидания.
+        Возвращает открытый файл блокировки; занято — UploadError."""
+        path = self.lock_path(sha)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        f = open(path, 'a+b')
+        try:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            # Файл удалили между open() и flock() — блокировка на нём ничего не значит
+            if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                raise OSError('файл блокировки заменён')
+        except OSError:
+            f.close()
+            raise UploadError('этот файл уже загружается')
+        return f
+
+    def release(self, lock):
+        # Файл удаляется ещё под блокировкой: открывший его раньше не пройдёт проверку st_ino
+        try:
+            os.remove(lock.name)
+        except OSError:
+            pass
+        lock.close()
+
+    def link(self, sha, dest):
+        """Делает dest именем объекта sha: жёсткая ссылка, а где нельзя — копия"""
+        obj = self.object_path(sha)
+        if os.path.exists(dest) and os.path.samefile(obj, dest):
+            return
+        tmp = f"{dest}.{sha[:8]}.link"
+        try:
+            os.link(obj, tmp)
+        except OSError:
+            shutil.copyfile(obj, tmp)
+        os.replace(tmp, dest)
+
+class ResumableUpload:
+    """Недокачанный файл media_store/partial/<sha>.part, дописывается с места обрыва"""
+    def __init__(self, store, sha, size, lock):
+        self.store = store
+        self.lock = lock
+        self.sha = sha
+        self.size = size
+        self.path = store.part_path(sha)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.hasher = hashlib.sha256()
+        self.offset = 0
+        if os.path.exists(self.path) and os.path.getsize(self.path) <= size:
+            # Продолжение: досчитываем хеш по уже принятой части
+            with open(self.path, 'rb') as f:
+                while True:
+                    chunk = f.read(RECV_BUFFER)
+                    if not chunk:
+                        break
+                    self.hasher.update(chunk)
+                    self.offset += len(chunk)
+            self.file = open(self.path, 'ab')
+        else:
+            self.file = open(self.path, 'wb')
+
+    @property
+    def remaining(self):
+        return self.size - self.offset
+
+    def write(self, chunk):
+        if len(chunk) > self.remaining:
+            raise UploadError('клиент прислал больше заявленного размера')
+        self.file.write(chunk)
+        self.hasher.update(chunk)
+        self.offset += len(chunk)
+
+    def finish(self):
+        """Проверяет размер и хеш и переносит файл в хранилище"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        if self.offset != self.size:
+            # Кусок остаётся на диске — клиент продолжит после переподключения
+            raise UploadError(f'получено {self.offset} из {self.size} байт, можно продолжить')
+        if self.hasher.hexdigest() != self.sha:
+            os.remove(self.path)
+            raise UploadError('sha256 не совпал, загрузка сброшена')
+        obj = self.store.object_path(self.sha)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        os.replace(self.path, obj)
+
+    def close(self):
+        self.file.close()
+        self.store.release(self.lock)
+
+def receive_resumable(sock, upload, buffered=b''):
+    """Дочитывает тело загрузки с upload.offset через переиспользуемый буфер"""
+    if buffered:
+        upload.write(buffered)
+    buffer = bytearray(RECV_BUFFER)
+    view = memoryview(buffer)
+    while upload.remaining:
+        n = sock.recv_into(view, min(len(buffer), upload.remaining))
+        if not n:
+            break
+        upload.write(view[:n])
+    upload.finish()
+
+def file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(RECV_BUFFER)
+            if not chunk:
+                return hasher.hexdigest()
+            hasher.update(chunk)
+
+def receive_frames(conn, path, size):
+    """Старый путь FILE: по соединению чата — тело идёт кадрами"""
+    f, tmp = open_part(path)
+    try:
+        with f:
+            received = 0
+            while received < size:
+                chunk = conn.recv_frame()
+                if chunk is None:
+                    break
+                if received + len(chunk) > size:
+                    raise UploadError('клиент прислал больше заявленного размера')
+                f.write(chunk)
+                received += len(chunk)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    finish_part(tmp, path, received, size)
+
+def skip_frames(conn, size):
+    """Дочитывает тело FILE: не сохраняя — когда файл отклонён, а клиент уже шлёт"""
+    received = 0
+    while received < size:
+        chunk = conn.recv_frame()
+        if chunk is None:
+            break
+        received += len(chunk)
+
+def send_upload(host, port, username, password, path, filename=None, sha=None):
+    """Клиентская сторона: отдельное соединение и sendfile() без копирования через Python.
+    Повторный вызов после обрыва продолжает с того места, где сервер остановился.
+    Возвращает число отправленных байт тела (0 — сервер уже знал этот файл)."""
+    filename = filename or os.path.basename(path)
+    size = os.path.getsize(path)
+    sha = sha or file_sha256(path)
+    conn = FramedSocket(socket.create_connection((host, port)))
+    try:
+        conn.recv_frame()  # LOGIN
+        conn.send(f"UPLOAD:{username}:{password}:{filename}:{size}:{sha}")
+        reply = (conn.recv_frame() or b'').decode('utf-8')
+        if reply == 'EXISTS':
+            return 0
+        if not reply.startswith('OK:'):
+            raise UploadError(reply)
+        offset = int(reply.rsplit(':', 1)[1])
+        if offset < size:
+            # offset == size — тело уже у сервера целиком, ждём только DONE
+            with open(path, 'rb') as f:
+                conn.sock.sendfile(f, offset=offset)
+        reply = conn.recv_frame()
+        if reply != b'DONE':
+            raise UploadError((reply or b'').decode('utf-8'))
+        return size - offset
+    finally:
+        conn.close()
@@ -2,7 +2,7 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse
 from datetime import datetime
 import json
-import uuid
+from ids import new_id
 from typing import Dict, List
 import uvicorn
 
@@ -25,7 +25,7 @@ class ConnectionManager:
         # Уведомляем о новом пользователе
         system_msg = {
             "type": "system",
-            "id": str(uuid.uuid4()),
+            "id": new_id(),
             "content": f"🟢 {username} присоединился к чату",
             "timestamp": datetime.now().isoformat()
         }
@@ -56,7 +56,7 @@ class ConnectionManager:
     async def send_message(self, message_data: dict):
         message = {
             "type": "message",
-            "id": str(uuid.uuid4()),
+            "id": new_id(),
             "username": message_data["username"],
             "content": message_data["content"],
             "timestamp": datetime.now().isoformat()
@@ -0,0 +1,219 @@
+# wire.py — кадры сообщений чата: текст (JSON) и двоичная кодировка bin1
+#
+# Текстовые кадры — как всегда: MSG:{json}, PRIVATE:<кто>:{json},
+# CHANNEL:<id>:MSG:{json}, HISTORY:{json}. Клиент, согласившийся на bin1
+# (приглашение LOGIN:...,bin1 → кадр ENCODING:bin1 до входа, см. server.negotiate),
+# получает эти четыре вида кадров в двоичном виде — без json.loads на каждое
+# сообщение. Остальные кадры (PRESENCE:, FILE:, ошибки HISTORY:) остаются текстом,
+# поэтому клиент различает кадры по первому байту: MARK — bin1, иначе текст.
+#
+# Кадр bin1: MARK, вид (KINDS), затем
+#   MSG      запись
+#   PRIVATE  str16 кто, запись
+#   CHANNEL  str16 id канала, запись
+#   HISTORY  str8 chat_type, флаг target (1 — есть), str16 target, флаг more, u32 N, N записей
+# Запись — фиксированный заголовок RECORD и одно UTF-8 тело:
+#   id (u64), флаги, длины в символах: timestamp, user, message, extra; размер тела в байтах
+#   тело: user + message + timestamp + extra (JSON прочих полей: image, reply_to, ...)
+# Длины в символах позволяют декодировать тело одним .decode() и резать срезами.
+import json
+import struct
+
+from compression import offered
+from framing import shared_frame
+
+CODEC = 'bin1'
+REQUEST = f"ENCODING:{CODEC}".encode('ascii')
+# 0x00 — сжатый кадр (compression.MARK), текстовые начинаются с латинской буквы
+MARK = b'\x01'
+
+KINDS = {'MSG': 1, 'PRIVATE': 2, 'CHANNEL': 3, 'HISTORY': 4}
+KIND_NAMES = {code: name for name, code in KINDS.items()}
+
+HEAD = struct.Struct('!cB')
+STR8 = struct.Struct('!B')
+STR16 = struct.Struct('!H')
+FLAG = struct.Struct('!B')
+COUNT = struct.Struct('!I')
+RECORD = struct.Struct('!QBBHIII')
+
+HAS_ID = 1
+HAS_USER = 2
+HAS_MESSAGE = 4
+HAS_TIMESTAMP = 8
+HAS_ADMIN = 16
+IS_ADMIN = 32
+
+class WireError(ValueError):
+    pass
+
+def to_json(obj):
+    """JSON для провода: кириллица как есть (2 байта UTF-8 на букву), а не \\uXXXX (6 байт)"""
+    return json.dumps(obj, ensure_ascii=False)
+
+def encode_text(kind, target, data):
+    if kind == 'MSG':
+        return f"MSG:{to_json(data)}"
+    if kind == 'PRIVATE':
+        return f"PRIVATE:{target}:{to_json(data)}"
+    if kind == 'CHANNEL':
+        return f"CHANNEL:{target}:MSG:{to_json(data)}"
+    return f"{kind}:{to_json(data)}"
+
+def encode_str(fmt, text):
+    raw = text.encode('utf-8')
+    return fmt.pack(len(raw)) + raw
+
+def encode_record(msg):
+    rest = dict(msg)
+    flags = 0
+    msg_id = rest.get('id')
+    # id из ids.py — число в строке; всё остальное (uuid, старые id) уходит в extra как есть
+    if (isinstance(msg_id, str) and msg_id.isascii() and msg_id.isdigit()
+            and msg_id[0] != '0' and int(msg_id) < 1 << 64):
+        flags |= HAS_ID
+        del rest['id']
+    else:
+        msg_id = 0
+    fields = []
+    for key, flag in (('user', HAS_USER), ('message', HAS_MESSAGE), ('timestamp', HAS_TIMESTAMP)):
+        value = rest.get(key)
+        if isinstance(value, str) and len(value) < (256 if key == 'timestamp' else 65536):
+            flags |= flag
+            del rest[key]
+        else:
+            value = ''
+        fields.append(value)
+    if isinstance(rest.get('is_admin'), bool):
+        flags |= HAS_ADMIN | (IS_ADMIN if rest.pop('is_admin') else 0)
+    user, text, timestamp = fields
+    extra = to_json(rest) if rest else ''
+    body = f"{user}{text}{timestamp}{extra}".encode('utf-8')
+    return RECORD.pack(int(msg_id), flags, len(timestamp), len(user), len(text), len(extra), len(body)) + body
+
+def encode_binary(kind, target, data):
+    """Кадр bin1 или None, если данные в него не укладываются (тогда — текст)"""
+    head = HEAD.pack(MARK, KINDS[kind])
+    if kind == 'MSG':
+        return head + encode_record(data)
+    if kind in ('PRIVATE', 'CHANNEL'):
+        return head + encode_str(STR16, target) + encode_record(data)
+    chat, target = data.get('chat_type'), data.get('target')
+    if 'error' in data or not isinstance(chat, str) or not isinstance(target, (str, type(None))):
+        return None
+    parts = [head, encode_str(STR8, chat), FLAG.pack(target is not None), encode_str(STR16, target or ''),
+             FLAG.pack(bool(data.get('more'))), COUNT.pack(len(data['messages']))]
+    parts.extend(encode_record(m) for m in data['messages'])
+    return b''.join(parts)
+
+def encode(kind, target, data, binary):
+    """Тело кадра для соединения: bin1, если клиент согласился, иначе текст"""
+    if binary:
+        frame = encode_binary(kind, target, data)
+        if frame is not None:
+            return frame
+    return encode_text(kind, target, data)
+
+def take(buf, pos, size):
+    """Срез тела; обрезанный кадр — ошибка, а не укороченные поля"""
+    if pos + size > len(buf):
+        raise WireError(f"Обрезанный кадр {CODEC}: нужно {pos + size} байт, есть {len(buf)}")
+    return str(buf[pos:pos + size], 'utf-8')
+
+def decode_str(fmt, buf, pos):
+    (size,) = fmt.unpack_from(buf, pos)
+    pos += fmt.size
+    return take(buf, pos, size), pos + size
+
+def decode_record(buf, pos):
+    msg_id, flags, ts_len, user_len, text_len, extra_len, size = RECORD.unpack_from(buf, pos)
+    pos += RECORD.size
+    body = take(buf, pos, size)
+    a = user_len
+    b = a + text_len
+    c = b + ts_len
+    msg = {}
+    if flags & HAS_USER:
+        msg['user'] = body[:a]
+    if flags & HAS_MESSAGE:
+        msg['message'] = body[a:b]
+    if flags & HAS_TIMESTAMP:
+        msg['timestamp'] = body[b:c]
+    if flags & HAS_ADMIN:
+        msg['is_admin'] = bool(flags & IS_ADMIN)
+    if flags & HAS_ID:
+        msg['id'] = str(msg_id)
+    if extra_len:
+        msg.update(json.loads(body[c:c + extra_len]))
+    return msg, pos + size
+
+def decode(frame):
+    """Кадр bin1 → (вид, target, данные), как parse_text для текстового"""
+    try:
+        _, code = HEAD.unpack_from(frame, 0)
+        kind = KIND_NAMES[code]
+        pos = HEAD.size
+        if kind == 'MSG':
+            return kind, None, decode_record(frame, pos)[0]
+        if kind in ('PRIVATE', 'CHANNEL'):
+            target, pos = decode_str(STR16, frame, pos)
+            return kind, target, decode_record(frame, pos)[0]
+        chat, pos = decode_str(STR8, frame, pos)
+        (has_target,) = FLAG.unpack_from(frame, pos)
+        target, pos = decode_str(STR16, frame, pos + FLAG.size)
+        (more,) = FLAG.unpack_from(frame, pos)
+        (count,) = COUNT.unpack_from(frame, pos + FLAG.size)
+        pos += FLAG.size + COUNT.size
+        messages = []
+        for _ in range(count):
+            msg, pos = decode_record(frame, pos)
+            messages.append(msg)
+        target = target if has_target else None
+        return kind, target, {'chat_type': chat, 'target': target, 'messages': messages, 'more': bool(more)}
+    except (struct.error, KeyError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise WireError(f"Повреждённый кадр {CODEC}: {e}") from None
+
+def parse_text(text):
+    """Текстовый кадр сообщения → (вид, target, данные); None — кадр не про сообщения"""
+    if text.startswith('MSG:'):
+        return 'MSG', None, json.loads(text[4:])
+    if text.startswith('PRIVATE:'):
+        target, body = text[8:].split(':', 1)
+        return 'PRIVATE', target, json.loads(body)
+    if text.startswith('CHANNEL:'):
+        parts = text[8:].split(':', 2)
+        if len(parts) == 3 and parts[1] == 'MSG':
+            return 'CHANNEL', parts[0], json.loads(parts[2])
+        return None
+    if text.startswith('HISTORY:'):
+        data = json.loads(text[8:])
+        return 'HISTORY', data.get('target'), data
+    return None
+
+def parse(frame):
+    """Любой принятый кадр → (вид, target, данные) или None для прочих кадров"""
+    if frame[:1] == MARK:
+        return decode(frame)
+    return parse_text(frame.decode('utf-8'))
+
+class ChatFrame:
+    """Общий кадр рассылки сообщения: каждая кодировка собирается один раз
+    и только когда нашёлся получатель, которому она нужна"""
+    def __init__(self, kind, target, msg):
+        self.kind = kind
+        self.target = target
+        self.msg = msg
+        self.frames = {}
+
+    def for_conn(self, conn):
+        frame = self.frames.get(conn.binary)
+        if frame is None:
+            frame = self.frames[conn.binary] = shared_frame(encode(self.kind, self.target, self.msg, conn.binary))
+        return frame
+
+def accept(conn, welcome):
+    """Клиентская сторона: соглашается на bin1, если сервер его предлагает"""
+    if CODEC.encode('ascii') in offered(welcome):
+        conn.send(REQUEST)
+        return True
+    return False